@@ -0,0 +1,326 @@
+"""
+Voice-path throughput benchmark.
+
+Replays a synthetic storm of ``on_voice_state_update`` events across many guilds through
+``play_intro_if_available`` and the real per-guild scheduler, connection manager, intro index
+and validation cache. Discord objects are replaced by in-process stand-ins: connecting takes a
+configurable handshake delay and playback ends after a configurable clip length (or the length of
+a merged join-burst sequence), so no gateway, network or ffmpeg is needed.
+
+Usage (from the repository root):
+
+    python -m benchmarks.voice_storm --guilds 200 --members 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, cast
+
+os.environ.setdefault("DISCORD_BOT_TOKEN", "benchmark")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import discord  # noqa: E402
+
+import services.voice_handler as voice_handler  # noqa: E402
+from utils.audio_meta import audio_meta_store  # noqa: E402
+from utils.config import INTRO_BATCH_WINDOW_SECONDS  # noqa: E402
+from utils.intro_index import IntroEntry, _Ref, intro_index  # noqa: E402
+from utils.opus_cache import FRAME_SECONDS  # noqa: E402
+
+
+@dataclass
+class Recorder:
+    enqueued_at: dict[tuple[int, int], float] = field(default_factory=dict)
+    first_event_at: dict[int, float] = field(default_factory=dict)
+    first_audio_at: dict[int, float] = field(default_factory=dict)
+    queue_waits: list[float] = field(default_factory=list)
+    handshakes: int = 0
+    plays: int = 0
+
+
+class StubAudioSource(discord.AudioSource):
+    def read(self) -> bytes:
+        return b""
+
+    def is_opus(self) -> bool:
+        return True
+
+
+class FakeVoiceClient:
+    def __init__(self, guild: "FakeGuild", channel: "FakeVoiceChannel", clip_seconds: float, recorder: Recorder) -> None:
+        self.guild = guild
+        self.channel = channel
+        self.clip_seconds = clip_seconds
+        self.recorder = recorder
+        self._connected = True
+        self._playing: asyncio.TimerHandle | None = None
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def is_playing(self) -> bool:
+        return self._playing is not None
+
+    def play(self, source: discord.AudioSource, *, after: Callable[[Exception | None], Any] | None = None) -> None:
+        if self._playing is not None:
+            raise discord.ClientException("Already playing audio.")
+        now = time.perf_counter()
+        self.recorder.plays += 1
+        self.recorder.first_audio_at.setdefault(self.guild.id, now)
+        # Le sequenze di intro durano quanto i loro frame; le sorgenti stub quanto una clip
+        frames = 0
+        while source.read():
+            frames += 1
+        seconds = frames * FRAME_SECONDS if frames else self.clip_seconds
+
+        def finished() -> None:
+            self._playing = None
+            if after is not None:
+                after(None)
+
+        self._playing = asyncio.get_running_loop().call_later(seconds, finished)
+
+    def stop(self) -> None:
+        if self._playing is not None:
+            self._playing.cancel()
+            self._playing = None
+
+    async def move_to(self, channel: "FakeVoiceChannel") -> None:
+        self.channel = channel
+
+    async def disconnect(self) -> None:
+        self.stop()
+        self._connected = False
+        self.guild.voice_client = None
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild: "FakeGuild", channel_id: int, handshake_seconds: float, clip_seconds: float, recorder: Recorder) -> None:
+        self.guild = guild
+        self.id = channel_id
+        self.handshake_seconds = handshake_seconds
+        self.clip_seconds = clip_seconds
+        self.recorder = recorder
+
+    async def connect(self, *, reconnect: bool = True) -> FakeVoiceClient:
+        await asyncio.sleep(self.handshake_seconds)
+        self.recorder.handshakes += 1
+        vc = FakeVoiceClient(self.guild, self, self.clip_seconds, self.recorder)
+        self.guild.voice_client = vc
+        return vc
+
+    def __str__(self) -> str:
+        return f"voice-{self.id}"
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int) -> None:
+        self.id = guild_id
+        self.shard_id = 0
+        self.voice_client: FakeVoiceClient | None = None
+        self.members: dict[int, "FakeMember"] = {}
+
+    def get_member(self, member_id: int) -> "FakeMember | None":
+        return self.members.get(member_id)
+
+
+@dataclass
+class FakeVoiceState:
+    channel: FakeVoiceChannel | None
+
+
+class FakeMember:
+    def __init__(self, guild: FakeGuild, member_id: int) -> None:
+        self.guild = guild
+        self.id = member_id
+        self.name = f"member-{member_id}"
+        self.bot = False
+        self.voice: FakeVoiceState | None = None
+
+
+async def measure_loop_lag(samples: list[float], stop: asyncio.Event, interval: float = 0.01) -> None:
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - started - interval))
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def build_storm(args: argparse.Namespace, recorder: Recorder) -> list[tuple[FakeMember, FakeVoiceState, FakeVoiceState]]:
+    # Per ogni membro: ingresso in un canale, spostamenti, toggle mute/deafen (stesso canale) e uscite
+    rng = random.Random(args.seed)
+    events: list[tuple[FakeMember, FakeVoiceState, FakeVoiceState]] = []
+    for g in range(args.guilds):
+        guild = FakeGuild(10_000 + g)
+        channels = [FakeVoiceChannel(guild, guild.id * 10 + c, args.handshake, args.clip, recorder) for c in range(args.channels)]
+        for m in range(args.members):
+            member = FakeMember(guild, guild.id * 1_000 + m)
+            guild.members[member.id] = member
+            current: FakeVoiceChannel | None = None
+            for _ in range(args.events_per_member):
+                roll = rng.random()
+                target: FakeVoiceChannel | None
+                if current is None or roll < args.hop_ratio:
+                    target = rng.choice(channels)
+                elif roll < args.hop_ratio + args.toggle_ratio:
+                    target = current
+                else:
+                    target = None
+                events.append((member, FakeVoiceState(current), FakeVoiceState(target)))
+                current = target
+    rng.shuffle(events)
+    return events
+
+
+async def run(args: argparse.Namespace) -> dict[str, float]:
+    # La directory di lavoro viene rimossa anche se il benchmark fallisce
+    with tempfile.TemporaryDirectory(prefix="introbot-bench-") as workdir:
+        try:
+            return await run_storm(args, workdir)
+        finally:
+            # Nessuna scrittura in background deve arrivare dopo la rimozione della directory
+            await audio_meta_store.flush()
+            await intro_index.flush()
+
+
+async def run_storm(args: argparse.Namespace, workdir: str) -> dict[str, float]:
+    recorder = Recorder()
+    events = build_storm(args, recorder)
+
+    # Indice intro e cache di validazione reali, popolati come dopo l'upload: nessun ffprobe nel percorso caldo
+    intro_file = os.path.join(workdir, "intro.mp3")
+    with open(intro_file, "wb") as f:
+        f.write(b"\0" * 1024)
+    st = os.stat(intro_file)
+    audio_meta_store.index_path = audio_meta_store._writer.path = os.path.join(workdir, "audio_meta.json")
+    audio_meta_store.record(intro_file, st, args.clip)
+    # Tutti i membri referenziano lo stesso blob, come una clip condivisa nello storage per contenuto
+    intro_index.root = workdir
+    intro_index.blob_dir = workdir
+    intro_index.refs_path = intro_index._writer.path = os.path.join(workdir, "intro_refs.json")
+    intro_index._blobs["intro"] = st
+    for member, _, _ in events:
+        intro_index._refs[(member.guild.id, member.id)] = _Ref("intro", 0.0)
+
+    original_enqueue = voice_handler.enqueue_intro
+
+    def recording_enqueue(member: discord.Member, priority: int = voice_handler.PRIORITY_JOIN) -> voice_handler.PlayRequest | None:
+        recorder.enqueued_at.setdefault((member.guild.id, member.id), time.perf_counter())
+        return original_enqueue(member, priority)
+
+    original_start = voice_handler.start_playback
+
+    def recording_start(vc: discord.VoiceClient, source: discord.AudioSource) -> asyncio.Event:
+        scheduler = voice_handler.find_scheduler(vc.guild)
+        if scheduler is not None and scheduler.current is not None:
+            for request in scheduler.batch or [scheduler.current]:
+                enqueued = recorder.enqueued_at.pop((vc.guild.id, request.member_id), None)
+                if enqueued is not None:
+                    recorder.queue_waits.append(time.perf_counter() - enqueued)
+        return original_start(vc, source)
+
+    async def stub_source(user_id: int, guild_id: int, entry: IntroEntry) -> discord.AudioSource:
+        return StubAudioSource()
+
+    clip_frames: tuple[bytes, ...] = (b"\xf8",) * max(1, round(args.clip / FRAME_SECONDS))
+
+    async def stub_frames(user_id: int, guild_id: int, entry: IntroEntry) -> tuple[bytes, ...] | None:
+        return clip_frames
+
+    voice_handler.enqueue_intro = recording_enqueue
+    voice_handler.start_playback = recording_start
+    voice_handler.create_intro_source = stub_source
+    voice_handler.intro_frames = stub_frames
+    original_get_scheduler = voice_handler.get_scheduler
+
+    def windowed_get_scheduler(guild: discord.Guild) -> voice_handler.GuildScheduler:
+        scheduler = original_get_scheduler(guild)
+        scheduler.batch_window = args.join_window
+        return scheduler
+
+    voice_handler.get_scheduler = windowed_get_scheduler
+
+    lag_samples: list[float] = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(lag_samples, stop))
+
+    started = time.perf_counter()
+    pending: list[asyncio.Task[None]] = []
+    for member, before, after in events:
+        member.voice = after
+        recorder.first_event_at.setdefault(member.guild.id, time.perf_counter())
+        # Come il dispatcher di discord.py: ogni evento è un task separato
+        coro = voice_handler.play_intro_if_available(cast(discord.Member, member), cast(discord.VoiceState, before), cast(discord.VoiceState, after))
+        pending.append(asyncio.create_task(coro))
+        if len(pending) >= args.batch:
+            await asyncio.gather(*pending)
+            pending.clear()
+    await asyncio.gather(*pending)
+    dispatch_seconds = time.perf_counter() - started
+
+    while any(len(s) or s.current is not None for s in voice_handler.all_schedulers()):
+        await asyncio.sleep(0.01)
+    total_seconds = time.perf_counter() - started
+
+    stop.set()
+    await lag_task
+
+    first_audio = [recorder.first_audio_at[g] - recorder.first_event_at[g] for g in recorder.first_audio_at]
+    return {
+        "events": float(len(events)),
+        "events_per_second": len(events) / dispatch_seconds if dispatch_seconds else 0.0,
+        "plays": float(recorder.plays),
+        "intros_started": float(len(recorder.queue_waits)),
+        "handshakes": float(recorder.handshakes),
+        "queue_wait_p50_ms": percentile(recorder.queue_waits, 50) * 1000,
+        "queue_wait_p99_ms": percentile(recorder.queue_waits, 99) * 1000,
+        "time_to_first_audio_p50_ms": percentile(first_audio, 50) * 1000,
+        "time_to_first_audio_p99_ms": percentile(first_audio, 99) * 1000,
+        "loop_lag_mean_ms": statistics.fmean(lag_samples) * 1000 if lag_samples else 0.0,
+        "loop_lag_max_ms": max(lag_samples, default=0.0) * 1000,
+        "total_seconds": total_seconds,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark del percorso vocale con un layer Discord simulato")
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--members", type=int, default=10, help="membri per guild")
+    parser.add_argument("--channels", type=int, default=3, help="canali vocali per guild")
+    parser.add_argument("--events-per-member", type=int, default=4)
+    parser.add_argument("--hop-ratio", type=float, default=0.3, help="quota di eventi che cambiano canale")
+    parser.add_argument("--toggle-ratio", type=float, default=0.5, help="quota di eventi mute/deafen (stesso canale)")
+    parser.add_argument("--handshake", type=float, default=0.2, help="durata simulata della connessione vocale (s)")
+    parser.add_argument("--clip", type=float, default=0.3, help="durata simulata di ogni intro (s)")
+    parser.add_argument("--join-window", type=float, default=INTRO_BATCH_WINDOW_SECONDS, help="finestra di raggruppamento degli ingressi (s), 0 = una intro alla volta")
+    parser.add_argument("--batch", type=int, default=500, help="eventi dispatchati prima di cedere il loop")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="stampa il report in JSON")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key:>28}: {value:,.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
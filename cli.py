@@ -0,0 +1,85 @@
+"""
+Command-line tools for intro archives.
+
+Exports a guild's intros to a tar archive (a ``manifest.json`` with durations, hashes and volumes,
+followed by one ``blobs/<sha256>.mp3`` per distinct clip) and imports such an archive into a guild,
+validating and pre-transcoding every intro so the caches are hot before members join. The same
+archive format is used by ``/intro-export`` and ``/intro-import``.
+
+Run it while the bot is stopped: a running bot keeps the intro index in memory and would overwrite
+the imported references on its next save, and startup cleanup would delete its in-flight staging
+files. Both take a lock on ``DATA_DIR``, so the tool refuses to start while the bot is running;
+use the slash commands on a running bot instead. No Discord token is needed. With ``workers.py``
+point ``DATA_DIR`` at the directory of the worker that owns the guild (``data/shard-<a>-<b>-of-<n>``).
+
+Usage (from the repository root):
+
+    python cli.py export --guild 123456789012345678 --output intros.tar
+    python cli.py import --guild 123456789012345678 intros.tar [--overwrite]
+"""
+
+import argparse
+import asyncio
+import sys
+
+from utils.audio_meta import audio_meta_store
+from utils.config import DATA_DIR, init_runtime, owns_guild
+from utils.data_lock import data_dir_lock, managed_by_workers
+from utils.intro_archive import export_guild, import_guild
+from utils.intro_index import intro_index
+from utils.settings_store import settings_store
+
+
+async def run(args: argparse.Namespace) -> int:
+    try:
+        return await run_command(args)
+    finally:
+        # Le scritture di indice, metadati e impostazioni avvengono in background: vanno completate prima dell'uscita
+        await intro_index.flush()
+        await audio_meta_store.flush()
+        await settings_store.flush()
+
+
+async def run_command(args: argparse.Namespace) -> int:
+    await asyncio.to_thread(intro_index.cleanup_orphans)
+    await asyncio.to_thread(intro_index.scan)
+    if args.command == "export":
+        count = await export_guild(args.guild, args.output)
+        if count is None:
+            return 1
+        print(f"{count} intro esportate in {args.output}")
+        return 0
+    report = await import_guild(args.archive, args.guild, args.overwrite)
+    if report is None:
+        return 1
+    print(f"Importate {report.imported} intro ({report.warmed} pronte per la riproduzione). Già presenti: {report.skipped}, non valide: {report.invalid}.")
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Esportazione e importazione delle intro di un server")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="esporta le intro di un server in un archivio .tar")
+    export.add_argument("--guild", type=int, required=True, help="id del server")
+    export.add_argument("--output", required=True, help="percorso dell'archivio da creare")
+    imp = commands.add_parser("import", help="importa un archivio .tar in un server")
+    imp.add_argument("--guild", type=int, required=True, help="id del server di destinazione")
+    imp.add_argument("--overwrite", action="store_true", help="sostituisci le intro già presenti dei membri")
+    imp.add_argument("archive", help="archivio creato con export o /intro-export")
+    args = parser.parse_args(argv)
+
+    init_runtime()
+    if managed_by_workers():
+        print(f"{DATA_DIR} è gestita da workers.py: imposta DATA_DIR sulla directory del worker che gestisce il server.", file=sys.stderr)
+        return 1
+    if not owns_guild(args.guild):
+        print(f"Il server {args.guild} è gestito da un altro worker: imposta DATA_DIR sulla sua directory.", file=sys.stderr)
+        return 1
+    if not data_dir_lock.acquire():
+        print(f"{DATA_DIR} è in uso da un altro processo (il bot è in esecuzione?): usa /intro-export o /intro-import.", file=sys.stderr)
+        return 1
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
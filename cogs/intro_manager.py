@@ -1,26 +1,93 @@
-import asyncio
+import math
 import os
+import time
 from datetime import datetime
-from typing import cast
+from typing import Any, cast
 
 import discord
 from discord import app_commands
 from discord.ext import commands
 
-from utils.checks import is_guild_context
-from utils.config import FFMPEG_PATH, INTRO_MAX_SECONDS
-from utils.file_utils import delete_intro_file, download_audio_clip, get_intro_path, save_intro_file, validate_audio_file, validate_time_format
+from services.voice_handler import PRIORITY_MANUAL, cancel_intro, enqueue_intro, get_scheduler, scheduler_status
+from utils.admission import Admission, ingest_admission
+from utils.checks import is_admin, is_guild_context
+from utils.config import IMPORT_MAX_ARCHIVE_BYTES, INTRO_MAX_SECONDS, INTRO_MAX_UPLOAD_BYTES
+from utils.file_utils import delete_intro_file, download_audio_clip, is_valid_youtube_url, publish_uploaded_intro, save_intro_file, set_guild_ceiling, set_intro_volume, validate_time_format
+from utils.intro_archive import archive_tmp_path, download_archive, export_guild, import_guild
+from utils.intro_index import intro_index
+from utils.opus_cache import opus_frame_cache
+from utils.watchdog import handler_stats, loop_watchdog, record_handler
+
+SUPERSEDED_MESSAGE = "⏹️ Richiesta annullata: sostituita dalla tua richiesta più recente."
 
 
 class IntroManager(commands.Cog):
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
 
+    # --- Strumentazione: durata di ogni comando, dal check iniziale al completamento o all'errore ---
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras["started"] = time.perf_counter()
+        return True
+
+    def _record_command(self, interaction: discord.Interaction) -> None:
+        started = interaction.extras.pop("started", None)
+        if started is not None and interaction.command is not None:
+            record_handler(f"/{interaction.command.name}", time.perf_counter() - started)
+
+    @commands.Cog.listener()
+    async def on_app_command_completion(self, interaction: discord.Interaction, command: app_commands.Command[Any, ..., Any] | app_commands.ContextMenu) -> None:
+        self._record_command(interaction)
+
+    async def cog_app_command_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError) -> None:
+        self._record_command(interaction)
+
+    # --- Controllo di ammissione per i comandi di ingestione ---
+
+    async def _acknowledge(self, interaction: discord.Interaction, admission: Admission) -> bool:
+        # Risposta immediata: rifiuto con l'attesa prevista, avviso di coda o di sostituzione, altrimenti "sta pensando"
+        if not admission.allowed:
+            who = "da parte tua" if admission.scope == "user" else "in questo server"
+            await interaction.response.send_message(f"⏳ Troppe richieste {who}: riprova tra {math.ceil(admission.retry_after)}s.", ephemeral=True)
+            return False
+        notes = []
+        if admission.supersedes:
+            notes.append("la richiesta precedente è stata annullata")
+        if admission.expected_wait > 0:
+            notes.append(f"in coda, attesa stimata ~{math.ceil(admission.expected_wait)}s")
+        if notes:
+            text = "; ".join(notes)
+            await interaction.response.send_message(f"⏳ {text[0].upper()}{text[1:]}.", ephemeral=True)
+        else:
+            await interaction.response.defer(thinking=True, ephemeral=True)
+        return True
+
     @app_commands.command(name="intro_set_volume", description="Imposta il volume di riproduzione della tua intro (0.0 a 1.0)")
     @app_commands.describe(volume="Il livello del volume (es. 0.5 per metà volume)")
     @is_guild_context()
-    async def set_volume(self, interaction: discord.Interaction, volume: float) -> None:
-        await interaction.response.send_message("⚠️ Funzione non ancora implementata.", ephemeral=True)
+    async def set_volume(self, interaction: discord.Interaction, volume: app_commands.Range[float, 0.0, 1.0]) -> None:
+        assert interaction.guild_id is not None
+        # Il guadagno viene applicato ricodificando la copia opus: può richiedere qualche secondo
+        await interaction.response.defer(thinking=True, ephemeral=True)
+        if await set_intro_volume(interaction.user.id, interaction.guild_id, round(volume, 2)):
+            await interaction.followup.send(f"🔊 Volume dell'intro impostato a {round(volume, 2):.2f}.")
+        else:
+            await interaction.followup.send("❌ Volume salvato, ma la preparazione dell'audio è fallita. Verrà ritentata alla prossima riproduzione.")
+
+    @app_commands.command(name="intro-ceiling", description="[Admin] Imposta il tetto di loudness delle intro del server")
+    @app_commands.describe(ceiling_db="Picco massimo in dBFS (da -24 a 0); lascia vuoto per rimuovere il tetto")
+    @is_guild_context()
+    @is_admin()
+    async def set_ceiling(self, interaction: discord.Interaction, ceiling_db: app_commands.Range[float, -24.0, 0.0] | None = None) -> None:
+        assert interaction.guild_id is not None
+        await interaction.response.defer(thinking=True, ephemeral=True)
+        ceiling = round(ceiling_db, 1) if ceiling_db is not None else None
+        ready = await set_guild_ceiling(interaction.guild_id, ceiling)
+        if ceiling is None:
+            await interaction.followup.send(f"🔊 Tetto di loudness rimosso ({ready} intro aggiornate).")
+        else:
+            await interaction.followup.send(f"🔊 Tetto di loudness impostato a {ceiling:.1f} dBFS ({ready} intro aggiornate).")
 
     @app_commands.command(name="intro-upload", description="Carica o sovrascrivi il tuo file intro (.mp3)")
     @is_guild_context()
@@ -28,35 +95,47 @@ class IntroManager(commands.Cog):
         if not file.filename.lower().endswith(".mp3"):
             await interaction.response.send_message("❌ Solo file .mp3 sono supportati.", ephemeral=True)
             return
+        if file.size > INTRO_MAX_UPLOAD_BYTES:
+            await interaction.response.send_message(f"❌ Il file supera la dimensione massima di {INTRO_MAX_UPLOAD_BYTES // 1024} KB.", ephemeral=True)
+            return
 
         assert interaction.guild_id is not None
-        await interaction.response.defer(thinking=True, ephemeral=True)
-        success = await save_intro_file(file, interaction.user.id, interaction.guild_id, temp=True)
-        if success:
-            temp_path = get_intro_path(interaction.user.id, interaction.guild_id, temp=True)
-            if await validate_audio_file(temp_path, INTRO_MAX_SECONDS):
-                os.replace(temp_path, get_intro_path(interaction.user.id, interaction.guild_id))
-                await interaction.followup.send("✅ Intro salvato con successo!")
-            else:
-                os.remove(temp_path)
-                await interaction.followup.send("❌ Il file audio non è valido o supera la durata massima.")
-        else:
-            await interaction.followup.send("❌ Errore durante il salvataggio del file.")
+        guild_id, user_id = interaction.guild_id, interaction.user.id
+        if not await self._acknowledge(interaction, ingest_admission.admit(guild_id, user_id)):
+            return
+
+        async def ingest() -> str:
+            if not await save_intro_file(file, user_id, guild_id):
+                return "❌ Errore durante il salvataggio del file."
+            if await publish_uploaded_intro(user_id, guild_id) is None:
+                return "❌ Il file audio non è valido o supera la durata massima."
+            return "✅ Intro salvato con successo!"
+
+        message = await ingest_admission.run(guild_id, user_id, ingest)
+        await interaction.followup.send(message or SUPERSEDED_MESSAGE, ephemeral=True)
 
     @app_commands.command(name="intro-youtube", description="Carica un file intro da un video YouTube")
     @app_commands.describe(time_start="Orario di inizio in formato HH:MM:SS", time_end="Orario di fine in formato HH:MM:SS", url="Link del video YouTube")
     @is_guild_context()
     async def intro_youtube(self, interaction: discord.Interaction, time_start: str, time_end: str, url: str) -> None:
         assert interaction.guild_id is not None
-        await interaction.response.defer(ephemeral=True, thinking=True)
-
+        # Input non valido: rifiutato prima del controllo di ammissione, senza consumare gettoni
         if not validate_time_format(time_start) or not validate_time_format(time_end):
-            await interaction.followup.send("❌ Formato di time_start o time_end non valido. Usa HH:MM:SS o MM:SS.", ephemeral=True)
+            await interaction.response.send_message("❌ Formato di time_start o time_end non valido. Usa HH:MM:SS o MM:SS.", ephemeral=True)
+            return
+        if not is_valid_youtube_url(url):
+            await interaction.response.send_message("❌ URL non valido: usa il link di un video YouTube (youtube.com/watch?v=... o youtu.be/...).", ephemeral=True)
             return
 
-        success = await download_audio_clip(interaction.user.id, interaction.guild_id, url, time_start, time_end)
+        guild_id, user_id = interaction.guild_id, interaction.user.id
+        if not await self._acknowledge(interaction, ingest_admission.admit(guild_id, user_id)):
+            return
+
+        success = await ingest_admission.run(guild_id, user_id, lambda: download_audio_clip(user_id, guild_id, url, time_start, time_end))
 
-        if success:
+        if success is None:
+            await interaction.followup.send(SUPERSEDED_MESSAGE, ephemeral=True)
+        elif success:
             await interaction.followup.send(f"✅ Intro caricato con successo da YouTube (max {INTRO_MAX_SECONDS}s)!", ephemeral=True)
         else:
             await interaction.followup.send("❌ Errore durante il download o il salvataggio dell'audio.", ephemeral=True)
@@ -75,14 +154,14 @@ class IntroManager(commands.Cog):
     @is_guild_context()
     async def intro_info(self, interaction: discord.Interaction) -> None:
         assert interaction.guild_id is not None
-        path = get_intro_path(interaction.user.id, interaction.guild_id)
+        entry = intro_index.get(interaction.guild_id, interaction.user.id)
 
-        if not os.path.exists(path):
+        if entry is None:
             await interaction.response.send_message("ℹ️ Non hai ancora caricato un file intro.", ephemeral=True)
             return
 
-        file_size = os.path.getsize(path)
-        creation_time = os.path.getctime(path)
+        file_size = entry.stat.st_size
+        creation_time = entry.created
         timestamp = datetime.fromtimestamp(creation_time).strftime("%Y-%m-%d %H:%M:%S")
 
         await interaction.response.send_message(f"🎵 Intro trovato!\n- **Dimensione**: {round(file_size / 1024, 2)} KB\n- **Creato il**: {timestamp}", ephemeral=True)
@@ -97,42 +176,112 @@ class IntroManager(commands.Cog):
             await interaction.response.send_message("❌ Devi essere in un canale vocale per usare questo comando.", ephemeral=True)
             return
 
-        path = get_intro_path(interaction.user.id, interaction.guild_id)
-        if not os.path.exists(path):
+        if intro_index.get(interaction.guild_id, interaction.user.id) is None:
             await interaction.response.send_message("⚠️ Nessun file intro trovato per te in questo server.", ephemeral=True)
             return
 
-        vc: discord.VoiceClient | None = None
-        try:
-            # guild.voice_client è tipizzato come VoiceProtocol | None negli stubs; a runtime è VoiceClient
-            voice_client = cast(discord.VoiceClient | None, interaction.guild.voice_client)  # type: ignore[union-attr]
-            if voice_client and voice_client.is_connected():
-                if voice_client.is_playing():
-                    await interaction.response.send_message("❌ Il bot sta già riproducendo un audio.", ephemeral=True)
-                    return
-                if voice_client.channel != voice_state.channel:
-                    await voice_client.move_to(voice_state.channel)
-                vc = voice_client
-            else:
-                # connect() è tipizzato come VoiceProtocol negli stubs; a runtime è VoiceClient
-                vc = cast(discord.VoiceClient, await voice_state.channel.connect())
-
-            vc.play(discord.FFmpegPCMAudio(path, executable=FFMPEG_PATH, before_options=f"-t {INTRO_MAX_SECONDS} -loglevel panic"))
+        # Stessa coda delle intro automatiche: nessuna corsa su guild.voice_client
+        member = cast(discord.Member, interaction.user)
+        request = enqueue_intro(member, PRIORITY_MANUAL)
+        if request is None:
+            await interaction.response.send_message("⏳ Troppe intro in coda in questo server, riprova tra poco.", ephemeral=True)
+            return
+
+        scheduler = get_scheduler(member.guild)
+        position = scheduler.position(request)
+        if position == 0 and scheduler.current is None:
             await interaction.response.send_message("🎶 Intro in riproduzione...", ephemeral=True)
+        else:
+            await interaction.response.send_message(f"🎶 Intro in coda (posizione {position + 1})...", ephemeral=True)
+
+    @app_commands.command(name="intro-cancel", description="Annulla la tua intro in coda o in riproduzione")
+    @is_guild_context()
+    async def intro_cancel(self, interaction: discord.Interaction) -> None:
+        assert interaction.guild is not None
+        if cancel_intro(interaction.guild, interaction.user.id):
+            await interaction.response.send_message("⏹️ Intro annullata.", ephemeral=True)
+        else:
+            await interaction.response.send_message("ℹ️ Nessuna tua intro in coda o in riproduzione.", ephemeral=True)
+
+    @app_commands.command(name="intro-queue", description="Mostra l'intro in riproduzione e quelle in coda nel server")
+    @is_guild_context()
+    async def intro_queue(self, interaction: discord.Interaction) -> None:
+        assert interaction.guild is not None
+        status = scheduler_status(interaction.guild)
+        if status.playing is None and not status.pending:
+            await interaction.response.send_message("ℹ️ Nessuna intro in coda.", ephemeral=True)
+            return
+        lines = [f"🎶 In riproduzione: <@{status.playing}>"] if status.playing is not None else []
+        lines += [f"{position}. <@{member_id}>" for position, member_id in enumerate(status.pending[:20], start=1)]
+        if len(status.pending) > 20:
+            lines.append(f"… e altre {len(status.pending) - 20}")
+        await interaction.response.send_message("\n".join(lines), ephemeral=True, allowed_mentions=discord.AllowedMentions.none())
 
-            timeout: float = 0
-            max_timeout = INTRO_MAX_SECONDS + 2
-            while vc.is_playing() and timeout < max_timeout:
-                await asyncio.sleep(0.5)
-                timeout += 0.5
+    @app_commands.command(name="intro-export", description="[Admin] Esporta le intro del server in un archivio con manifest")
+    @is_guild_context()
+    @is_admin()
+    async def export_intros(self, interaction: discord.Interaction) -> None:
+        assert interaction.guild is not None
+        guild = interaction.guild
+        await interaction.response.defer(thinking=True, ephemeral=True)
+        path = archive_tmp_path(guild.id, "export")
+        try:
+            count = await export_guild(guild.id, path)
+            if count is None:
+                await interaction.followup.send("❌ Errore durante l'esportazione delle intro.")
+                return
+            size = os.path.getsize(path)
+            if size > guild.filesize_limit:
+                await interaction.followup.send(f"❌ L'archivio ({size // 1024} KB) supera il limite di upload del server: usa `python cli.py export` sull'host del bot.")
+                return
+            await interaction.followup.send(f"📦 {count} intro esportate.", file=discord.File(path, filename=f"intros-{guild.id}.tar"))
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
 
-        except discord.ClientException as e:
-            await interaction.response.send_message(f"❌ Errore di connessione vocale: {e}", ephemeral=True)
-        except OSError as e:
-            await interaction.response.send_message(f"❌ Errore di accesso al file audio: {e}", ephemeral=True)
+    @app_commands.command(name="intro-import", description="[Admin] Importa un archivio di intro creato con /intro-export")
+    @app_commands.describe(archive="Archivio .tar creato con /intro-export o cli.py", overwrite="Sostituisci le intro già presenti dei membri")
+    @is_guild_context()
+    @is_admin()
+    async def import_intros(self, interaction: discord.Interaction, archive: discord.Attachment, overwrite: bool = False) -> None:
+        assert interaction.guild_id is not None
+        if archive.size > IMPORT_MAX_ARCHIVE_BYTES:
+            await interaction.response.send_message(f"❌ L'archivio supera la dimensione massima di {IMPORT_MAX_ARCHIVE_BYTES // (1024 * 1024)} MB.", ephemeral=True)
+            return
+        # Validazione e transcodifica di tutte le intro: può richiedere qualche minuto
+        await interaction.response.defer(thinking=True, ephemeral=True)
+        path = archive_tmp_path(interaction.guild_id, "import")
+        try:
+            report = await import_guild(path, interaction.guild_id, overwrite) if await download_archive(archive.url, path) else None
         finally:
-            if vc and vc.is_connected():
-                await vc.disconnect()
+            if os.path.exists(path):
+                os.remove(path)
+        if report is None:
+            await interaction.followup.send("❌ Archivio non valido o illeggibile.")
+        else:
+            await interaction.followup.send(f"📥 Importate {report.imported} intro ({report.warmed} pronte per la riproduzione). Già presenti: {report.skipped}, non valide: {report.invalid}.")
+
+    @app_commands.command(name="intro-stats", description="[Admin] Ritardo dell'event loop, blocchi e tempi di eventi e comandi")
+    @is_guild_context()
+    @is_admin()
+    async def intro_stats(self, interaction: discord.Interaction) -> None:
+        lines = [
+            f"Loop: ritardo p50 {loop_watchdog.lag_percentile(50) * 1000:.1f} ms, p99 {loop_watchdog.lag_percentile(99) * 1000:.1f} ms, "
+            f"max {max(loop_watchdog.lag_samples, default=0.0) * 1000:.1f} ms ({len(loop_watchdog.lag_samples)} campioni)",
+            f"Blocchi oltre {loop_watchdog.threshold:.2f}s: {loop_watchdog.stall_count}",
+        ]
+        if loop_watchdog.stalls:
+            last = loop_watchdog.stalls[-1]
+            frame = last.stack.strip().splitlines()[-2:]
+            lines.append(f"Ultimo blocco: {datetime.fromtimestamp(last.at).strftime('%H:%M:%S')} ({last.seconds:.2f}s) in {' '.join(s.strip() for s in frame)}")
+        cache = opus_frame_cache.stats
+        lines.append(f"Cache opus: {len(opus_frame_cache)} intro, {opus_frame_cache.bytes // 1024} KB, hit {cache.hits}, miss {cache.misses}, rimozioni {cache.evictions}")
+        lines.append("")
+        lines.append(f"{'handler':<24}{'chiamate':>9}{'media ms':>10}{'max ms':>10}")
+        for name, stats in sorted(handler_stats.items(), key=lambda item: item[1].max_seconds, reverse=True):
+            lines.append(f"{name:<24}{stats.calls:>9}{stats.avg_seconds * 1000:>10.1f}{stats.max_seconds * 1000:>10.1f}")
+        report = "\n".join(lines)
+        await interaction.response.send_message(f"```\n{report[:1900]}\n```", ephemeral=True)
 
 
 async def setup(bot: commands.Bot) -> None:
@@ -1,49 +1,155 @@
 import asyncio
+import hashlib
+import json
+import os
 import sys
+import time
 from typing import Any
 
 import discord
+from aiohttp import web
 from discord.ext import commands
 
-from services.voice_handler import play_intro_if_available
-from utils.config import DISCORD_BOT_TOKEN
-from utils.logger import bot_logger
-
-intents = discord.Intents.default()
-intents.voice_states = True
-intents.guilds = True
-intents.members = True
-
-reconnect_attempts = 0
+from services.voice_handler import play_intro_if_available, shard_load
+from utils import metrics
+from utils.audio_meta import audio_meta_store
+from utils.config import (
+    BOT_START_TIME,
+    DATA_DIR,
+    DISCORD_BOT_TOKEN,
+    INTEGRITY_SCAN_BATCH_SIZE,
+    INTEGRITY_SCAN_INTERVAL_SECONDS,
+    INTRO_INDEX_REFRESH_SECONDS,
+    LOOP_WATCHDOG_INTERVAL,
+    LOW_MEMORY_MODE,
+    METRICS_HOST,
+    METRICS_PORT,
+    SHARD_COUNT,
+    SHARD_IDS,
+    SYNC_COMMANDS,
+    init_runtime,
+    require_token,
+)
+from utils.data_lock import data_dir_lock, managed_by_workers
+from utils.http import close_http_session, get_http_session
+from utils.integrity import run_integrity_scan
+from utils.intro_index import intro_index, run_index_refresh
+from utils.logger import bot_logger, error_logger
+from utils.metrics import process_rss_bytes, start_metrics_server
+from utils.settings_store import settings_store
+from utils.watchdog import loop_watchdog, timed
+
+if LOW_MEMORY_MODE:
+    # Bastano guild e voice state: i comandi slash arrivano come interazioni, non come messaggi
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.voice_states = True
+else:
+    intents = discord.Intents.default()
+    intents.voice_states = True
+    intents.guilds = True
+    intents.members = True
+
+# Con la cache ridotta (solo membri in voce) il bot non scarica le liste membri all'avvio
+client_options: dict[str, Any] = {}
+if LOW_MEMORY_MODE:
+    client_options = {"chunk_guilds_at_startup": False, "member_cache_flags": discord.MemberCacheFlags.from_intents(intents), "max_messages": None}
+
+# Disconnessioni consecutive per shard, azzerate quando lo shard torna pronto; oltre la soglia si logga un errore
+reconnect_attempts: dict[int, int] = {}
 MAX_RECONNECT_ATTEMPTS = 5
 
 
-async def monitor_connection() -> None:
-    # discord.py gestisce la riconnessione automaticamente; questo task
-    # si limita a chiudere il bot se le disconnessioni superano il limite.
-    while True:
-        await asyncio.sleep(5)
-        if reconnect_attempts >= MAX_RECONNECT_ATTEMPTS:
-            bot_logger.error("--- Numero massimo di tentativi di riconnessione raggiunto, arresto del bot")
-            await bot.close()
-            break
+class IntroBot(commands.AutoShardedBot):
+    metrics_runner: web.AppRunner | None = None
+    startup_reported = False
+    command_hash_path = os.path.join(DATA_DIR, "command_tree.sha256")
 
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.startup_timings: dict[str, float] = {}
+        self._startup_mark = BOT_START_TIME
+
+    def mark_startup(self, phase: str) -> None:
+        # Durata di ogni fase dell'avvio, dalla fine della precedente (la prima parte da BOT_START_TIME)
+        now = time.time()
+        self.startup_timings[phase] = now - self._startup_mark
+        self._startup_mark = now
 
-class IntroBot(commands.Bot):
     async def setup_hook(self) -> None:
-        asyncio.create_task(monitor_connection())
+        self.mark_startup("import+login")
+        if LOOP_WATCHDOG_INTERVAL > 0:
+            loop_watchdog.start()
+        get_http_session()
+        orphans = await asyncio.to_thread(intro_index.cleanup_orphans)
+        if orphans:
+            bot_logger.warning("Rimossi %s file temporanei orfani da un arresto precedente", orphans)
+        count = await asyncio.to_thread(intro_index.scan)
+        bot_logger.info("Indice intro caricato: %s file", count)
+        self.mark_startup("indice")
+        if INTRO_INDEX_REFRESH_SECONDS > 0:
+            asyncio.create_task(run_index_refresh(intro_index, INTRO_INDEX_REFRESH_SECONDS))
+        if INTEGRITY_SCAN_INTERVAL_SECONDS > 0:
+            asyncio.create_task(run_integrity_scan(intro_index, INTEGRITY_SCAN_INTERVAL_SECONDS, INTEGRITY_SCAN_BATCH_SIZE))
+        if METRICS_PORT > 0:
+            try:
+                self.metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+            except OSError as e:
+                bot_logger.error("Impossibile avviare l'endpoint metriche su %s:%s: %s", METRICS_HOST, METRICS_PORT, e)
         await self.load_extension("cogs.intro_manager")
+        self.mark_startup("cog")
+        if SYNC_COMMANDS:
+            await self.sync_commands_if_changed()
+        self.mark_startup("sync")
+
+    def command_tree_hash(self) -> str:
+        # Payload che verrebbe inviato a Discord, più l'application id (un altro token = un'altra app)
+        payload = sorted((command.to_dict(self.tree) for command in self.tree.get_commands()), key=lambda c: str(c["name"]))
+        return hashlib.sha256(json.dumps([self.application_id, payload], sort_keys=True, default=str).encode()).hexdigest()
+
+    async def sync_commands_if_changed(self) -> None:
+        # La sync globale è lenta e soggetta a rate limit: si esegue solo se i comandi sono cambiati.
+        # Per forzarla basta cancellare DATA_DIR/command_tree.sha256.
+        current = self.command_tree_hash()
+        try:
+            with open(self.command_hash_path, encoding="ascii") as f:
+                if f.read().strip() == current:
+                    bot_logger.info("Comandi slash invariati, sincronizzazione saltata")
+                    return
+        except OSError:
+            pass
         try:
             synced = await self.tree.sync()
-            bot_logger.info(f"Comandi slash sincronizzati: {len(synced)}")
+            bot_logger.info("Comandi slash sincronizzati: %s", len(synced))
         except Exception as e:
-            bot_logger.error(f"Errore durante la sincronizzazione dei comandi: {e}")
+            bot_logger.error("Errore durante la sincronizzazione dei comandi: %s", e)
+            return
+        try:
+            with open(self.command_hash_path, "w", encoding="ascii") as f:
+                f.write(current)
+        except OSError as e:
+            bot_logger.error("Errore salvataggio hash dei comandi: %s", e)
+
+    async def close(self) -> None:
+        loop_watchdog.stop()
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        await close_http_session()
+        await super().close()
+        # Le ultime modifiche a indice, metadati e impostazioni vengono scritte prima dell'uscita
+        await intro_index.flush()
+        await audio_meta_store.flush()
+        await settings_store.flush()
 
 
-bot = IntroBot(command_prefix=[], intents=intents)
+if SHARD_IDS is not None:
+    bot = IntroBot(command_prefix=[], intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS, **client_options)
+else:
+    bot = IntroBot(command_prefix=[], intents=intents, shard_count=SHARD_COUNT or None, **client_options)
 
 
 @bot.event
+@timed("on_voice_state_update")
 async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState) -> None:
     await play_intro_if_available(member, before, after)
 
@@ -52,30 +158,66 @@ async def on_voice_state_update(member: discord.Member, before: discord.VoiceSta
 async def on_error(event: str, *args: Any, **kwargs: Any) -> None:
     exc_type, exc_value, exc_tb = sys.exc_info()
     if exc_value is not None:
-        bot_logger.error(f"Errore nell'evento {event}", exc_info=True)
+        error_logger.error("Errore nell'evento %s", event, exc_info=True)
         if "WebSocket closed with 4006" in str(exc_value):
             bot_logger.warning("--- Possibile invalidazione della sessione WebSocket rilevata")
     else:
-        bot_logger.error(f"Errore nell'evento {event}: args={args}")
+        error_logger.error("Errore nell'evento %s: args=%s", event, args)
+
+
+@bot.event
+async def on_shard_disconnect(shard_id: int) -> None:
+    # discord.py riconnette lo shard da solo (resume o nuova sessione): qui si traccia e si logga
+    # soltanto. Forzare una riconnessione correrebbe contro quella in corso (IDENTIFY in più).
+    attempts = reconnect_attempts[shard_id] = reconnect_attempts.get(shard_id, 0) + 1
+    metrics.shard_disconnects.inc(shard=shard_id)
+    guilds, pending = shard_load(shard_id)
+    bot_logger.warning("--- Shard %s disconnesso dal WebSocket (%s/%s): %s guild con coda attiva, %s intro in attesa", shard_id, attempts, MAX_RECONNECT_ATTEMPTS, guilds, pending)
+    if attempts == MAX_RECONNECT_ATTEMPTS:
+        bot_logger.error("--- Shard %s: %s disconnessioni consecutive senza tornare pronto", shard_id, attempts)
+
+
+async def _shard_back(shard_id: int) -> None:
+    attempts = reconnect_attempts.pop(shard_id, 0)
+    if attempts > 0:
+        bot_logger.info("--- Shard %s riconnesso dopo %s tentativi", shard_id, attempts)
+
+
+@bot.event
+async def on_shard_ready(shard_id: int) -> None:
+    bot_logger.info("--- Shard %s pronto", shard_id)
+    await _shard_back(shard_id)
 
 
 @bot.event
-async def on_disconnect() -> None:
-    global reconnect_attempts
-    bot_logger.warning("--- Disconnessione dal WebSocket rilevata")
-    reconnect_attempts += 1
+async def on_shard_resumed(shard_id: int) -> None:
+    await _shard_back(shard_id)
 
 
 @bot.event
 async def on_ready() -> None:
-    global reconnect_attempts
-    bot_logger.info(f"--- Bot connesso come {bot.user}")
-    if reconnect_attempts > 0:
-        bot_logger.info(f"--- Riconnessione riuscita dopo {reconnect_attempts} tentativi")
-    reconnect_attempts = 0
+    bot_logger.info("--- Bot connesso come %s (shard %s di %s)", bot.user, sorted(bot.shards), bot.shard_count)
+    if bot.startup_reported:
+        return
+    bot.startup_reported = True
+    bot.mark_startup("gateway")
+    phases = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in bot.startup_timings.items())
+    bot_logger.info("--- Fasi di avvio: %s", phases)
+    rss = process_rss_bytes()
+    rss_text = f"{rss / (1024 * 1024):.1f} MiB" if rss is not None else "n/d"
+    mode = "basso consumo" if LOW_MEMORY_MODE else "standard"
+    bot_logger.info("--- Pronto in %.1fs, RSS %s, %s guild, modalità %s", time.time() - BOT_START_TIME, rss_text, len(bot.guilds), mode)
 
 
 async def main() -> None:
+    require_token()
+    init_runtime()
+    if managed_by_workers():
+        bot_logger.error("%s è gestita da workers.py: avvia i worker oppure usa DATA_DIR=<directory di un worker>", DATA_DIR)
+        sys.exit(1)
+    if not data_dir_lock.acquire():
+        bot_logger.error("Un altro processo (bot o cli.py) sta usando %s: avvio annullato", DATA_DIR)
+        sys.exit(1)
     await bot.start(DISCORD_BOT_TOKEN)
 
 
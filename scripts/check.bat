@@ -19,7 +19,7 @@ ruff format --check .
 if errorlevel 1 exit /b 1
 
 echo === mypy ===
-mypy introbot.py cogs\ services\ utils\
+mypy introbot.py workers.py cli.py cogs\ services\ utils\ benchmarks\
 if errorlevel 1 exit /b 1
 
 if exist "tests\" (
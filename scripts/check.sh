@@ -18,7 +18,7 @@ echo "=== ruff format ==="
 ruff format --check .
 
 echo "=== mypy ==="
-mypy introbot.py cogs/ services/ utils/
+mypy introbot.py workers.py cli.py cogs/ services/ utils/ benchmarks/
 
 if [ -d "tests" ]; then
     echo "=== pytest ==="
@@ -0,0 +1,113 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import cast
+
+import discord
+
+from utils import metrics
+from utils.config import VOICE_IDLE_SECONDS
+from utils.logger import service_logger
+
+
+@dataclass
+class ConnectionStats:
+    handshakes: int = 0
+    handshake_seconds: float = 0.0
+    reuses: int = 0
+    moves: int = 0
+
+    @property
+    def avg_handshake_seconds(self) -> float:
+        return self.handshake_seconds / self.handshakes if self.handshakes else 0.0
+
+    @property
+    def saved_seconds(self) -> float:
+        # Stima: ogni riutilizzo evita un handshake di durata media
+        return self.reuses * self.avg_handshake_seconds
+
+
+class VoiceConnectionManager:
+    """
+    Keeps one VoiceClient per guild alive across consecutive intros.
+
+    The connection is reused (moving between channels if needed) while there is work to do and
+    is only closed once it has been idle for ``idle_seconds``.
+    """
+
+    def __init__(self, idle_seconds: float) -> None:
+        self.idle_seconds = idle_seconds
+        self.stats: dict[int, ConnectionStats] = {}
+        self._idle_tasks: dict[int, asyncio.Task[None]] = {}
+
+    def _cancel_idle(self, guild_id: int) -> None:
+        task = self._idle_tasks.pop(guild_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+
+    async def acquire(self, channel: discord.VoiceChannel | discord.StageChannel) -> discord.VoiceClient:
+        guild = channel.guild
+        self._cancel_idle(guild.id)
+        stats = self.stats.setdefault(guild.id, ConnectionStats())
+
+        # guild.voice_client è tipizzato come VoiceProtocol | None negli stubs; a runtime è VoiceClient
+        voice_client = cast(discord.VoiceClient | None, guild.voice_client)
+        if voice_client and voice_client.is_connected():
+            if voice_client.channel != channel:
+                await voice_client.move_to(channel)
+                stats.moves += 1
+            stats.reuses += 1
+            metrics.voice_connect_reuses.inc(guild=guild.id)
+            return voice_client
+
+        started = time.perf_counter()
+        max_retries = 2
+        for attempt in range(max_retries + 1):
+            try:
+                # connect() è tipizzato come VoiceProtocol negli stubs; a runtime è VoiceClient
+                vc = cast(discord.VoiceClient, await channel.connect(reconnect=False))
+                for _ in range(6):
+                    if vc.is_connected():
+                        break
+                    await asyncio.sleep(0.5)
+                else:
+                    raise discord.DiscordException("Connection timeout")
+                elapsed = time.perf_counter() - started
+                stats.handshakes += 1
+                stats.handshake_seconds += elapsed
+                metrics.voice_connect_seconds.observe(elapsed, guild=guild.id)
+                return vc
+            except (discord.DiscordException, asyncio.TimeoutError) as e:
+                # connect() segnala il timeout dell'handshake con asyncio.TimeoutError
+                service_logger.error("--- Tentativo %s/%s fallito: %s", attempt + 1, max_retries + 1, e)
+                if attempt == max_retries:
+                    raise
+                metrics.voice_connect_retries.inc(guild=guild.id)
+                await asyncio.sleep(1)
+        raise AssertionError("unreachable")
+
+    def release(self, guild: discord.Guild) -> None:
+        # Da chiamare quando non c'è altro da riprodurre: la disconnessione avviene dopo la finestra di inattività
+        self._cancel_idle(guild.id)
+        self._idle_tasks[guild.id] = asyncio.create_task(self._disconnect_when_idle(guild))
+
+    async def _disconnect_when_idle(self, guild: discord.Guild) -> None:
+        if self.idle_seconds > 0:
+            await asyncio.sleep(self.idle_seconds)
+        self._idle_tasks.pop(guild.id, None)
+        voice_client = cast(discord.VoiceClient | None, guild.voice_client)
+        if voice_client is None or not voice_client.is_connected() or voice_client.is_playing():
+            return
+        await voice_client.disconnect()
+        stats = self.stats.get(guild.id, ConnectionStats())
+        service_logger.debug(
+            "--- Disconnesso dal canale vocale (guild %s): handshake=%s, riutilizzi=%s, spostamenti=%s, tempo risparmiato≈%.1fs",
+            guild.id,
+            stats.handshakes,
+            stats.reuses,
+            stats.moves,
+            stats.saved_seconds,
+        )
+
+
+voice_connections = VoiceConnectionManager(VOICE_IDLE_SECONDS)
@@ -1,107 +1,477 @@
 import asyncio
-import os
+import time
+from dataclasses import dataclass, field
 from typing import cast
 
 import discord
 
-from utils.config import FFMPEG_PATH, INTRO_MAX_SECONDS
-from utils.file_utils import get_intro_path, validate_audio_file
-from utils.logger import bot_logger
+from services.voice_connection import voice_connections
+from utils import metrics
+from utils.config import FFMPEG_PATH, GUILD_QUEUE_ENTRY_TTL_SECONDS, GUILD_QUEUE_MAX_DEPTH, GUILD_SCHEDULER_IDLE_SECONDS, INTRO_BATCH_WINDOW_SECONDS, INTRO_MAX_SECONDS
+from utils.file_utils import ensure_opus_cache, validate_audio_file
+from utils.intro_index import IntroEntry, intro_index
+from utils.logger import service_logger
+from utils.opus_cache import CachedOpusSource, OpusSequenceSource, opus_frame_cache, read_opus_frames
+from utils.subprocess_pool import PRIORITY_PLAYBACK
 
-guild_queues: dict[int, asyncio.Queue[discord.Member]] = {}
-guild_tasks: dict[int, asyncio.Task[None]] = {}
+# Priorità: valore più basso = servito prima
+PRIORITY_MANUAL = 0
+PRIORITY_JOIN = 10
 
 
-async def guild_player(guild_id: int, queue: asyncio.Queue[discord.Member]) -> None:
-    while True:
-        member = await queue.get()
+@dataclass
+class PlayRequest:
+    # Solo id e guild: il membro viene risolto dalla cache al momento della riproduzione,
+    # così la coda non trattiene oggetti Member (rilevante con la cache membri ridotta).
+    member_id: int
+    guild: discord.Guild
+    name: str
+    priority: int
+    seq: int
+    enqueued_at: float = field(default_factory=time.monotonic)
+    done: asyncio.Future[bool] = field(default_factory=lambda: asyncio.get_running_loop().create_future())
 
-        # Re-check member is still in a voice channel (may have left while queued)
-        if member.voice is None or member.voice.channel is None:
-            bot_logger.debug(f"--- {member.name} ha lasciato il canale prima della riproduzione, skip")
-            queue.task_done()
-            continue
+    def finish(self, played: bool) -> None:
+        if not self.done.done():
+            self.done.set_result(played)
 
-        target_channel = member.voice.channel
-        path = get_intro_path(member.id, guild_id)
 
-        if not os.path.exists(path):
-            bot_logger.debug(f"--- Nessun intro per {member.name}, skip")
-            queue.task_done()
-            continue
+@dataclass
+class SchedulerStatus:
+    playing: int | None
+    pending: list[int]
 
-        if not await validate_audio_file(path, INTRO_MAX_SECONDS):
-            bot_logger.debug(f"--- File intro non valido per {member.name}, skip")
-            queue.task_done()
-            continue
 
-        vc: discord.VoiceClient | None = None
+async def load_intro_frames(opus_path: str) -> tuple[bytes, ...] | None:
+    # Frame Opus già in memoria (nessun processo, nessuna lettura da disco); al primo uso
+    # li legge dalla copia Ogg/Opus in cache. None se la cache è disabilitata o la copia illeggibile.
+    if opus_frame_cache.max_bytes <= 0:
+        return None
+    frames = opus_frame_cache.get(opus_path)
+    if frames is None:
         try:
-            voice_client = cast(discord.VoiceClient | None, target_channel.guild.voice_client)
-
-            if voice_client and voice_client.is_connected():
-                if voice_client.channel != target_channel:
-                    await voice_client.move_to(target_channel)
-                vc = voice_client
-            else:
-                max_retries = 2
-                for attempt in range(max_retries + 1):
-                    try:
-                        vc = cast(discord.VoiceClient, await target_channel.connect(reconnect=False))
-                        for _ in range(6):
-                            if vc.is_connected():
-                                break
-                            await asyncio.sleep(0.5)
-                        else:
-                            raise discord.DiscordException("Connection timeout")
-                        break
-                    except discord.DiscordException as e:
-                        bot_logger.error(f"--- Tentativo {attempt + 1}/{max_retries + 1} fallito: {e}")
-                        if attempt == max_retries:
-                            raise
-                        await asyncio.sleep(1)
-
-            assert vc is not None
-            vc.play(discord.FFmpegPCMAudio(path, executable=FFMPEG_PATH, before_options=f"-t {INTRO_MAX_SECONDS} -loglevel panic"))
-            bot_logger.debug(f"--- Riproduzione avviata per {member.name}")
-
-            timeout: float = 0
-            max_timeout = INTRO_MAX_SECONDS + 2
-            while vc.is_playing() and timeout < max_timeout:
-                await asyncio.sleep(0.5)
-                timeout += 0.5
-
-            bot_logger.debug(f"--- Riproduzione terminata per {member.name}")
-
-        except discord.DiscordException as e:
-            bot_logger.error(f"Errore Discord durante la riproduzione per {member.name}: {e}")
+            frames = await asyncio.to_thread(read_opus_frames, opus_path)
+        except (OSError, discord.DiscordException) as e:
+            service_logger.error("Copia opus %s illeggibile: %s", opus_path, e)
+            return None
+        opus_frame_cache.put(opus_path, frames)
+    return frames or None
+
+
+async def intro_frames(user_id: int, guild_id: int, entry: IntroEntry) -> tuple[bytes, ...] | None:
+    opus_path = await ensure_opus_cache(entry, guild_id, user_id, PRIORITY_PLAYBACK)
+    return await load_intro_frames(opus_path) if opus_path is not None else None
+
+
+async def create_intro_source(user_id: int, guild_id: int, entry: IntroEntry) -> discord.AudioSource:
+    # Fallback su ffmpeg se i frame non sono disponibili in memoria o la copia opus manca
+    opus_path = await ensure_opus_cache(entry, guild_id, user_id, PRIORITY_PLAYBACK)
+    if opus_path is not None:
+        frames = await load_intro_frames(opus_path)
+        if frames is not None:
+            return CachedOpusSource(frames)
+        return discord.FFmpegOpusAudio(opus_path, codec="copy", executable=FFMPEG_PATH, before_options="-loglevel panic")
+    return discord.FFmpegPCMAudio(entry.path, executable=FFMPEG_PATH, before_options=f"-t {INTRO_MAX_SECONDS} -loglevel panic")
+
+
+def start_playback(vc: discord.VoiceClient, source: discord.AudioSource) -> asyncio.Event:
+    # Il callback after= gira nel thread del player: lo riportiamo sul loop con call_soon_threadsafe,
+    # così la prossima intro parte appena finisce la precedente, senza polling.
+    loop = asyncio.get_running_loop()
+    finished = asyncio.Event()
+
+    def after(error: Exception | None) -> None:
+        if error is not None:
+            service_logger.error("Errore nel player audio: %s", error)
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(finished.set)
+
+    vc.play(source, after=after)
+    return finished
+
+
+async def wait_playback(vc: discord.VoiceClient, finished: asyncio.Event, timeout: float) -> None:
+    try:
+        await asyncio.wait_for(finished.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        service_logger.warning("--- Riproduzione oltre %ss, interrotta", timeout)
+        vc.stop()
+
+
+async def play_and_wait(vc: discord.VoiceClient, source: discord.AudioSource, timeout: float) -> None:
+    await wait_playback(vc, start_playback(vc, source), timeout)
+
+
+class GuildScheduler:
+    """
+    Single per-guild playback queue shared by automatic join intros and /intro-play.
+
+    Pending requests are keyed by member id, so a member joining repeatedly or hopping between
+    channels keeps one entry (the target channel is resolved at play time). Depth is bounded,
+    entries older than ``ttl`` are dropped, and the consumer task exits after ``idle_seconds``
+    without work, removing the scheduler from its shard's partition of ``shard_schedulers``.
+
+    With a ``batch_window``, a join burst is played as one sequence: the voice connection is
+    opened while the window runs, then every request for the same channel is drained and the
+    clips are concatenated into a single Opus stream. A lone request on an open connection
+    skips the window.
+    """
+
+    def __init__(self, guild_id: int, shard_id: int, max_depth: int, ttl: float, idle_seconds: float, batch_window: float = 0.0) -> None:
+        self.guild_id = guild_id
+        self.shard_id = shard_id
+        self.max_depth = max_depth
+        self.ttl = ttl
+        self.idle_seconds = idle_seconds
+        self.batch_window = batch_window
+        self.current: PlayRequest | None = None
+        self.batch: list[PlayRequest] = []
+        self._sequence: OpusSequenceSource | None = None
+        self._pending: dict[int, PlayRequest] = {}
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self.task: asyncio.Task[None] | None = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def submit(self, member: discord.Member, priority: int) -> PlayRequest | None:
+        existing = self._pending.get(member.id)
+        if existing is not None:
+            # Coalescing: stesso membro già in coda, si mantiene la posizione e si alza eventualmente la priorità
+            existing.name = member.name
+            existing.priority = min(existing.priority, priority)
+            existing.enqueued_at = time.monotonic()
+            return existing
+        if len(self._pending) >= self.max_depth:
+            self._evict_expired()
+            if len(self._pending) >= self.max_depth:
+                metrics.intros_skipped.inc(guild=self.guild_id, reason="queue_full")
+                return None
+        self._seq += 1
+        request = PlayRequest(member.id, member.guild, member.name, priority, self._seq)
+        self._pending[member.id] = request
+        metrics.queue_depth.set(len(self._pending), guild=self.guild_id)
+        self._wakeup.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        return request
+
+    def cancel(self, member_id: int) -> bool:
+        # Annulla la richiesta in coda o interrompe quella in riproduzione
+        request = self._pending.pop(member_id, None)
+        if request is not None:
+            request.finish(False)
+            metrics.queue_depth.set(len(self._pending), guild=self.guild_id)
+            return True
+        sequence = self._sequence
+        if sequence is not None:
+            if sequence.skip(member_id):
+                return True
+        elif self.current is not None and self.current.member_id == member_id:
+            voice_client = cast(discord.VoiceClient | None, self.current.guild.voice_client)
+            if voice_client is not None and voice_client.is_playing():
+                voice_client.stop()
+                return True
+        # Membro della sequenza da riprodurre da solo dopo di essa (clip non in cache), non ancora iniziato
+        for request in self.batch:
+            if request.member_id == member_id and not request.done.done() and (member_id not in sequence.members if sequence else request is not self.current):
+                request.finish(False)
+                return True
+        return False
+
+    def position(self, request: PlayRequest) -> int:
+        key = (request.priority, request.seq)
+        return sum(1 for r in self._pending.values() if (r.priority, r.seq) < key)
+
+    def status(self) -> SchedulerStatus:
+        ordered = sorted(self._pending.values(), key=lambda r: (r.priority, r.seq))
+        # Membri della sequenza non ancora riprodotti; quelli rimessi in coda compaiono in ordered
+        waiting = [r for r in self.batch if not r.done.done() and r.member_id not in self._pending]
+        sequence = self._sequence
+        if sequence is not None:
+            playing = sequence.current
+            upcoming = [r.member_id for r in waiting if r.member_id != playing and not sequence.finished(r.member_id)]
+        else:
+            playing = self.current.member_id if self.current else None
+            upcoming = [r.member_id for r in waiting if r is not self.current]
+        return SchedulerStatus(playing=playing, pending=upcoming + [r.member_id for r in ordered])
+
+    def _evict_expired(self) -> None:
+        deadline = time.monotonic() - self.ttl
+        for member_id, request in list(self._pending.items()):
+            if request.enqueued_at < deadline:
+                del self._pending[member_id]
+                request.finish(False)
+                metrics.intros_skipped.inc(guild=self.guild_id, reason="expired")
+                service_logger.debug("--- Richiesta di %s scaduta in coda (guild %s), scartata", request.name, self.guild_id)
+
+    def _pop_next(self) -> PlayRequest | None:
+        self._evict_expired()
+        if not self._pending:
+            return None
+        request = min(self._pending.values(), key=lambda r: (r.priority, r.seq))
+        del self._pending[request.member_id]
+        metrics.queue_depth.set(len(self._pending), guild=self.guild_id)
+        return request
+
+    async def run(self) -> None:
+        guild: discord.Guild | None = None
+        while True:
+            request = self._pop_next()
+            if request is None:
+                # Coda vuota: la connessione resta aperta solo per la finestra di inattività
+                if guild is not None:
+                    voice_connections.release(guild)
+                    guild = None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.idle_seconds)
+                except asyncio.TimeoutError:
+                    # Nessun await tra il controllo e la rimozione: un nuovo submit crea un nuovo scheduler
+                    if not self._pending:
+                        partition = shard_schedulers.get(self.shard_id, {})
+                        if partition.get(self.guild_id) is self:
+                            del partition[self.guild_id]
+                        metrics.queue_depth.remove(guild=self.guild_id)
+                        return
+                continue
+
+            guild = request.guild
+            self.current = request
+            try:
+                if self.batch_window > 0 and opus_frame_cache.max_bytes > 0:
+                    await self._play_batch(request)
+                else:
+                    request.finish(await self._play(request))
+            finally:
+                # Nessuna richiesta resta in attesa se la riproduzione fallisce con un errore inatteso
+                for done in [request, *self.batch]:
+                    if self._pending.get(done.member_id) is not done:
+                        done.finish(False)
+                self.current = None
+                self.batch = []
+                self._sequence = None
+
+    async def _prepare(self, request: PlayRequest) -> tuple[discord.Member, IntroEntry] | None:
+        # Re-check member is still in a voice channel (may have left while queued).
+        # Con la cache ridotta ai membri in voce, un membro assente dalla cache non è in un canale.
+        member = request.guild.get_member(request.member_id)
+        if member is None or member.voice is None or member.voice.channel is None:
+            service_logger.debug("--- %s ha lasciato il canale prima della riproduzione, skip", request.name)
+            metrics.intros_skipped.inc(guild=self.guild_id, reason="left")
+            return None
+
+        entry = intro_index.get(self.guild_id, member.id)
+
+        if entry is None:
+            service_logger.debug("--- Nessun intro per %s, skip", member.name)
+            metrics.intros_skipped.inc(guild=self.guild_id, reason="missing")
+            return None
+
+        if not await validate_audio_file(entry.path, INTRO_MAX_SECONDS, entry.stat, PRIORITY_PLAYBACK):
+            service_logger.debug("--- File intro non valido per %s, skip", member.name)
+            metrics.intros_skipped.inc(guild=self.guild_id, reason="invalid")
+            return None
+        return member, entry
+
+    async def _play(self, request: PlayRequest) -> bool:
+        prepared = await self._prepare(request)
+        if prepared is None:
+            return False
+        member, entry = prepared
+        assert member.voice is not None and member.voice.channel is not None
+        target_channel = member.voice.channel
+
+        try:
+            vc = await voice_connections.acquire(target_channel)
+            source = await create_intro_source(member.id, self.guild_id, entry)
+            service_logger.debug("--- Riproduzione avviata per %s", member.name)
+            metrics.enqueue_to_play_seconds.observe(time.monotonic() - request.enqueued_at, guild=self.guild_id)
+            with metrics.playback_seconds.time(guild=self.guild_id):
+                await play_and_wait(vc, source, INTRO_MAX_SECONDS + 2)
+            metrics.intros_played.inc(guild=self.guild_id)
+            service_logger.debug("--- Riproduzione terminata per %s", member.name)
+            return True
+
+        except (discord.DiscordException, asyncio.TimeoutError) as e:
+            service_logger.error("Errore Discord durante la riproduzione per %s: %s", member.name, e)
         except OSError as e:
-            bot_logger.error(f"Errore accesso file audio per {member.name}: {e}")
+            service_logger.error("Errore accesso file audio per %s: %s", member.name, e)
+        metrics.intros_skipped.inc(guild=self.guild_id, reason="error")
+        return False
+
+    def _drain_channel(self, channel: discord.abc.Connectable) -> list[PlayRequest]:
+        # Richieste in coda dei membri che si trovano ora nello stesso canale, in ordine di priorità
+        drained: list[PlayRequest] = []
+        for request in sorted(self._pending.values(), key=lambda r: (r.priority, r.seq)):
+            member = request.guild.get_member(request.member_id)
+            if member is not None and member.voice is not None and member.voice.channel == channel:
+                del self._pending[request.member_id]
+                drained.append(request)
+        metrics.queue_depth.set(len(self._pending), guild=self.guild_id)
+        return drained
+
+    def _requeue(self, request: PlayRequest) -> bool:
+        # Membro uscito dal canale della sequenza ma ancora in voce: il canale si sceglie al momento
+        # della riproduzione, quindi la richiesta torna in coda con la sua posizione originale.
+        member = request.guild.get_member(request.member_id)
+        if member is None or member.voice is None or member.voice.channel is None:
+            return False
+        newer = self._pending.get(request.member_id)
+        if newer is not None:
+            # Il cambio di canale ha già messo in coda una nuova richiesta: eredita la posizione
+            newer.priority = min(newer.priority, request.priority)
+            newer.seq = min(newer.seq, request.seq)
+            request.finish(False)
+        else:
+            request.enqueued_at = time.monotonic()
+            self._pending[request.member_id] = request
+            metrics.queue_depth.set(len(self._pending), guild=self.guild_id)
+        service_logger.debug("--- %s ha cambiato canale durante la sequenza, intro rimessa in coda", request.name)
+        return True
+
+    async def _play_batch(self, first: PlayRequest) -> None:
+        # Nessuna connessione per una richiesta che non si può riprodurre (registra lo skip)
+        if await self._prepare(first) is None:
+            first.finish(False)
+            return
+        member = first.guild.get_member(first.member_id)
+        assert member is not None and member.voice is not None and member.voice.channel is not None
+        channel = member.voice.channel
+
+        # L'handshake vocale procede mentre la finestra raccoglie gli altri ingressi nello stesso canale.
+        # Con la connessione già aperta e nessun'altra richiesta in coda la finestra sarebbe solo attesa.
+        voice_client = cast(discord.VoiceClient | None, first.guild.voice_client)
+        connected = voice_client is not None and voice_client.is_connected()
+        connecting = asyncio.create_task(voice_connections.acquire(channel))
+        try:
+            if self._pending or not connected:
+                await asyncio.sleep(max(0.0, first.enqueued_at + self.batch_window - time.monotonic()))
+            self.batch = [first, *self._drain_channel(channel)]
+
+            segments: list[tuple[int, tuple[bytes, ...]]] = []
+            fallback: list[PlayRequest] = []
+            for request in self.batch:
+                prepared = await self._prepare(request)
+                if prepared is None:
+                    request.finish(False)
+                    continue
+                frames = await intro_frames(request.member_id, self.guild_id, prepared[1])
+                if frames is None:
+                    fallback.append(request)  # riprodotta da sola con ffmpeg, dopo la sequenza
+                else:
+                    segments.append((request.member_id, frames))
+            pending = [r for r in self.batch if not r.done.done()]
+            if not pending:
+                return  # tutti usciti durante la finestra: la connessione in corso viene annullata
+
+            try:
+                vc = await connecting
+            except (discord.DiscordException, asyncio.TimeoutError) as e:
+                service_logger.error("Errore Discord durante la connessione al canale %s: %s", channel, e)
+                for request in pending:
+                    metrics.intros_skipped.inc(guild=self.guild_id, reason="error")
+                    request.finish(False)
+                return
+
+            if segments:
+
+                def keep(member_id: int) -> bool:
+                    # Chiamata dal thread del player all'inizio di ogni clip: la sequenza suona solo in questo canale
+                    current = first.guild.get_member(member_id)
+                    return current is not None and current.voice is not None and current.voice.channel == channel
+
+                source = self._sequence = OpusSequenceSource(segments, keep)
+                now = time.monotonic()
+                for request in pending:
+                    metrics.enqueue_to_play_seconds.observe(now - request.enqueued_at, guild=self.guild_id)
+                metrics.intro_batch_size.observe(len(segments), guild=self.guild_id)
+                service_logger.debug("--- Sequenza di %s intro avviata nel canale %s (%.1fs)", len(segments), channel, source.seconds)
+                try:
+                    with metrics.playback_seconds.time(guild=self.guild_id):
+                        await play_and_wait(vc, source, source.seconds + 2)
+                except (discord.DiscordException, asyncio.TimeoutError) as e:
+                    service_logger.error("Errore Discord durante la sequenza di intro: %s", e)
+                for member_id, _ in segments:
+                    request = next(r for r in pending if r.member_id == member_id)
+                    if member_id in source.played:
+                        metrics.intros_played.inc(guild=self.guild_id)
+                    elif member_id in source.dropped and self._requeue(request):
+                        continue
+                    elif member_id in source.dropped:
+                        metrics.intros_skipped.inc(guild=self.guild_id, reason="left")
+                    request.finish(member_id in source.played)
+                self._sequence = None
+
+            for request in fallback:
+                if request.done.done():
+                    continue  # annullata con cancel durante la sequenza
+                self.current = request
+                request.finish(await self._play(request))
         finally:
-            if vc and vc.is_connected():
-                await vc.disconnect()
-                bot_logger.debug("--- Disconnesso dal canale vocale")
-            queue.task_done()
+            # Connessione non più necessaria o errore nella preparazione: il task non resta orfano
+            connecting.cancel()
+            if connecting.done() and not connecting.cancelled():
+                connecting.exception()
+
+
+# Stato delle code partizionato per shard: ogni processo possiede solo le guild dei propri shard
+shard_schedulers: dict[int, dict[int, GuildScheduler]] = {}
+
+
+def find_scheduler(guild: discord.Guild) -> GuildScheduler | None:
+    return shard_schedulers.get(guild.shard_id, {}).get(guild.id)
+
+
+def get_scheduler(guild: discord.Guild) -> GuildScheduler:
+    partition = shard_schedulers.setdefault(guild.shard_id, {})
+    scheduler = partition.get(guild.id)
+    if scheduler is None:
+        scheduler = partition[guild.id] = GuildScheduler(guild.id, guild.shard_id, GUILD_QUEUE_MAX_DEPTH, GUILD_QUEUE_ENTRY_TTL_SECONDS, GUILD_SCHEDULER_IDLE_SECONDS, INTRO_BATCH_WINDOW_SECONDS)
+    return scheduler
+
+
+def all_schedulers() -> list[GuildScheduler]:
+    return [scheduler for partition in shard_schedulers.values() for scheduler in partition.values()]
+
+
+def shard_load(shard_id: int) -> tuple[int, int]:
+    # (guild con uno scheduler attivo, intro in coda o in riproduzione) per lo shard
+    partition = shard_schedulers.get(shard_id, {})
+    return len(partition), sum(len(s) + (s.current is not None) for s in partition.values())
+
+
+def enqueue_intro(member: discord.Member, priority: int = PRIORITY_JOIN) -> PlayRequest | None:
+    # Ritorna None se la coda della guild è piena
+    request = get_scheduler(member.guild).submit(member, priority)
+    if request is None:
+        service_logger.warning("--- Coda piena (guild %s), intro di %s scartata", member.guild.id, member.name)
+    return request
+
+
+def cancel_intro(guild: discord.Guild, member_id: int) -> bool:
+    scheduler = find_scheduler(guild)
+    return scheduler is not None and scheduler.cancel(member_id)
+
+
+def scheduler_status(guild: discord.Guild) -> SchedulerStatus:
+    scheduler = find_scheduler(guild)
+    return scheduler.status() if scheduler is not None else SchedulerStatus(playing=None, pending=[])
 
 
 async def play_intro_if_available(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState) -> None:
-    bot_logger.debug(f"--- {member.name} Passa da canale {before.channel} a canale {after.channel}")
+    service_logger.debug("--- %s Passa da canale %s a canale %s", member.name, before.channel, after.channel)
 
     if member.bot or before.channel == after.channel or after.channel is None:
         return
 
     guild_id = after.channel.guild.id
 
-    # Enqueue member (check intro exists early to avoid filling queue with no-ops)
-    path = get_intro_path(member.id, guild_id)
-    if not os.path.exists(path):
+    # Enqueue member (check intro exists early to avoid filling queue with no-ops).
+    # Lookup in memoria: nessuna stat sul disco per ogni voice state update.
+    if intro_index.get(guild_id, member.id) is None:
         return
 
-    q = guild_queues.setdefault(guild_id, asyncio.Queue())
-
-    # Start consumer task if not running (check is synchronous — no await between check and create_task)
-    if guild_id not in guild_tasks or guild_tasks[guild_id].done():
-        guild_tasks[guild_id] = asyncio.create_task(guild_player(guild_id, q))
-
-    q.put_nowait(member)
-    bot_logger.debug(f"--- {member.name} aggiunto alla coda (guild {guild_id}, size={q.qsize()})")
+    if enqueue_intro(member) is not None:
+        service_logger.debug("--- %s aggiunto alla coda (guild %s, shard %s, size=%s)", member.name, guild_id, member.guild.shard_id, len(get_scheduler(member.guild)))
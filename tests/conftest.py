@@ -0,0 +1,10 @@
+import os
+import tempfile
+
+# Configurazione minima per importare i moduli del bot senza token né directory del progetto
+_runtime = tempfile.mkdtemp(prefix="introbot-tests-")
+os.environ.setdefault("DISCORD_BOT_TOKEN", "test")
+os.environ.setdefault("DATA_DIR", os.path.join(_runtime, "data"))
+os.environ.setdefault("LOG_DIR", os.path.join(_runtime, "logs"))
+os.makedirs(os.environ["LOG_DIR"], exist_ok=True)
+os.makedirs(os.environ["DATA_DIR"], exist_ok=True)
@@ -0,0 +1,11 @@
+from pathlib import Path
+
+from utils.data_lock import DataDirLock
+
+
+def test_second_holder_is_refused_while_the_lock_is_held(tmp_path: Path) -> None:
+    path = str(tmp_path / "introbot.lock")
+    bot, cli = DataDirLock(path), DataDirLock(path)
+    assert bot.acquire()
+    assert bot.acquire()  # rientrante per lo stesso detentore
+    assert not cli.acquire()
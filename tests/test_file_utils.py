@@ -0,0 +1,65 @@
+import asyncio
+import os
+from pathlib import Path
+
+import pytest
+
+from utils import file_utils
+from utils.intro_index import IntroIndex
+
+
+def test_concurrent_requests_for_one_variant_share_a_transcode(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    root = tmp_path / "intros"
+    root.mkdir()
+    index = IntroIndex(str(root), str(tmp_path / "intro_refs.json"))
+    index.scan()
+    monkeypatch.setattr(file_utils, "intro_index", index)
+    calls: list[str] = []
+
+    async def fake_transcode(src: str, dst: str, priority: int = 0, gain_filters: list[str] | None = None) -> bool:
+        calls.append(dst)
+        await asyncio.sleep(0.05)
+        with open(dst, "wb") as f:
+            f.write(b"opus")
+        return True
+
+    monkeypatch.setattr(file_utils, "transcode_to_opus", fake_transcode)
+
+    async def scenario() -> list[str | None]:
+        for user_id in (1, 2, 3):
+            staged = index.staging_path(5, user_id)
+            os.makedirs(os.path.dirname(staged), exist_ok=True)
+            with open(staged, "wb") as f:
+                f.write(b"same clip")
+            await index.publish(5, user_id, staged)
+        entries = [(user_id, index.get(5, user_id)) for user_id in (1, 2, 3)]
+        return await asyncio.gather(*(file_utils.ensure_opus_cache(entry, 5, user_id) for user_id, entry in entries if entry is not None))
+
+    paths = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert paths == [calls[0]] * 3
+    assert not file_utils._opus_builds
+
+    # L'mtime della copia è nell'indice: le riproduzioni successive non fanno stat
+    def no_stat(path: str) -> float:
+        raise AssertionError(path)
+
+    monkeypatch.setattr(os.path, "getmtime", no_stat)
+    entry = index.get(5, 1)
+    assert entry is not None
+    assert asyncio.run(file_utils.ensure_opus_cache(entry, 5, 1)) == calls[0]
+
+
+@pytest.mark.parametrize(
+    ("url", "video_id"),
+    [
+        ("https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=42", "dQw4w9WgXcQ"),
+        ("https://youtu.be/dQw4w9WgXcQ", "dQw4w9WgXcQ"),
+        ("https://www.youtube.com/", None),
+        ("https://www.youtube.com/watch?v=../../etc", None),
+        ("https://youtu.be/", None),
+        ("https://example.com/watch?v=dQw4w9WgXcQ", None),
+    ],
+)
+def test_youtube_video_id(url: str, video_id: str | None) -> None:
+    assert file_utils.youtube_video_id(url) == video_id
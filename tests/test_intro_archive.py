@@ -0,0 +1,44 @@
+import asyncio
+import io
+import json
+import os
+import tarfile
+from pathlib import Path
+
+import pytest
+
+from utils import file_utils
+from utils.intro_archive import ARCHIVE_VERSION, MANIFEST_NAME, import_guild
+from utils.intro_index import intro_index
+from utils.settings_store import settings_store
+
+GUILD_ID = 4242
+
+
+def test_adopted_ceiling_re_encodes_existing_members(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    built: list[str] = []
+
+    async def fake_transcode(src: str, dst: str, priority: int = 0, gain_filters: list[str] | None = None) -> bool:
+        built.append(os.path.basename(dst))
+        Path(dst).write_bytes(b"opus")
+        return True
+
+    monkeypatch.setattr(file_utils, "transcode_to_opus", fake_transcode)
+    archive = tmp_path / "intros.tar"
+    manifest = json.dumps({"version": ARCHIVE_VERSION, "guild_id": 1, "exported_at": 0, "ceiling_db": -6.0, "intros": []}).encode()
+    with tarfile.open(archive, "w") as tar:
+        info = tarfile.TarInfo(MANIFEST_NAME)
+        info.size = len(manifest)
+        tar.addfile(info, io.BytesIO(manifest))
+
+    async def scenario() -> None:
+        await asyncio.to_thread(intro_index.scan)
+        staged = intro_index.staging_path(GUILD_ID, 1)
+        os.makedirs(os.path.dirname(staged), exist_ok=True)
+        Path(staged).write_bytes(b"existing intro")
+        entry = await intro_index.publish(GUILD_ID, 1, staged)
+        assert await import_guild(str(archive), GUILD_ID) is not None
+        assert built == [f"{entry.blob}.c-6.0.opus"]
+
+    asyncio.run(scenario())
+    assert settings_store.get_ceiling(GUILD_ID) == -6.0
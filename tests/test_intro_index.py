@@ -0,0 +1,92 @@
+import asyncio
+import os
+from pathlib import Path
+
+from utils.intro_index import IntroIndex
+
+
+def _index(tmp_path: Path) -> IntroIndex:
+    root = tmp_path / "intros"
+    root.mkdir()
+    return IntroIndex(str(root), str(tmp_path / "intro_refs.json"))
+
+
+def _publish(index: IntroIndex, guild_id: int, user_id: int, content: bytes) -> str:
+    staged = index.staging_path(guild_id, user_id)
+    os.makedirs(os.path.dirname(staged), exist_ok=True)
+    with open(staged, "wb") as f:
+        f.write(content)
+    return asyncio.run(index.publish(guild_id, user_id, staged)).blob
+
+
+def test_scan_keeps_blobs_when_refs_file_is_corrupt(tmp_path: Path) -> None:
+    index = _index(tmp_path)
+    index.scan()
+    blob = _publish(index, 1, 2, b"intro audio")
+
+    with open(index.refs_path, "w", encoding="utf-8") as f:
+        f.write('{"refs": {"1:2": {"blo')
+
+    reloaded = IntroIndex(index.root, index.refs_path)
+    reloaded.scan()
+    assert os.path.exists(reloaded.blob_path(blob))
+    assert reloaded.has_blob(blob)
+    assert list(tmp_path.glob("intro_refs.json.corrupt-*"))
+
+    # Anche ai riavvii successivi, finché l'indice danneggiato non viene recuperato
+    IntroIndex(index.root, index.refs_path).scan()
+    assert os.path.exists(reloaded.blob_path(blob))
+
+
+def test_scan_collects_unreferenced_blobs_with_a_valid_index(tmp_path: Path) -> None:
+    index = _index(tmp_path)
+    index.scan()
+    kept = _publish(index, 1, 2, b"kept")
+    orphan = index.blob_path("0" * 64)
+    with open(orphan, "wb") as f:
+        f.write(b"orphan")
+
+    reloaded = IntroIndex(index.root, index.refs_path)
+    assert reloaded.scan() == 1
+    entry = reloaded.get(1, 2)
+    assert entry is not None and entry.blob == kept
+    assert not os.path.exists(orphan)
+
+
+def test_import_legacy_links_new_files_without_touching_other_refs(tmp_path: Path) -> None:
+    index = _index(tmp_path)
+    index.scan()
+    kept = _publish(index, 1, 2, b"kept")
+    legacy_dir = tmp_path / "intros" / "7"
+    legacy_dir.mkdir()
+    (legacy_dir / "8.mp3").write_bytes(b"legacy")
+
+    assert asyncio.run(index.import_legacy()) == 1
+    assert not (legacy_dir / "8.mp3").exists()
+    entry = index.get(7, 8)
+    assert entry is not None and os.path.exists(entry.path)
+    assert index.get(1, 2) is not None and index.has_blob(kept)
+
+
+def test_saves_made_on_the_loop_are_coalesced_and_flushed(tmp_path: Path) -> None:
+    index = _index(tmp_path)
+    index.scan()
+    blob = _publish(index, 1, 1, b"shared clip")
+    writes: list[object] = []
+    write = index._writer._write
+
+    def counting_write(data: object) -> None:
+        writes.append(data)
+        write(data)
+
+    index._writer._write = counting_write  # type: ignore[method-assign]
+
+    async def burst() -> None:
+        for user_id in range(2, 52):
+            index.link(1, user_id, blob)
+        await index.flush()
+
+    asyncio.run(burst())
+    assert 1 <= len(writes) < 50
+    reloaded = IntroIndex(index.root, index.refs_path)
+    assert reloaded.scan() == 51
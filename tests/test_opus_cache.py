@@ -0,0 +1,14 @@
+from utils.opus_cache import OpusSequenceSource
+
+
+def test_sequence_skips_only_segments_that_have_not_finished() -> None:
+    source = OpusSequenceSource([(1, (b"a", b"b")), (2, (b"c",)), (3, (b"d",))], lambda _: True)
+    assert source.read() == b"a"
+    assert source.current == 1 and not source.finished(1)
+    assert source.read() == b"b"
+    assert source.read() == b"c"  # il segmento di 1 è concluso
+    assert source.current == 2 and source.finished(1)
+    assert not source.skip(1)
+    assert source.skip(3)
+    assert source.read() == b""
+    assert source.played == [1, 2] and source.finished(3)
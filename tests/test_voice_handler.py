@@ -0,0 +1,152 @@
+import asyncio
+import os
+from collections.abc import Callable
+from typing import Any
+
+import discord
+import pytest
+
+from services import voice_handler
+from services.voice_connection import voice_connections
+from utils.intro_index import IntroEntry, intro_index
+from utils.opus_cache import OpusSequenceSource, opus_frame_cache
+
+
+class FakeVoiceClient:
+    def __init__(self, guild: "FakeGuild", channel: "FakeChannel") -> None:
+        self.guild = guild
+        self.channel = channel
+
+    def is_connected(self) -> bool:
+        return True
+
+    def is_playing(self) -> bool:
+        return False
+
+    def play(self, source: discord.AudioSource, *, after: Callable[[Exception | None], Any]) -> None:
+        # Consuma la sorgente subito, come farebbe il thread del player
+        frames = []
+        while frame := source.read():
+            frames.append(frame)
+        self.guild.played.append((self.channel.id, frames))
+        after(None)
+
+    async def move_to(self, channel: "FakeChannel") -> None:
+        self.channel = channel
+
+
+class FakeChannel:
+    def __init__(self, guild: "FakeGuild", channel_id: int) -> None:
+        self.guild = guild
+        self.id = channel_id
+
+    async def connect(self, *, reconnect: bool = True) -> FakeVoiceClient:
+        self.guild.voice_client = FakeVoiceClient(self.guild, self)
+        return self.guild.voice_client
+
+
+class FakeVoiceState:
+    def __init__(self, channel: FakeChannel | None) -> None:
+        self.channel = channel
+
+
+class FakeMember:
+    def __init__(self, guild: "FakeGuild", member_id: int, channel: FakeChannel) -> None:
+        self.id = member_id
+        self.name = f"member-{member_id}"
+        self.guild = guild
+        self.voice = FakeVoiceState(channel)
+
+
+class FakeGuild:
+    def __init__(self) -> None:
+        self.id = 1
+        self.shard_id = 0
+        self.voice_client: FakeVoiceClient | None = None
+        self.members: dict[int, FakeMember] = {}
+        self.played: list[tuple[int, list[bytes]]] = []
+
+    def get_member(self, member_id: int) -> FakeMember | None:
+        return self.members.get(member_id)
+
+
+def test_member_who_hops_during_a_sequence_is_played_in_the_new_channel(monkeypatch: pytest.MonkeyPatch) -> None:
+    guild = FakeGuild()
+    first, second = FakeChannel(guild, 10), FakeChannel(guild, 20)
+    alice, bob = FakeMember(guild, 1, first), FakeMember(guild, 2, first)
+    guild.members = {1: alice, 2: bob}
+    entry = IntroEntry("blob", "unused.mp3", os.stat_result((0,) * 10), 0.0)
+
+    async def frames(user_id: int, guild_id: int, entry: IntroEntry) -> tuple[bytes, ...]:
+        if user_id == bob.id:
+            bob.voice = FakeVoiceState(second)  # cambia canale dopo la formazione della sequenza
+        return (bytes([user_id]),)
+
+    async def source(user_id: int, guild_id: int, entry: IntroEntry) -> discord.AudioSource:
+        return OpusSequenceSource([(user_id, (bytes([user_id]),))], lambda _: True)
+
+    async def valid(*args: Any, **kwargs: Any) -> bool:
+        return True
+
+    monkeypatch.setattr(intro_index, "get", lambda g, u: entry)
+    monkeypatch.setattr(voice_handler, "validate_audio_file", valid)
+    monkeypatch.setattr(voice_handler, "intro_frames", frames)
+    monkeypatch.setattr(voice_handler, "create_intro_source", source)
+    monkeypatch.setattr(opus_frame_cache, "max_bytes", 1024)
+
+    async def scenario() -> list[bool]:
+        scheduler = voice_handler.GuildScheduler(guild.id, 0, 10, 60, 0.05, batch_window=0.01)
+        requests = [scheduler.submit(member, voice_handler.PRIORITY_JOIN) for member in (alice, bob)]  # type: ignore[arg-type]
+        return await asyncio.gather(*(r.done for r in requests if r is not None))
+
+    assert asyncio.run(scenario()) == [True, True]
+    assert guild.played == [(10, [b"\x01"]), (20, [b"\x02"])]
+
+
+def test_batch_without_playable_intros_does_not_connect(monkeypatch: pytest.MonkeyPatch) -> None:
+    guild = FakeGuild()
+    channel = FakeChannel(guild, 10)
+    alice = FakeMember(guild, 1, channel)
+    guild.members = {1: alice}
+    monkeypatch.setattr(intro_index, "get", lambda g, u: None)
+    monkeypatch.setattr(opus_frame_cache, "max_bytes", 1024)
+
+    async def scenario() -> bool:
+        scheduler = voice_handler.GuildScheduler(guild.id, 0, 10, 60, 0.05, batch_window=0.01)
+        request = scheduler.submit(alice, voice_handler.PRIORITY_JOIN)  # type: ignore[arg-type]
+        assert request is not None
+        return await request.done
+
+    assert asyncio.run(scenario()) is False
+    assert guild.voice_client is None and guild.played == []
+
+
+@pytest.mark.parametrize("batch_window", [0.0, 0.01])
+def test_connect_timeout_finishes_the_request(monkeypatch: pytest.MonkeyPatch, batch_window: float) -> None:
+    guild = FakeGuild()
+    alice = FakeMember(guild, 1, FakeChannel(guild, 10))
+    guild.members = {1: alice}
+    entry = IntroEntry("blob", "unused.mp3", os.stat_result((0,) * 10), 0.0)
+
+    async def valid(*args: Any, **kwargs: Any) -> bool:
+        return True
+
+    async def frames(user_id: int, guild_id: int, entry: IntroEntry) -> tuple[bytes, ...]:
+        return (b"\x01",)
+
+    async def timeout(channel: FakeChannel) -> FakeVoiceClient:
+        raise asyncio.TimeoutError
+
+    monkeypatch.setattr(intro_index, "get", lambda g, u: entry)
+    monkeypatch.setattr(voice_handler, "validate_audio_file", valid)
+    monkeypatch.setattr(voice_handler, "intro_frames", frames)
+    monkeypatch.setattr(voice_connections, "acquire", timeout)
+    monkeypatch.setattr(opus_frame_cache, "max_bytes", 1024)
+
+    async def scenario() -> bool:
+        scheduler = voice_handler.GuildScheduler(guild.id, 0, 10, 60, 0.05, batch_window=batch_window)
+        request = scheduler.submit(alice, voice_handler.PRIORITY_JOIN)  # type: ignore[arg-type]
+        assert request is not None
+        return await asyncio.wait_for(request.done, 1)
+
+    assert asyncio.run(scenario()) is False
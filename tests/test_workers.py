@@ -0,0 +1,100 @@
+import asyncio
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+import workers
+from utils.intro_index import IntroIndex
+
+GUILD_SHARD_0 = 0 << 22
+GUILD_SHARD_1 = 1 << 22
+
+
+def _setup(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> tuple[Path, Path]:
+    data_dir, intro_dir = tmp_path / "data", tmp_path / "data" / "intros"
+    intro_dir.mkdir(parents=True)
+    monkeypatch.setattr(workers, "DATA_DIR", str(data_dir))
+    monkeypatch.setattr(workers, "INTRO_DIR", str(intro_dir))
+    monkeypatch.setattr(workers, "LOG_DIR", str(tmp_path / "logs"))
+    return data_dir, intro_dir
+
+
+def _publish(index: IntroIndex, guild_id: int, content: bytes) -> str:
+    staged = index.staging_path(guild_id, 7)
+    os.makedirs(os.path.dirname(staged), exist_ok=True)
+    Path(staged).write_bytes(content)
+    return asyncio.run(index.publish(guild_id, 7, staged)).blob
+
+
+def _start(workers_list: list[workers.Worker]) -> None:
+    # I passi di main() prima di supervise()
+    sources = workers.migration_sources(workers_list)
+    for worker in workers_list:
+        assert workers.migrate_worker(worker, sources) is not None
+    workers.retire(sources)
+    workers.write_layout(workers_list)
+
+
+def _worker_index(worker: workers.Worker, intro_dir: Path) -> IntroIndex:
+    worker_dir = Path(worker.env["DATA_DIR"])
+    owned = set(worker.shard_ids)
+    index = IntroIndex(str(intro_dir), str(worker_dir / "intro_refs.json"), True, lambda guild_id: (guild_id >> 22) % worker.shard_count in owned)
+    index.scan()
+    return index
+
+
+def test_first_start_migrates_each_guild_to_the_worker_owning_its_shard(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    data_dir, intro_dir = _setup(tmp_path, monkeypatch)
+    single = IntroIndex(str(intro_dir), str(data_dir / "intro_refs.json"))
+    single.scan()
+    blobs = {guild_id: _publish(single, guild_id, content) for guild_id, content in ((GUILD_SHARD_0, b"first"), (GUILD_SHARD_1, b"second"))}
+    (data_dir / "settings.json").write_text(json.dumps({"volumes": {f"{GUILD_SHARD_1}:7": 0.5}, "ceilings": {str(GUILD_SHARD_0): -6.0}}))
+
+    first, second = workers.build_workers(2, 2)
+    assert first.label == "shard-0-0-of-2"
+    assert first.env.get("SYNC_COMMANDS") != "0" and second.env["SYNC_COMMANDS"] == "0"
+    _start([first, second])
+
+    # Lo stato del processo singolo è stato spostato: non verrà più letto né migrato
+    assert not (data_dir / "intro_refs.json").exists() and list((data_dir / "retired").iterdir())
+    for worker, guild_id, other in ((first, GUILD_SHARD_0, GUILD_SHARD_1), (second, GUILD_SHARD_1, GUILD_SHARD_0)):
+        index = _worker_index(worker, intro_dir)
+        entry = index.get(guild_id, 7)
+        assert entry is not None and index.get(other, 7) is None
+        assert entry.path == single.blob_path(blobs[guild_id])  # nessuna copia: storage condiviso
+    assert json.loads((Path(first.env["DATA_DIR"]) / "settings.json").read_text()) == {"volumes": {}, "ceilings": {str(GUILD_SHARD_0): -6.0}}
+    assert json.loads((Path(second.env["DATA_DIR"]) / "settings.json").read_text()) == {"volumes": {f"{GUILD_SHARD_1}:7": 0.5}, "ceilings": {}}
+    assert workers.migration_sources([first, second]) == []
+
+
+def test_reshard_migrates_from_the_previous_workers_and_collects_unreferenced_blobs(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    data_dir, intro_dir = _setup(tmp_path, monkeypatch)
+    (data_dir / "intro_refs.json").write_text(json.dumps({"refs": {}, "sources": {}}))
+    old = workers.build_workers(2, 2)
+    _start(old)
+    first_index, second_index = (_worker_index(worker, intro_dir) for worker in old)
+    kept = _publish(first_index, GUILD_SHARD_0, b"kept")
+    shared = _publish(second_index, GUILD_SHARD_1, b"kept")  # stesso contenuto: un solo blob
+    assert kept == shared
+    dropped = _publish(second_index, GUILD_SHARD_1 + 1, b"dropped")
+    assert second_index.remove(GUILD_SHARD_1 + 1, 7)
+    assert os.path.exists(second_index.blob_path(dropped))  # la rimozione la fa il launcher
+
+    (merged,) = workers.build_workers(1, 1)
+    _start([merged])
+    assert not any(Path(worker.env["DATA_DIR"]).exists() for worker in old)
+    assert workers.collect_shared_store([merged]) == 1
+    index = _worker_index(merged, intro_dir)
+    assert index.get(GUILD_SHARD_0, 7) is not None and index.get(GUILD_SHARD_1, 7) is not None
+    assert os.path.exists(index.blob_path(kept)) and not os.path.exists(index.blob_path(dropped))
+
+
+def test_collection_is_skipped_when_an_index_is_missing(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    data_dir, intro_dir = _setup(tmp_path, monkeypatch)
+    (blob_dir := intro_dir / "blobs").mkdir()
+    (blob_dir / "abc.mp3").write_bytes(b"x")
+    (first,) = workers.build_workers(1, 1)
+    assert workers.collect_shared_store([first]) is None
+    assert (blob_dir / "abc.mp3").exists()
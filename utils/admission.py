@@ -0,0 +1,159 @@
+import asyncio
+import math
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Any, TypeVar
+
+from utils import metrics
+from utils.config import INGEST_GUILD_BURST, INGEST_GUILD_REFILL_SECONDS, INGEST_MAX_CONCURRENT, INGEST_USER_BURST, INGEST_USER_REFILL_SECONDS
+from utils.logger import bot_logger
+
+T = TypeVar("T")
+
+# Stima iniziale della durata di un'ingestione, finché non ne è stata misurata nessuna
+_DEFAULT_JOB_SECONDS = 15.0
+# Oltre questo numero di bucket, quelli di nuovo pieni (equivalenti a un bucket nuovo) vengono rimossi
+_MAX_IDLE_BUCKETS = 1024
+
+
+class TokenBucket:
+    """
+    Token bucket: up to ``capacity`` requests in a burst, then one every ``refill_seconds``.
+    """
+
+    def __init__(self, capacity: int, refill_seconds: float) -> None:
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def wait_time(self, now: float) -> float:
+        # Secondi prima che sia disponibile un gettone (0 = disponibile subito)
+        if self.refill_seconds > 0:
+            self.tokens = min(float(self.capacity), self.tokens + (now - self.updated) / self.refill_seconds)
+        else:
+            self.tokens = float(self.capacity)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) * self.refill_seconds
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    @property
+    def full(self) -> bool:
+        return self.tokens >= self.capacity
+
+
+@dataclass
+class Admission:
+    allowed: bool
+    retry_after: float = 0.0  # rifiutata: secondi prima che una nuova richiesta venga accettata
+    scope: str = ""  # rifiutata: "user" o "guild"
+    expected_wait: float = 0.0  # accettata: attesa stimata per uno slot libero
+    supersedes: bool = False  # accettata: annullerà la richiesta ancora in corso dello stesso utente
+
+
+class IngestAdmission:
+    """
+    Admission control for ingestion commands (``/intro-youtube``, ``/intro-upload``).
+
+    A request needs a token from both the user's and the guild's bucket, otherwise it is refused
+    at once with the time to wait. Admitted jobs share ``max_concurrent`` global slots. Each member
+    has at most one job in flight per guild: a newer request cancels the previous one, whose
+    subprocesses are killed by the pool, and waits for it to wind down before starting.
+    """
+
+    def __init__(self, user_burst: int, user_refill: float, guild_burst: int, guild_refill: float, max_concurrent: int) -> None:
+        self.user_burst = user_burst
+        self.user_refill = user_refill
+        self.guild_burst = guild_burst
+        self.guild_refill = guild_refill
+        self.max_concurrent = max_concurrent
+        self.active = 0
+        self.waiting = 0
+        self._users: dict[int, TokenBucket] = {}
+        self._guilds: dict[int, TokenBucket] = {}
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._job_seconds = _DEFAULT_JOB_SECONDS
+        self._inflight: dict[tuple[int, int], asyncio.Task[Any]] = {}
+
+    def _bucket(self, buckets: dict[int, TokenBucket], key: int, capacity: int, refill: float) -> TokenBucket | None:
+        # capacity <= 0: nessun limite per questo ambito
+        if capacity <= 0:
+            return None
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= _MAX_IDLE_BUCKETS:
+                now = time.monotonic()
+                for stale in [k for k, b in buckets.items() if b.wait_time(now) == 0 and b.full]:
+                    del buckets[stale]
+            bucket = buckets[key] = TokenBucket(capacity, refill)
+        return bucket
+
+    def expected_wait(self) -> float:
+        if self.active + self.waiting < self.max_concurrent:
+            return 0.0
+        return math.ceil((self.waiting + 1) / self.max_concurrent) * self._job_seconds
+
+    def admit(self, guild_id: int, user_id: int) -> Admission:
+        # Decisione immediata, senza attese: il gettone viene consumato solo se entrambi i bucket ne hanno uno
+        now = time.monotonic()
+        user = self._bucket(self._users, user_id, self.user_burst, self.user_refill)
+        guild = self._bucket(self._guilds, guild_id, self.guild_burst, self.guild_refill)
+        for scope, bucket in (("user", user), ("guild", guild)):
+            if bucket is not None and (wait := bucket.wait_time(now)) > 0:
+                metrics.ingest_rejected.inc(scope=scope)
+                return Admission(False, retry_after=wait, scope=scope)
+        for bucket in (user, guild):
+            if bucket is not None:
+                bucket.take()
+        previous = self._inflight.get((guild_id, user_id))
+        return Admission(True, expected_wait=self.expected_wait(), supersedes=previous is not None and not previous.done())
+
+    async def run(self, guild_id: int, user_id: int, job: Callable[[], Awaitable[T]]) -> T | None:
+        # Ritorna None se la richiesta è stata sostituita da una più recente dello stesso utente
+        key = (guild_id, user_id)
+        previous = self._inflight.get(key)
+        if previous is not None and not previous.done():
+            previous.cancel()
+            metrics.ingest_superseded.inc()
+            bot_logger.info("Richiesta di ingestione precedente annullata per utente %s in server %s", user_id, guild_id)
+        # Registrato subito, così un'ulteriore richiesta annulla questa e non di nuovo la precedente
+        task = asyncio.create_task(self._run_job(job, previous))
+        self._inflight[key] = task
+        try:
+            await asyncio.wait([task])
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+        return None if task.cancelled() else task.result()
+
+    async def _run_job(self, job: Callable[[], Awaitable[T]], previous: asyncio.Task[Any] | None) -> T:
+        if previous is not None:
+            # Stesso file di staging: si parte solo dopo la pulizia della richiesta annullata
+            await asyncio.wait([previous])
+        queued_at = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        metrics.ingest_queue_wait_seconds.observe(time.monotonic() - queued_at)
+        self.active += 1
+        metrics.ingest_active.set(self.active)
+        started = time.monotonic()
+        try:
+            return await job()
+        finally:
+            self.active -= 1
+            metrics.ingest_active.set(self.active)
+            self._slots.release()
+            # Media mobile della durata, usata per stimare l'attesa in coda
+            self._job_seconds = 0.8 * self._job_seconds + 0.2 * (time.monotonic() - started)
+
+
+ingest_admission = IngestAdmission(INGEST_USER_BURST, INGEST_USER_REFILL_SECONDS, INGEST_GUILD_BURST, INGEST_GUILD_REFILL_SECONDS, INGEST_MAX_CONCURRENT)
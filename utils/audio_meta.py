@@ -0,0 +1,87 @@
+import json
+import os
+from dataclasses import asdict, dataclass
+
+from utils.config import DATA_DIR
+from utils.logger import bot_logger
+from utils.snapshot_writer import SnapshotWriter
+
+
+@dataclass
+class AudioMeta:
+    mtime_ns: int
+    size: int
+    ino: int
+    duration: float | None  # None = file non leggibile da ffprobe
+
+    def matches(self, st: os.stat_result) -> bool:
+        return self.mtime_ns == st.st_mtime_ns and self.size == st.st_size and self.ino == st.st_ino
+
+
+class AudioMetaStore:
+    """
+    Persistent duration/validity index for audio files, keyed by path and file identity.
+
+    An entry is only trusted while mtime, size and inode still match the file on disk,
+    so a replaced or edited file is transparently re-probed.
+    """
+
+    def __init__(self, index_path: str) -> None:
+        self.index_path = index_path
+        self._entries: dict[str, AudioMeta] | None = None
+        self._writer = SnapshotWriter(index_path, self._snapshot, "indice metadati audio", self._encode)
+
+    def _load(self) -> dict[str, AudioMeta]:
+        if self._entries is None:
+            self._entries = {}
+            try:
+                with open(self.index_path, encoding="utf-8") as f:
+                    raw = json.load(f)
+                self._entries = {path: AudioMeta(**data) for path, data in raw.items()}
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, TypeError) as e:
+                bot_logger.error("Indice metadati audio illeggibile, verrà ricostruito: %s", e)
+        return self._entries
+
+    def _save(self) -> None:
+        # Scrittura coalescente in un thread: una raffica di ffprobe produce una sola scrittura
+        self._writer.schedule()
+
+    def _snapshot(self) -> dict[str, AudioMeta]:
+        # Gli AudioMeta non vengono mai modificati, solo sostituiti: basta una copia superficiale
+        return dict(self._load())
+
+    @staticmethod
+    def _encode(entries: dict[str, AudioMeta]) -> dict[str, dict[str, object]]:
+        return {path: asdict(meta) for path, meta in entries.items()}
+
+    async def flush(self) -> None:
+        await self._writer.flush()
+
+    def lookup(self, path: str, st: os.stat_result) -> AudioMeta | None:
+        meta = self._load().get(path)
+        if meta is not None and meta.matches(st):
+            return meta
+        return None
+
+    def record(self, path: str, st: os.stat_result, duration: float | None) -> None:
+        self._load()[path] = AudioMeta(st.st_mtime_ns, st.st_size, st.st_ino, duration)
+        self._save()
+
+    def move(self, src: str, dst: str) -> None:
+        # os.replace conserva inode e mtime: l'esito della validazione resta valido sul nuovo path
+        entries = self._load()
+        meta = entries.pop(src, None)
+        if meta is None:
+            entries.pop(dst, None)
+        else:
+            entries[dst] = meta
+        self._save()
+
+    def forget(self, path: str) -> None:
+        if self._load().pop(path, None) is not None:
+            self._save()
+
+
+audio_meta_store = AudioMetaStore(os.path.join(DATA_DIR, "audio_meta.json"))
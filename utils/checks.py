@@ -1,8 +1,9 @@
 from typing import Callable, TypeVar
 
-from discord import Interaction
+from discord import Interaction, Member
 from discord.app_commands import check
 
+from utils.config import DISCORD_ADMIN_ROLES, DISCORD_FALLBACK_ID
 from utils.logger import bot_logger
 
 T = TypeVar("T")
@@ -13,9 +14,25 @@ def is_guild_context() -> Callable[[T], T]:
     async def predicate(interaction: Interaction) -> bool:
         if interaction.guild is None:
             command_name = interaction.command.name if interaction.command else "sconosciuto"
-            bot_logger.warning(f"Tentativo di usare comando {command_name} fuori da un server da parte di {interaction.user.id}")
+            bot_logger.warning("Tentativo di usare comando %s fuori da un server da parte di %s", command_name, interaction.user.id)
             await interaction.response.send_message("⛔ Questo comando può essere usato solo in un canale del server.", ephemeral=True)
             return False
         return True
 
     return predicate
+
+
+def is_admin() -> Callable[[T], T]:
+    @check
+    async def predicate(interaction: Interaction) -> bool:
+        user = interaction.user
+        if user.id == DISCORD_FALLBACK_ID:
+            return True
+        if isinstance(user, Member) and any(role.name in DISCORD_ADMIN_ROLES for role in user.roles):
+            return True
+        command_name = interaction.command.name if interaction.command else "sconosciuto"
+        bot_logger.warning("Tentativo di usare comando amministrativo %s da parte di %s", command_name, user.id)
+        await interaction.response.send_message("⛔ Questo comando è riservato agli amministratori.", ephemeral=True)
+        return False
+
+    return predicate
@@ -1,9 +1,10 @@
 # utils/config.py
 
+import json
 import logging
 import os
-import shutil
 import time
+from typing import Any
 
 from dotenv import load_dotenv
 
@@ -15,12 +16,22 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # --- General Settings ---
 DEFAULT_LANG = "en"
-DATA_DIR = os.path.normpath(os.path.join(BASE_DIR, "../data"))
-if not os.path.exists(DATA_DIR):
-    os.makedirs(DATA_DIR)
-INTRO_DIR = os.path.normpath(os.path.join(DATA_DIR, "intros"))
-if not os.path.exists(INTRO_DIR):
-    os.makedirs(INTRO_DIR)
+# Sovrascrivibile per processo: più processi (shard diversi) non devono condividere lo stesso indice
+DATA_DIR = os.path.normpath(os.getenv("DATA_DIR") or os.path.join(BASE_DIR, "../data"))
+# Scritto da workers.py nella DATA_DIR di ogni worker: storage delle intro condiviso tra i worker,
+# directory dati degli altri worker e shard posseduti. Letto anche da cli.py puntato su un worker.
+WORKER_LAYOUT_FILE = "worker.json"
+# Scritto da workers.py nella DATA_DIR di base: da lì i dati sono gestiti dai worker
+WORKERS_LAYOUT_FILE = "workers.json"
+_worker_layout: dict[str, Any] = {}
+try:
+    with open(os.path.join(DATA_DIR, WORKER_LAYOUT_FILE), encoding="utf-8") as _f:
+        _worker_layout = dict(json.load(_f))
+except FileNotFoundError:
+    pass
+SHARED_INTRO_STORE = bool(_worker_layout)
+INTRO_DIR = os.path.normpath(_worker_layout.get("intro_dir") or os.path.join(DATA_DIR, "intros"))
+PEER_DATA_DIRS: list[str] = [str(path) for path in _worker_layout.get("peers", [])]
 
 
 # --- Admin Settings ---
@@ -28,30 +39,115 @@ DISCORD_ADMIN_ROLES = ["Admin", "Boss", "CoffyMaster"]
 DISCORD_FALLBACK_ID = int(os.getenv("DISCORD_FALLBACK_ID", "123456789012345678"))  # Default fallback ID
 
 # --- Logging ---
-LOG_DIR = os.path.normpath(os.path.join(BASE_DIR, "../logs"))
-if not os.path.exists(LOG_DIR):
-    os.makedirs(LOG_DIR)
+LOG_DIR = os.path.normpath(os.getenv("LOG_DIR") or os.path.join(BASE_DIR, "../logs"))
 BOT_LOG_FILE = "bot.log"
 SERVICE_LOG_FILE = "services.log"
 ERROR_LOG_FILE = "errors.log"
 
 # --- API Keys ---
-DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN", "__unset__")
-if DISCORD_BOT_TOKEN == "__unset__":
-    raise ValueError("Variabile d'ambiente DISCORD_BOT_TOKEN non impostata!")
+DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN") or ""
 
 # --- FFmpeg ---
 # Percorso al binario ffmpeg. Impostare FFMPEG_PATH in .env se non è nel PATH di sistema.
 # Esempio: FFMPEG_PATH=C:\ffmpeg\bin\ffmpeg.exe
 FFMPEG_PATH: str = os.getenv("FFMPEG_PATH", "ffmpeg")
-# Risolve il path assoluto (necessario per yt-dlp --ffmpeg-location che non accetta nomi di binari)
-_ffmpeg_abs: str = shutil.which(FFMPEG_PATH) or FFMPEG_PATH
-FFMPEG_DIR: str = os.path.dirname(os.path.abspath(_ffmpeg_abs))
-# ffprobe è derivato automaticamente dalla stessa directory di ffmpeg, ma può essere sovrascritto.
-FFPROBE_PATH: str = os.getenv("FFPROBE_PATH", os.path.join(FFMPEG_DIR, "ffprobe"))
+# ffprobe è derivato dalla stessa directory di ffmpeg, ma può essere sovrascritto. Se FFMPEG_PATH è
+# solo un nome di binario entrambi vengono cercati nel PATH al momento dell'esecuzione (niente which all'import).
+_ffmpeg_dir = os.path.dirname(FFMPEG_PATH)
+FFPROBE_PATH: str = os.getenv("FFPROBE_PATH") or (os.path.join(_ffmpeg_dir, "ffprobe") if _ffmpeg_dir else "ffprobe")
+
+# --- Sharding ---
+# Numero totale di shard del bot (0 = quello raccomandato da Discord) e shard gestiti da questo processo,
+# es. "0-3" o "4,5,6,7" (vuoto = tutti). Più processi sullo stesso host si dividono le guild per shard.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT") or _worker_layout.get("shard_count") or "0")
+SHARD_IDS: list[int] | None = None
+_shard_ids_spec = os.getenv("SHARD_IDS") or str(_worker_layout.get("shard_ids") or "")
+if _shard_ids_spec:
+    SHARD_IDS = []
+    for _part in _shard_ids_spec.split(","):
+        _first, _, _last = _part.strip().partition("-")
+        SHARD_IDS.extend(range(int(_first), int(_last or _first) + 1))
+    if SHARD_COUNT <= 0 or any(shard_id >= SHARD_COUNT for shard_id in SHARD_IDS):
+        raise ValueError("SHARD_IDS richiede SHARD_COUNT impostato e maggiore di ogni shard indicato")
+
+
+def guild_shard(guild_id: int, shard_count: int) -> int:
+    # Formula di Discord: lo shard che riceve gli eventi (e le connessioni vocali) della guild
+    return (guild_id >> 22) % shard_count
+
+
+def owns_guild(guild_id: int) -> bool:
+    return SHARD_IDS is None or guild_shard(guild_id, SHARD_COUNT) in SHARD_IDS
+
+
+# Sincronizzazione dei comandi slash all'avvio; workers.py la lascia al solo primo worker
+SYNC_COMMANDS = (os.getenv("SYNC_COMMANDS") or "true").lower() in ("1", "true", "yes")
+
+# --- Memoria ---
+# Modalità a basso consumo: solo gli intent necessari, nessun chunking dei membri all'avvio,
+# cache membri limitata a chi è in un canale vocale e nessuna cache dei messaggi.
+LOW_MEMORY_MODE = (os.getenv("LOW_MEMORY_MODE") or "false").lower() in ("1", "true", "yes")
+
+# --- Watchdog ---
+# Intervallo (secondi) del battito con cui si misura il ritardo dell'event loop (0 = watchdog disabilitato)
+LOOP_WATCHDOG_INTERVAL = float(os.getenv("LOOP_WATCHDOG_INTERVAL") or "0.5")
+# Oltre questa durata (secondi) un blocco del loop viene loggato con lo stack, e un evento/comando come lento
+SLOW_CALLBACK_SECONDS = float(os.getenv("SLOW_CALLBACK_SECONDS") or "0.25")
+
+# --- Subprocess pool ---
+# Processi esterni concorrenti per strumento; le richieste in eccesso attendono in coda (prima la riproduzione)
+SUBPROCESS_LIMITS: dict[str, int] = {
+    "ffprobe": int(os.getenv("SUBPROCESS_LIMIT_FFPROBE") or "4"),
+    "ffmpeg": int(os.getenv("SUBPROCESS_LIMIT_FFMPEG") or "2"),
+    "yt-dlp": int(os.getenv("SUBPROCESS_LIMIT_YTDLP") or "2"),
+}
+# Secondi massimi di attesa di uno slot libero prima di rinunciare
+SUBPROCESS_QUEUE_TIMEOUT = float(os.getenv("SUBPROCESS_QUEUE_TIMEOUT") or "30")
+
+# --- Metrics ---
+# Porta dell'endpoint Prometheus /metrics (0 = disabilitato). Per default ascolta solo in locale.
+METRICS_PORT = int(os.getenv("METRICS_PORT") or "0")
+METRICS_HOST = os.getenv("METRICS_HOST") or "127.0.0.1"
 
 # --- Intro Settings ---
 INTRO_MAX_SECONDS = 11  # Limite massimo di riproduzione per ogni intro
+# Dimensione massima (byte) di un file caricato con /intro-upload
+INTRO_MAX_UPLOAD_BYTES = int(os.getenv("INTRO_MAX_UPLOAD_BYTES") or str(2 * 1024 * 1024))
+# Bitrate della copia Ogg/Opus pre-transcodificata usata in riproduzione (passthrough, nessuna ricodifica)
+OPUS_BITRATE_KBPS = int(os.getenv("OPUS_BITRATE_KBPS") or "96")
+# Secondi di inattività dopo i quali il bot lascia il canale vocale (la connessione viene riutilizzata tra intro consecutive)
+VOICE_IDLE_SECONDS = float(os.getenv("VOICE_IDLE_SECONDS") or "30")
+# Numero massimo di intro in attesa per guild (i membri già in coda non occupano nuovi posti)
+GUILD_QUEUE_MAX_DEPTH = int(os.getenv("GUILD_QUEUE_MAX_DEPTH") or "25")
+# Secondi dopo i quali un'intro ancora in coda viene scartata (il membro è entrato troppo tempo fa)
+GUILD_QUEUE_ENTRY_TTL_SECONDS = float(os.getenv("GUILD_QUEUE_ENTRY_TTL_SECONDS") or "60")
+# Secondi senza richieste dopo i quali il task e la coda della guild vengono rimossi
+GUILD_SCHEDULER_IDLE_SECONDS = float(os.getenv("GUILD_SCHEDULER_IDLE_SECONDS") or "300")
+# Limiti di /intro-youtube e /intro-upload: richieste consecutive consentite (0 = nessun limite) e secondi per recuperarne una
+INGEST_USER_BURST = int(os.getenv("INGEST_USER_BURST") or "3")
+INGEST_USER_REFILL_SECONDS = float(os.getenv("INGEST_USER_REFILL_SECONDS") or "60")
+INGEST_GUILD_BURST = int(os.getenv("INGEST_GUILD_BURST") or "10")
+INGEST_GUILD_REFILL_SECONDS = float(os.getenv("INGEST_GUILD_REFILL_SECONDS") or "15")
+# Ingestioni (download, validazione, codifica) eseguite contemporaneamente in tutto il bot
+INGEST_MAX_CONCURRENT = max(1, int(os.getenv("INGEST_MAX_CONCURRENT") or "4"))
+# Finestra (secondi) in cui gli ingressi nello stesso canale vengono riprodotti come un'unica sequenza (0 = una intro alla volta)
+INTRO_BATCH_WINDOW_SECONDS = float(os.getenv("INTRO_BATCH_WINDOW_SECONDS") or "0")
+# Filtro ffmpeg di normalizzazione del volume applicato in fase di codifica ("off" = disabilitato)
+INTRO_LOUDNORM_FILTER = os.getenv("INTRO_LOUDNORM_FILTER") or "loudnorm=I=-16:TP=-1.5:LRA=11"
+if INTRO_LOUDNORM_FILTER.lower() == "off":
+    INTRO_LOUDNORM_FILTER = ""
+# Memoria massima (byte) della cache LRU dei frame Opus delle intro più riprodotte; 0 = disabilitata
+OPUS_CACHE_MAX_BYTES = int(os.getenv("OPUS_CACHE_MAX_BYTES") or str(32 * 1024 * 1024))
+# Intervallo (secondi) tra due passate del controllo di integrità dei blob; 0 = disabilitato
+INTEGRITY_SCAN_INTERVAL_SECONDS = float(os.getenv("INTEGRITY_SCAN_INTERVAL_SECONDS") or "3600")
+# Blob verificati per lotto; tra un lotto e l'altro il controllo cede il passo al resto del bot
+INTEGRITY_SCAN_BATCH_SIZE = int(os.getenv("INTEGRITY_SCAN_BATCH_SIZE") or "50")
+# Blob validati, pubblicati e preparati in parallelo durante l'import di un archivio di intro
+IMPORT_WARMUP_CONCURRENCY = int(os.getenv("IMPORT_WARMUP_CONCURRENCY") or "4")
+# Dimensione massima (byte) di un archivio caricato con /intro-import
+IMPORT_MAX_ARCHIVE_BYTES = int(os.getenv("IMPORT_MAX_ARCHIVE_BYTES") or str(25 * 1024 * 1024))
+# Intervallo (secondi) di importazione dei file legacy <guild_id>/<user_id>.mp3 aggiunti fuori dal bot; 0 = disabilitato
+INTRO_INDEX_REFRESH_SECONDS = float(os.getenv("INTRO_INDEX_REFRESH_SECONDS") or "0")
 
 # --- Logging ---
 LOG_LEVEL_ENV = os.getenv("LOG_LEVEL", "INFO")
@@ -59,3 +155,20 @@ valid_levels = logging.getLevelNamesMapping()
 if LOG_LEVEL_ENV not in valid_levels:
     raise ValueError(f"Livello di log '{LOG_LEVEL_ENV}' non valido. Valori validi: {list(valid_levels.keys())}")
 LOG_LEVEL = valid_levels[LOG_LEVEL_ENV]  # Define the log level for use in logger.py
+# Formato dei log su file e console: "text" (default) oppure "json" (un oggetto per riga)
+LOG_FORMAT = (os.getenv("LOG_FORMAT") or "text").lower()
+if LOG_FORMAT not in ("text", "json"):
+    raise ValueError(f"Formato di log '{LOG_FORMAT}' non valido. Valori validi: ['text', 'json']")
+
+
+def require_token() -> None:
+    # Solo per chi si connette a Discord: gli strumenti offline (cli.py) funzionano senza token
+    if not DISCORD_BOT_TOKEN:
+        raise ValueError("Variabile d'ambiente DISCORD_BOT_TOKEN non impostata!")
+
+
+def init_runtime() -> None:
+    # Effetti collaterali dell'avvio, esplicitati invece che eseguiti all'import del modulo:
+    # importare la configurazione (benchmark, strumenti, test) non tocca il filesystem.
+    for path in (DATA_DIR, INTRO_DIR, LOG_DIR):
+        os.makedirs(path, exist_ok=True)
@@ -0,0 +1,48 @@
+import os
+import sys
+
+from utils.config import DATA_DIR, WORKERS_LAYOUT_FILE
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+
+class DataDirLock:
+    """
+    Exclusive, non-blocking lock on a file in ``DATA_DIR``, held until the process exits.
+
+    The bot and ``cli.py`` both keep the intro index and the settings in memory and rewrite
+    their files, so only one of them may work on a data directory at a time. The lock is
+    released by the OS when the process ends, crashes included.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._fd: int | None = None
+
+    def acquire(self) -> bool:
+        # False se un altro processo detiene già il lock
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if sys.platform == "win32":
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+
+# Nome senza ".tmp": cleanup_orphans non deve rimuoverlo
+data_dir_lock = DataDirLock(os.path.join(DATA_DIR, "introbot.lock"))
+
+
+def managed_by_workers() -> bool:
+    # DATA_DIR di base di workers.py: indici e impostazioni sono nelle directory dei worker
+    return os.path.exists(os.path.join(DATA_DIR, WORKERS_LAYOUT_FILE))
@@ -2,49 +2,77 @@ import asyncio
 import os
 import re
 from datetime import datetime, timedelta
-from urllib.parse import urlparse
+from urllib.parse import parse_qs, urlparse
 
-import aiohttp
-
-from utils.config import FFMPEG_DIR, FFPROBE_PATH, INTRO_DIR, INTRO_MAX_SECONDS
+from utils.audio_meta import audio_meta_store
+from utils.config import FFMPEG_PATH, FFPROBE_PATH, INTRO_DIR, INTRO_LOUDNORM_FILTER, INTRO_MAX_SECONDS, INTRO_MAX_UPLOAD_BYTES, OPUS_BITRATE_KBPS
+from utils.http import get_http_session
+from utils.intro_index import IntroEntry, fsync_file, hash_file, intro_index
 from utils.logger import bot_logger
+from utils.opus_cache import opus_frame_cache
+from utils.settings_store import settings_store
+from utils.subprocess_pool import PRIORITY_INGEST, subprocess_pool
 
 
-async def validate_audio_file(path: str, max_seconds: int) -> bool:
+async def probe_audio_duration(path: str, priority: int = PRIORITY_INGEST) -> tuple[float | None, bool]:
+    # Ritorna (durata, cacheable): un timeout è transitorio e non va memorizzato,
+    # un errore di ffprobe indica un file rotto e viene memorizzato come non valido.
     # pydub.from_file() chiama get_prober_name() che usa shutil.which() ignorando
     # qualsiasi path configurato manualmente. Usiamo ffprobe direttamente.
+    command = [FFPROBE_PATH, "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", path]
     try:
-        process = await asyncio.create_subprocess_exec(
-            FFPROBE_PATH,
-            "-v",
-            "error",
-            "-show_entries",
-            "format=duration",
-            "-of",
-            "default=noprint_wrappers=1:nokey=1",
-            path,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
+        result = await subprocess_pool.run("ffprobe", command, timeout=10, priority=priority)
+        if result.timed_out:
+            bot_logger.error("Timeout ffprobe su %s", path)
+            return None, False
+        if result.returncode != 0:
+            bot_logger.error("ffprobe errore su %s: %s", path, result.stderr.decode().strip())
+            return None, True
+        return float(result.stdout.decode().strip()), True
+    except ValueError as e:
+        bot_logger.error("Durata non valida per il file audio %s: %s", path, e)
+        return None, True
+    except Exception as e:
+        bot_logger.error("Errore validazione file audio %s: %s", path, e)
+        return None, False
+
+
+async def validate_audio_file(path: str, max_seconds: int, st: os.stat_result | None = None, priority: int = PRIORITY_INGEST) -> bool:
+    # ffprobe viene eseguito solo se il file non è nell'indice o è cambiato (mtime/size/inode).
+    # Il chiamante può passare uno stat già noto (es. dall'indice intro) per evitare un'altra stat.
+    if st is None:
         try:
-            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=10)
-        except asyncio.TimeoutError:
-            process.kill()
-            bot_logger.error(f"Timeout ffprobe su {path}")
+            st = os.stat(path)
+        except OSError:
             return False
-        if process.returncode != 0:
-            bot_logger.error(f"ffprobe errore su {path}: {stderr.decode().strip()}")
-            return False
-        duration = float(stdout.decode().strip())
-        return duration <= max_seconds
-    except Exception as e:
-        bot_logger.error(f"Errore validazione file audio {path}: {e}")
-        return False
+    meta = audio_meta_store.lookup(path, st)
+    if meta is not None:
+        return meta.duration is not None and meta.duration <= max_seconds
+    duration, cacheable = await probe_audio_duration(path, priority)
+    if cacheable:
+        audio_meta_store.record(path, st, duration)
+    return duration is not None and duration <= max_seconds
 
 
-def is_valid_youtube_url(url: str) -> bool:
+YOUTUBE_VIDEO_ID = re.compile(r"[A-Za-z0-9_-]{11}")
+
+
+def youtube_video_id(url: str) -> str | None:
+    # youtu.be/<id> o youtube.com/watch?v=<id>; None se l'URL non indica un video
     parsed = urlparse(url)
-    return parsed.netloc in ("www.youtube.com", "youtu.be")
+    if parsed.scheme not in ("http", "https"):
+        return None
+    if parsed.netloc == "youtu.be":
+        video_id = parsed.path.lstrip("/")
+    elif parsed.netloc in ("www.youtube.com", "youtube.com", "m.youtube.com") and parsed.path == "/watch":
+        video_id = (parse_qs(parsed.query).get("v") or [""])[0]
+    else:
+        return None
+    return video_id if YOUTUBE_VIDEO_ID.fullmatch(video_id) else None
+
+
+def is_valid_youtube_url(url: str) -> bool:
+    return youtube_video_id(url) is not None
 
 
 def validate_time_format(time_str: str) -> bool:
@@ -55,7 +83,6 @@ def validate_time_format(time_str: str) -> bool:
 async def download_audio_clip(user_id: int, guild_id: int, url: str, start_time: str, end_time: str) -> bool:
     guild_dir = os.path.join(INTRO_DIR, str(guild_id))
     os.makedirs(guild_dir, exist_ok=True)
-    path = os.path.join(guild_dir, f"{user_id}.mp3")
 
     # FIX: validazione singola; rimossi i blocchi doppi irraggiungibili
     if not validate_time_format(start_time):
@@ -85,88 +112,311 @@ async def download_audio_clip(user_id: int, guild_id: int, url: str, start_time:
         if duration <= 0:
             bot_logger.error("end_time deve essere successivo a start_time")
             return False
-        if duration > INTRO_MAX_SECONDS:
-            end_td = start_td + timedelta(seconds=INTRO_MAX_SECONDS)
-            end_time = str(timedelta(seconds=int(end_td.total_seconds()))).split(".")[0]
 
     except ValueError:
         bot_logger.error("start_time e end_time devono essere nel formato HH:MM:SS")
         return False
 
-    command = [
-        "yt-dlp",
-        "--extract-audio",
-        "--audio-format",
-        "mp3",
-        "--audio-quality",
-        "0",
-        "--ffmpeg-location",
-        FFMPEG_DIR,
-        "--postprocessor-args",
-        f"ffmpeg:-ss {start_time} -to {end_time}",
-        "-o",
-        path,
-        url,
-    ]
+    # Stesso video e stesso intervallo già scaricati (da chiunque): si riusa il blob senza scaricare
+    clip_seconds = min(duration, INTRO_MAX_SECONDS)
+    source = f"youtube:{youtube_video_id(url)}:{start_td.total_seconds():.0f}:{clip_seconds:.0f}"
+    existing = intro_index.find_source(source)
+    if existing is not None:
+        entry = intro_index.link(guild_id, user_id, existing, source)
+        await ensure_opus_cache(entry, guild_id, user_id)
+        bot_logger.info("Clip YouTube già presente (%s), riutilizzata per utente %s in server %s", existing[:12], user_id, guild_id)
+        return True
+
+    # Pipeline a passaggio singolo: yt-dlp risolve solo l'URL dello stream audio, poi un unico ffmpeg
+    # fa seek, taglio, normalizzazione e codifica dell'mp3 e della copia opus, riportando la durata.
+    stream_url = await resolve_stream_url(url)
+    if stream_url is None:
+        return False
 
+    path = intro_index.staging_path(guild_id, user_id)
+    opus_path = intro_index.staging_path(guild_id, user_id, ".opus")
+    produced = await encode_intro_clip(stream_url, start_td.total_seconds(), clip_seconds, path, opus_path)
+    if produced is None:
+        return False
+    if produced > INTRO_MAX_SECONDS + 0.5:
+        bot_logger.error("File audio %s troppo lungo (%.2fs)", path, produced)
+        for staged in (path, opus_path):
+            if os.path.exists(staged):
+                os.remove(staged)
+        return False
+    # Durata nota dall'encoder: registrata nell'indice metadati senza un ffprobe aggiuntivo
+    audio_meta_store.record(path, os.stat(path), produced)
+    entry = await intro_index.publish(guild_id, user_id, path, source=source, staged_opus=opus_path)
+    await ensure_opus_cache(entry, guild_id, user_id)
+    bot_logger.info("Clip YouTube salvata per utente %s in server %s (%.2fs)", user_id, guild_id, produced)
+    return True
+
+
+async def resolve_stream_url(url: str) -> str | None:
+    command = ["yt-dlp", "--no-playlist", "--format", "bestaudio/best", "--get-url", url]
     try:
-        process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
         # FIX: aggiunto timeout per evitare hang su URL lenti o bloccati
-        try:
-            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=120)
-        except asyncio.TimeoutError:
-            process.kill()
-            bot_logger.error("Timeout durante il download con yt-dlp")
-            return False
+        result = await subprocess_pool.run("yt-dlp", command, timeout=60)
+        if result.timed_out:
+            bot_logger.error("Timeout durante la risoluzione dello stream con yt-dlp")
+            return None
+        if result.returncode != 0:
+            bot_logger.error("Errore durante la risoluzione dello stream: %s", result.stderr.decode())
+            return None
+        lines = result.stdout.decode().strip().splitlines()
+        return lines[0] if lines else None
+    except Exception as e:
+        bot_logger.error("Errore durante la risoluzione dello stream: %s", e)
+        return None
 
-        if process.returncode == 0:
-            if await validate_audio_file(path, INTRO_MAX_SECONDS):
-                bot_logger.info(f"Download completato: {stdout.decode()}")
-                return True
-            bot_logger.error(f"File audio {path} non valido o troppo lungo")
-            return False
 
-        bot_logger.error(f"Errore durante il download: {stderr.decode()}")
-        return False
+def _opus_output_args() -> list[str]:
+    # 48 kHz stereo con frame da 20 ms: il formato che discord.py invia senza ricodifica
+    return ["-c:a", "libopus", "-b:a", f"{OPUS_BITRATE_KBPS}k", "-ar", "48000", "-ac", "2", "-frame_duration", "20", "-f", "ogg"]
+
+
+def _parse_progress_seconds(output: bytes) -> float | None:
+    # Output di "-progress pipe:1": coppie chiave=valore, l'ultimo out_time_us è la durata prodotta
+    seconds: float | None = None
+    for line in output.decode(errors="replace").splitlines():
+        key, _, value = line.partition("=")
+        if key == "out_time_us" and value.strip().isdigit():
+            seconds = int(value) / 1_000_000
+    return seconds
+
 
+async def encode_intro_clip(source: str, start_seconds: float, seconds: float, mp3_dst: str, opus_dst: str) -> float | None:
+    audio_filter = f"{INTRO_LOUDNORM_FILTER}," if INTRO_LOUDNORM_FILTER else ""
+    mp3_tmp, opus_tmp = f"{mp3_dst}.tmp", f"{opus_dst}.tmp"
+    command = [FFMPEG_PATH, "-y", "-loglevel", "error", "-nostats", "-progress", "pipe:1"]
+    if source.startswith("http"):
+        command += ["-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "5"]
+    command += ["-ss", f"{start_seconds:.3f}", "-t", f"{seconds:.3f}", "-i", source, "-vn"]
+    command += ["-filter_complex", f"[0:a]{audio_filter}asplit=2[mp3][opus]"]
+    command += ["-map", "[mp3]", "-map_metadata", "-1", "-c:a", "libmp3lame", "-q:a", "2", "-ar", "48000", "-f", "mp3", mp3_tmp]
+    command += ["-map", "[opus]", "-map_metadata", "-1", *_opus_output_args(), opus_tmp]
+    try:
+        result = await subprocess_pool.run("ffmpeg", command, timeout=120)
+        if result.timed_out:
+            bot_logger.error("Timeout ffmpeg durante la codifica della clip")
+            return None
+        if result.returncode != 0:
+            bot_logger.error("ffmpeg errore durante la codifica della clip: %s", result.stderr.decode().strip())
+            return None
+        produced = _parse_progress_seconds(result.stdout)
+        if not produced:
+            bot_logger.error("ffmpeg non ha prodotto audio per la clip richiesta")
+            return None
+        # Prima l'mp3, poi l'opus: la copia opus risulta più recente della sorgente e resta valida.
+        # L'mp3 viene sincronizzato su disco da publish; l'opus qui, prima di diventare visibile.
+        await asyncio.to_thread(fsync_file, opus_tmp)
+        os.replace(mp3_tmp, mp3_dst)
+        os.replace(opus_tmp, opus_dst)
+        return produced
     except Exception as e:
-        bot_logger.error(f"Errore durante il download: {e}")
-        return False
+        bot_logger.error("Errore durante la codifica della clip: %s", e)
+        return None
+    finally:
+        for tmp in (mp3_tmp, opus_tmp):
+            if os.path.exists(tmp):
+                os.remove(tmp)
 
 
-async def save_intro_file(file: object, user_id: int, guild_id: int, temp: bool = False) -> bool:
+async def save_intro_file(file: object, user_id: int, guild_id: int) -> bool:
+    # Scarica l'allegato nel file di staging; la pubblicazione avviene dopo la validazione
     if not file.content_type.startswith("audio/") or not file.filename.lower().endswith(".mp3"):  # type: ignore[attr-defined]
-        bot_logger.error(f"File non supportato per utente {user_id} in server {guild_id}")
+        bot_logger.error("File non supportato per utente %s in server %s", user_id, guild_id)
+        return False
+    if file.size > INTRO_MAX_UPLOAD_BYTES:  # type: ignore[attr-defined]
+        bot_logger.error("File troppo grande (%s byte) per utente %s in server %s", file.size, user_id, guild_id)  # type: ignore[attr-defined]
         return False
 
     guild_dir = os.path.join(INTRO_DIR, str(guild_id))
     os.makedirs(guild_dir, exist_ok=True)
-    path = get_intro_path(user_id, guild_id, temp=temp)
+    path = intro_index.staging_path(guild_id, user_id)
 
-    # FIX: aggiunto timeout sulla richiesta HTTP
-    timeout = aiohttp.ClientTimeout(total=30)
+    # Download in streaming sulla sessione condivisa: il limite di dimensione è verificato sia su
+    # Content-Length sia durante la lettura, e le scritture su disco avvengono fuori dal loop.
+    written = 0
     try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(file.url) as resp:  # type: ignore[attr-defined]
-                if resp.status == 200:
-                    with open(path, "wb") as f:
-                        f.write(await resp.read())
-                    bot_logger.info(f"File intro salvato per utente {user_id} in server {guild_id}")
-                    return True
+        async with get_http_session().get(file.url) as resp:  # type: ignore[attr-defined]
+            if resp.status != 200:
+                bot_logger.error("Download allegato fallito (HTTP %s) per utente %s in server %s", resp.status, user_id, guild_id)
+                return False
+            if resp.content_length is not None and resp.content_length > INTRO_MAX_UPLOAD_BYTES:
+                bot_logger.error("Content-Length %s oltre il limite per utente %s in server %s", resp.content_length, user_id, guild_id)
+                return False
+            f = await asyncio.to_thread(open, path, "wb")
+            try:
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    written += len(chunk)
+                    if written > INTRO_MAX_UPLOAD_BYTES:
+                        raise ValueError(f"allegato oltre {INTRO_MAX_UPLOAD_BYTES} byte")
+                    await asyncio.to_thread(f.write, chunk)
+            finally:
+                await asyncio.to_thread(f.close)
+        bot_logger.info("File intro salvato per utente %s in server %s (%s byte)", user_id, guild_id, written)
+        return True
     except Exception as e:
-        bot_logger.error(f"Errore salvataggio file intro per utente {user_id} in server {guild_id}: {e}")
+        bot_logger.error("Errore salvataggio file intro per utente %s in server %s: %s", user_id, guild_id, e)
+        if os.path.exists(path):
+            os.remove(path)
     return False
 
 
-def delete_intro_file(user_id: int, guild_id: int) -> bool:
-    path = get_intro_path(user_id, guild_id)
-    if os.path.exists(path):
+async def transcode_to_opus(src: str, dst: str, priority: int = PRIORITY_INGEST, gain_filters: list[str] | None = None) -> bool:
+    # Transcodifica una volta sola in Ogg/Opus (FFmpegOpusAudio codec="copy" in riproduzione).
+    # Volume e tetto di loudness sono applicati qui, mai con un PCMVolumeTransformer a runtime.
+    # Il pid nel nome: con lo storage condiviso tra worker due processi possono preparare la stessa variante.
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    filters = ([INTRO_LOUDNORM_FILTER] if INTRO_LOUDNORM_FILTER else []) + (gain_filters or [])
+    command = [FFMPEG_PATH, "-y", "-loglevel", "error", "-i", src, "-t", str(INTRO_MAX_SECONDS), "-vn", "-map_metadata", "-1"]
+    if filters:
+        command += ["-af", ",".join(filters)]
+    command += [*_opus_output_args(), tmp]
+    try:
+        result = await subprocess_pool.run("ffmpeg", command, timeout=30, priority=priority)
+        if result.timed_out:
+            bot_logger.error("Timeout ffmpeg durante la transcodifica di %s", src)
+            return False
+        if result.returncode != 0:
+            bot_logger.error("ffmpeg errore durante la transcodifica di %s: %s", src, result.stderr.decode().strip())
+            return False
+        # Una copia troncata da un crash avrebbe comunque un mtime valido e non verrebbe ricostruita
+        await asyncio.to_thread(fsync_file, tmp)
+        os.replace(tmp, dst)
+        return True
+    except Exception as e:
+        bot_logger.error("Errore transcodifica opus %s: %s", src, e)
+        return False
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def opus_variant(guild_id: int, user_id: int) -> tuple[str, list[str]]:
+    # Suffisso del file e filtri ffmpeg per volume dell'utente e tetto del server.
+    # Con le impostazioni di default la variante è la copia opus base del blob (suffisso vuoto).
+    volume = settings_store.get_volume(guild_id, user_id)
+    ceiling_db = settings_store.get_ceiling(guild_id)
+    suffix, filters = "", []
+    if volume != 1.0:
+        suffix += f".g{volume:.2f}"
+        filters.append(f"volume={volume:.2f}")
+    if ceiling_db is not None:
+        # level=disabled: il limiter non deve rialzare il segnale fino al tetto
+        suffix += f".c{ceiling_db:+.1f}"
+        filters.append(f"alimiter=limit={10 ** (ceiling_db / 20):.4f}:level=disabled")
+    return suffix, filters
+
+
+# Transcodifiche opus in corso per file di destinazione: chi chiede la stessa variante attende questa
+_opus_builds: dict[str, asyncio.Task[bool]] = {}
+
+
+async def _build_opus_variant(entry: IntroEntry, dst: str, suffix: str, priority: int, gain_filters: list[str]) -> bool:
+    intro_index.forget_variant(entry.blob, suffix)
+    if not await transcode_to_opus(entry.path, dst, priority, gain_filters):
+        return False
+    intro_index.record_variant(entry.blob, suffix, os.path.getmtime(dst))
+    opus_frame_cache.invalidate(dst)
+    bot_logger.debug("--- Cache opus ricostruita per il blob %s%s", entry.blob[:12], suffix)
+    return True
+
+
+async def ensure_opus_cache(entry: IntroEntry, guild_id: int, user_id: int, priority: int = PRIORITY_INGEST) -> str | None:
+    # Una copia opus per (blob, volume, tetto), condivisa da tutti i riferimenti con le stesse
+    # impostazioni; ricostruita se l'mp3 è più recente. Richieste concorrenti per la stessa
+    # variante condividono un'unica transcodifica (stesso file .tmp, un solo ffmpeg).
+    # L'mtime della copia è tenuto dall'indice: solo il primo uso di una variante esegue una stat.
+    suffix, gain_filters = opus_variant(guild_id, user_id)
+    dst = intro_index.blob_path(entry.blob, f"{suffix}.opus")
+    mtime = intro_index.variant_mtime(entry.blob, suffix)
+    if mtime is None:
+        try:
+            mtime = os.path.getmtime(dst)
+        except OSError:
+            pass
+        else:
+            intro_index.record_variant(entry.blob, suffix, mtime)
+    if mtime is not None and mtime >= entry.stat.st_mtime:
+        return dst
+    task = _opus_builds.get(dst)
+    if task is None:
+        task = asyncio.create_task(_build_opus_variant(entry, dst, suffix, priority, gain_filters))
+        _opus_builds[dst] = task
+        task.add_done_callback(lambda _: _opus_builds.pop(dst, None))
+    # shield: l'annullamento di un chiamante non interrompe la transcodifica attesa dagli altri
+    return dst if await asyncio.shield(task) else None
+
+
+def drop_unused_variant(blob: str, suffix: str) -> None:
+    # Rimuove una variante opus non più usata da nessun riferimento; la copia base resta col blob.
+    # Con lo storage condiviso la variante può servire a un altro worker: resta fino alla rimozione del blob.
+    if not suffix or intro_index.shared or any(opus_variant(g, u)[0] == suffix for g, u in intro_index.references(blob)):
+        return
+    path = intro_index.blob_path(blob, f"{suffix}.opus")
+    opus_frame_cache.invalidate(path)
+    intro_index.forget_variant(blob, suffix)
+    try:
         os.remove(path)
-        bot_logger.info(f"File intro cancellato per utente {user_id} in server {guild_id}")
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        bot_logger.error("Errore rimozione variante opus %s: %s", path, e)
+
+
+async def set_intro_volume(user_id: int, guild_id: int, volume: float) -> bool:
+    # Salva il volume e prepara subito la variante: la riproduzione resta un semplice codec copy
+    previous, _ = opus_variant(guild_id, user_id)
+    settings_store.set_volume(guild_id, user_id, volume)
+    entry = intro_index.get(guild_id, user_id)
+    if entry is None:
         return True
-    return False
+    ready = await ensure_opus_cache(entry, guild_id, user_id)
+    drop_unused_variant(entry.blob, previous)
+    bot_logger.info("Volume intro impostato a %.2f per utente %s in server %s", volume, user_id, guild_id)
+    return ready is not None
 
 
-def get_intro_path(user_id: int, guild_id: int, temp: bool = False) -> str:
-    filename = f"{user_id}.tmp.mp3" if temp else f"{user_id}.mp3"
-    return os.path.join(INTRO_DIR, str(guild_id), filename)
+async def set_guild_ceiling(guild_id: int, ceiling_db: float | None) -> int:
+    # Cambia il tetto del server e ricodifica le varianti dei membri; ritorna quante sono state preparate
+    members = [(user_id, entry) for (g, user_id) in intro_index.guild_members(guild_id) if (entry := intro_index.get(g, user_id)) is not None]
+    previous = {(entry.blob, opus_variant(guild_id, user_id)[0]) for user_id, entry in members}
+    settings_store.set_ceiling(guild_id, ceiling_db)
+    # Una transcodifica per variante (blob, suffisso), anche se condivisa da più membri
+    variants: dict[tuple[str, str], tuple[IntroEntry, int]] = {}
+    for user_id, entry in members:
+        variants.setdefault((entry.blob, opus_variant(guild_id, user_id)[0]), (entry, user_id))
+    results = await asyncio.gather(*(ensure_opus_cache(entry, guild_id, user_id) for entry, user_id in variants.values()))
+    ready = {key for key, path in zip(variants, results, strict=True) if path is not None}
+    for blob, suffix in previous:
+        drop_unused_variant(blob, suffix)
+    bot_logger.info("Tetto di loudness del server %s impostato a %s dBFS (%s intro, %s varianti)", guild_id, ceiling_db, len(members), len(variants))
+    return sum(1 for user_id, entry in members if (entry.blob, opus_variant(guild_id, user_id)[0]) in ready)
+
+
+async def publish_uploaded_intro(user_id: int, guild_id: int) -> IntroEntry | None:
+    # Valida il file in staging e lo pubblica. Se lo stesso contenuto è già nello storage
+    # la validazione usa il risultato in cache del blob esistente (nessun ffprobe).
+    staged = intro_index.staging_path(guild_id, user_id)
+    blob = await asyncio.to_thread(hash_file, staged)
+    check_path = intro_index.blob_path(blob) if intro_index.has_blob(blob) else staged
+    if not await validate_audio_file(check_path, INTRO_MAX_SECONDS):
+        os.remove(staged)
+        audio_meta_store.forget(staged)
+        return None
+    entry = await intro_index.publish(guild_id, user_id, staged, blob=blob)
+    await ensure_opus_cache(entry, guild_id, user_id)
+    return entry
+
+
+def delete_intro_file(user_id: int, guild_id: int) -> bool:
+    # Rimuove il riferimento; il blob viene eliminato se nessun altro lo usa
+    entry = intro_index.get(guild_id, user_id)
+    if intro_index.remove(guild_id, user_id):
+        if entry is not None:
+            drop_unused_variant(entry.blob, opus_variant(guild_id, user_id)[0])
+        bot_logger.info("File intro cancellato per utente %s in server %s", user_id, guild_id)
+        return True
+    return False
@@ -0,0 +1,62 @@
+import asyncio
+import os
+
+from utils.audio_meta import audio_meta_store
+from utils.config import INTRO_MAX_SECONDS
+from utils.file_utils import validate_audio_file
+from utils.intro_index import IntroIndex, hash_file
+from utils.logger import bot_logger
+from utils.subprocess_pool import PRIORITY_BACKGROUND
+
+
+def _same_file(a: os.stat_result, b: os.stat_result) -> bool:
+    return a.st_mtime_ns == b.st_mtime_ns and a.st_size == b.st_size and a.st_ino == b.st_ino
+
+
+async def check_blob(index: IntroIndex, blob: str, known: os.stat_result) -> str | None:
+    # Ritorna il motivo della quarantena, o None se il blob è sano
+    path = index.blob_path(blob)
+    try:
+        st = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
+        return "file mancante"
+    if not _same_file(st, known):
+        # Modificato fuori dal bot: nello storage per contenuto l'hash deve ancora corrispondere al nome
+        if await asyncio.to_thread(hash_file, path) != blob:
+            return "contenuto alterato"
+        index.refresh_blob(blob, st)
+    # Con l'indice metadati aggiornato è solo una lookup; ffprobe gira solo per i file cambiati
+    if not await validate_audio_file(path, INTRO_MAX_SECONDS, st, PRIORITY_BACKGROUND):
+        meta = audio_meta_store.lookup(path, st)
+        if meta is None:
+            return None  # errore transitorio (es. timeout di ffprobe): si riprova alla prossima passata
+        return "audio non valido" if meta.duration is None else f"durata {meta.duration:.1f}s oltre il limite"
+    return None
+
+
+async def scan_integrity(index: IntroIndex, batch_size: int) -> tuple[int, int]:
+    # Una passata completa a lotti; ritorna (blob verificati, blob messi in quarantena)
+    checked = quarantined = 0
+    snapshot = index.blobs()
+    for start in range(0, len(snapshot), batch_size):
+        for blob, known in snapshot[start : start + batch_size]:
+            if not index.has_blob(blob):
+                continue  # rimosso nel frattempo
+            reason = await check_blob(index, blob, known)
+            checked += 1
+            if reason is not None:
+                index.quarantine(blob, reason)
+                quarantined += 1
+        await asyncio.sleep(1)
+    return checked, quarantined
+
+
+async def run_integrity_scan(index: IntroIndex, interval: float, batch_size: int) -> None:
+    # Task a bassa priorità: i file rotti vengono tolti dall'indice prima che il percorso vocale li incontri
+    while True:
+        try:
+            checked, quarantined = await scan_integrity(index, batch_size)
+            bot_logger.info("--- Controllo di integrità completato: %s blob verificati, %s in quarantena", checked, quarantined)
+        except Exception as e:
+            bot_logger.error("Errore nel controllo di integrità delle intro: %s", e)
+        await asyncio.sleep(interval)
@@ -0,0 +1,265 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import re
+import tarfile
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Any
+
+import discord
+
+from utils.audio_meta import audio_meta_store
+from utils.config import DATA_DIR, IMPORT_MAX_ARCHIVE_BYTES, IMPORT_WARMUP_CONCURRENCY, INTRO_MAX_SECONDS, INTRO_MAX_UPLOAD_BYTES
+from utils.file_utils import ensure_opus_cache, set_guild_ceiling, validate_audio_file
+from utils.http import get_http_session
+from utils.intro_index import IntroEntry, intro_index
+from utils.logger import bot_logger
+from utils.opus_cache import opus_frame_cache, read_opus_frames
+from utils.settings_store import settings_store
+from utils.subprocess_pool import PRIORITY_INGEST
+
+ARCHIVE_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+_BLOB_MEMBER = re.compile(r"^blobs/([0-9a-f]{64})\.mp3$")
+
+
+@dataclass
+class ImportReport:
+    imported: int = 0
+    skipped: int = 0  # membri che hanno già un'intro (senza overwrite)
+    invalid: int = 0  # hash errato, audio non valido o blob mancante nell'archivio
+    warmed: int = 0  # intro con copia opus pronta e frame in memoria
+
+
+def archive_tmp_path(guild_id: int, kind: str) -> str:
+    # Nome con ".tmp": un file rimasto da un crash viene rimosso da cleanup_orphans all'avvio
+    return os.path.join(DATA_DIR, f"{kind}-{guild_id}.tmp.tar")
+
+
+def build_manifest(guild_id: int) -> dict[str, Any]:
+    intros = []
+    for g, user_id in intro_index.guild_members(guild_id):
+        entry = intro_index.get(g, user_id)
+        if entry is None:
+            continue
+        meta = audio_meta_store.lookup(entry.path, entry.stat)
+        intros.append(
+            {
+                "user_id": user_id,
+                "blob": entry.blob,
+                "duration": meta.duration if meta is not None else None,
+                "volume": settings_store.get_volume(guild_id, user_id),
+                "created": entry.created,
+            }
+        )
+    return {"version": ARCHIVE_VERSION, "guild_id": guild_id, "exported_at": time.time(), "ceiling_db": settings_store.get_ceiling(guild_id), "intros": intros}
+
+
+def write_archive(manifest: dict[str, Any], dst: str) -> None:
+    # Bloccante: va eseguito con asyncio.to_thread. Il manifest è il primo membro, così l'import
+    # può leggere l'archivio in streaming; ogni blob compare una sola volta anche se condiviso.
+    tmp = f"{dst}.tmp"
+    try:
+        with tarfile.open(tmp, "w") as tar:
+            data = json.dumps(manifest, indent=1).encode()
+            info = tarfile.TarInfo(MANIFEST_NAME)
+            info.size, info.mtime = len(data), int(manifest["exported_at"])
+            tar.addfile(info, io.BytesIO(data))
+            for blob in sorted({item["blob"] for item in manifest["intros"]}):
+                tar.add(intro_index.blob_path(blob), arcname=f"blobs/{blob}.mp3")
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+async def export_guild(guild_id: int, dst: str) -> int | None:
+    # Ritorna il numero di intro esportate, None in caso di errore
+    manifest = build_manifest(guild_id)
+    try:
+        await asyncio.to_thread(write_archive, manifest, dst)
+    except (OSError, tarfile.TarError) as e:
+        bot_logger.error("Errore esportazione intro del server %s: %s", guild_id, e)
+        return None
+    bot_logger.info("Esportate %s intro del server %s in %s", len(manifest["intros"]), guild_id, dst)
+    return len(manifest["intros"])
+
+
+async def download_archive(url: str, dst: str) -> bool:
+    # Download in streaming sulla sessione condivisa, come gli allegati di /intro-upload
+    written = 0
+    try:
+        async with get_http_session().get(url) as resp:
+            if resp.status != 200:
+                bot_logger.error("Download archivio fallito (HTTP %s)", resp.status)
+                return False
+            f = await asyncio.to_thread(open, dst, "wb")
+            try:
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    written += len(chunk)
+                    if written > IMPORT_MAX_ARCHIVE_BYTES:
+                        raise ValueError(f"archivio oltre {IMPORT_MAX_ARCHIVE_BYTES} byte")
+                    await asyncio.to_thread(f.write, chunk)
+            finally:
+                await asyncio.to_thread(f.close)
+        return True
+    except Exception as e:
+        bot_logger.error("Errore download archivio intro: %s", e)
+        if os.path.exists(dst):
+            os.remove(dst)
+    return False
+
+
+def _parse_manifest(raw: bytes) -> tuple[dict[str, list[tuple[int, float]]], float | None]:
+    # (blob -> [(user_id, volume)], tetto del server); solleva ValueError/KeyError/TypeError se il manifest non è valido
+    manifest = json.loads(raw)
+    if manifest.get("version") != ARCHIVE_VERSION:
+        raise ValueError(f"versione archivio non supportata: {manifest.get('version')}")
+    wanted: dict[str, list[tuple[int, float]]] = {}
+    for item in manifest["intros"]:
+        blob, user_id, volume = str(item["blob"]), int(item["user_id"]), float(item.get("volume", 1.0))
+        if not _BLOB_MEMBER.match(f"blobs/{blob}.mp3") or not 0.0 <= volume <= 1.0:
+            raise ValueError(f"voce non valida per l'utente {user_id}")
+        wanted.setdefault(blob, []).append((user_id, round(volume, 2)))
+    ceiling = manifest.get("ceiling_db")
+    return wanted, float(ceiling) if ceiling is not None else None
+
+
+def _extract_verified(tar: tarfile.TarFile, member: tarfile.TarInfo, blob: str) -> str | None:
+    # Bloccante: copia il blob in un file di staging verificando l'hash durante la lettura.
+    # Nome univoco: import concorrenti dello stesso blob (anche da altri worker) non si sovrascrivono.
+    src = tar.extractfile(member)
+    if src is None:
+        return None
+    fd, dst = tempfile.mkstemp(prefix=f"{blob}.", suffix=".import.tmp.mp3", dir=intro_index.blob_dir)
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: src.read(1024 * 1024), b""):
+                digest.update(chunk)
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.remove(dst)
+        raise
+    if digest.hexdigest() != blob:
+        os.remove(dst)
+        return None
+    return dst
+
+
+async def _warm_up(entries: list[tuple[int, IntroEntry]], guild_id: int) -> int:
+    # Copia opus della variante di ogni membro e frame nella cache in memoria: la prima riproduzione
+    # dopo l'import non esegue né ffprobe né ffmpeg né letture da disco.
+    ready = 0
+    loaded: set[str] = set()
+    for user_id, entry in entries:
+        opus_path = await ensure_opus_cache(entry, guild_id, user_id, PRIORITY_INGEST)
+        if opus_path is None:
+            continue
+        ready += 1
+        if opus_frame_cache.max_bytes > 0 and opus_path not in loaded:
+            loaded.add(opus_path)
+            try:
+                opus_frame_cache.put(opus_path, await asyncio.to_thread(read_opus_frames, opus_path))
+            except (OSError, discord.DiscordException) as e:
+                bot_logger.error("Copia opus %s illeggibile: %s", opus_path, e)
+    return ready
+
+
+async def _import_blob(blob: str, staged: str | None, users: list[tuple[int, float]], guild_id: int, report: ImportReport, slots: asyncio.Semaphore) -> None:
+    try:
+        if staged is not None and not await validate_audio_file(staged, INTRO_MAX_SECONDS, priority=PRIORITY_INGEST):
+            os.remove(staged)
+            audio_meta_store.forget(staged)
+            report.invalid += len(users)
+            return
+        entries: list[tuple[int, IntroEntry]] = []
+        for user_id, volume in users:
+            # Volume prima della pubblicazione: la variante opus corretta viene preparata una volta sola
+            settings_store.set_volume(guild_id, user_id, volume)
+            if staged is not None and not entries:
+                entry = await intro_index.publish(guild_id, user_id, staged, blob=blob)
+            else:
+                entry = intro_index.link(guild_id, user_id, blob)
+            entries.append((user_id, entry))
+        report.imported += len(entries)
+        ready = await _warm_up(entries, guild_id)
+        report.warmed += ready
+    finally:
+        slots.release()
+
+
+async def import_guild(src: str, guild_id: int, overwrite: bool = False) -> ImportReport | None:
+    # Legge l'archivio in streaming (manifest, poi un blob alla volta) e valida, pubblica e prepara
+    # ogni blob in parallelo con al massimo IMPORT_WARMUP_CONCURRENCY blob in lavorazione: la lettura
+    # dell'archivio si ferma finché non si libera uno slot. Ritorna None se l'archivio non è valido.
+    report = ImportReport()
+    slots = asyncio.Semaphore(IMPORT_WARMUP_CONCURRENCY)
+    tasks: list[asyncio.Task[None]] = []
+    try:
+        tar = await asyncio.to_thread(tarfile.open, src, "r|*")
+    except (OSError, tarfile.TarError) as e:
+        bot_logger.error("Archivio intro %s illeggibile: %s", src, e)
+        return None
+    try:
+        member = await asyncio.to_thread(tar.next)
+        manifest_file = tar.extractfile(member) if member is not None and member.name == MANIFEST_NAME else None
+        if manifest_file is None:
+            bot_logger.error("Archivio intro %s senza %s in testa", src, MANIFEST_NAME)
+            return None
+        wanted, ceiling = _parse_manifest(await asyncio.to_thread(manifest_file.read))
+
+        if not overwrite:
+            for blob, users in wanted.items():
+                kept = [(u, v) for u, v in users if intro_index.get(guild_id, u) is None]
+                report.skipped += len(users) - len(kept)
+                users[:] = kept
+        # Il tetto del server di origine viene adottato solo se quello di destinazione non ne ha uno;
+        # come per /intro-ceiling, le varianti dei membri già presenti vengono ricodificate.
+        if ceiling is not None and settings_store.get_ceiling(guild_id) is None:
+            await set_guild_ceiling(guild_id, ceiling)
+
+        # Blob già presenti nello storage: nessuna estrazione, solo collegamento e warm-up
+        for blob in [b for b, users in wanted.items() if users and intro_index.has_blob(b)]:
+            await slots.acquire()
+            tasks.append(asyncio.create_task(_import_blob(blob, None, wanted.pop(blob), guild_id, report, slots)))
+
+        while (member := await asyncio.to_thread(tar.next)) is not None:
+            match = _BLOB_MEMBER.match(member.name)
+            if match is None or not member.isfile():
+                continue
+            blob = match.group(1)
+            users = wanted.pop(blob, [])
+            if not users:
+                continue
+            if member.size > INTRO_MAX_UPLOAD_BYTES:
+                bot_logger.error("Blob %s nell'archivio oltre %s byte, ignorato", blob[:12], INTRO_MAX_UPLOAD_BYTES)
+                report.invalid += len(users)
+                continue
+            await slots.acquire()
+            staged = await asyncio.to_thread(_extract_verified, tar, member, blob)
+            if staged is None:
+                slots.release()
+                bot_logger.error("Blob %s nell'archivio con hash errato, ignorato", blob[:12])
+                report.invalid += len(users)
+                continue
+            tasks.append(asyncio.create_task(_import_blob(blob, staged, users, guild_id, report, slots)))
+
+        report.invalid += sum(len(users) for users in wanted.values())
+        await asyncio.gather(*tasks)
+    except (OSError, tarfile.TarError, ValueError, KeyError, TypeError) as e:
+        bot_logger.error("Errore importazione archivio intro %s: %s", src, e)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return None
+    finally:
+        tar.close()
+    bot_logger.info("Importate %s intro nel server %s (già presenti %s, non valide %s, pronte in cache %s)", report.imported, guild_id, report.skipped, report.invalid, report.warmed)
+    return report
@@ -0,0 +1,405 @@
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from utils.audio_meta import audio_meta_store
+from utils.config import DATA_DIR, INTRO_DIR, PEER_DATA_DIRS, SHARED_INTRO_STORE, owns_guild
+from utils.logger import bot_logger
+from utils.opus_cache import opus_frame_cache
+from utils.snapshot_writer import SnapshotWriter
+
+
+@dataclass(frozen=True)
+class IntroEntry:
+    blob: str
+    path: str
+    stat: os.stat_result
+    created: float
+
+
+@dataclass
+class _Ref:
+    blob: str
+    created: float
+    source: str | None = None
+
+
+def hash_file(path: str) -> str:
+    # Bloccante: va eseguito con asyncio.to_thread
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class IntroIndex:
+    """
+    Content-addressed intro storage with an in-memory (guild_id, user_id) index.
+
+    Audio is stored once per distinct content as ``blobs/<sha256>.mp3`` (plus its ``.opus``
+    playback copy and any per-volume ``.opus`` variants); each member's intro is a reference to a blob, persisted in ``intro_refs.json``
+    together with the source (e.g. a YouTube URL and time range) that produced it. A blob is
+    deleted as soon as its last reference goes away. The voice path only does dict lookups.
+
+    With ``shared`` (workers started by ``workers.py``) the blob directory is shared with other
+    processes, each indexing only the guilds ``owns_guild`` accepts: blobs already on disk are
+    reused whoever wrote them, YouTube sources of ``peer_refs`` are reused too, and blobs are
+    never deleted here — the launcher collects unreferenced ones before starting the workers.
+    """
+
+    def __init__(self, root: str, refs_path: str, shared: bool = False, owns_guild: Callable[[int], bool] | None = None, peer_refs: list[str] | None = None) -> None:
+        self.root = root
+        self.shared = shared
+        self.owns_guild = owns_guild or (lambda guild_id: True)
+        self.peer_refs = peer_refs or []
+        self._peer_sources: dict[str, str] = {}
+        self.blob_dir = os.path.join(root, "blobs")
+        self.quarantine_dir = os.path.join(root, "quarantine")
+        self.refs_path = refs_path
+        self._refs: dict[tuple[int, int], _Ref] = {}
+        self._sources: dict[str, str] = {}
+        self._blobs: dict[str, os.stat_result] = {}
+        # mtime delle copie opus già verificate, per suffisso di variante: la riproduzione non fa stat
+        self._variants: dict[str, dict[str, float]] = {}
+        self._refcount: Counter[str] = Counter()
+        self._writer = SnapshotWriter(refs_path, self._snapshot, "indice intro", self._encode)
+
+    def __len__(self) -> int:
+        return len(self._refs)
+
+    def blob_path(self, blob: str, ext: str = ".mp3") -> str:
+        return os.path.join(self.blob_dir, f"{blob}{ext}")
+
+    def staging_path(self, guild_id: int, user_id: int, ext: str = ".mp3") -> str:
+        return os.path.join(self.root, str(guild_id), f"{user_id}.tmp{ext}")
+
+    def has_blob(self, blob: str) -> bool:
+        if blob in self._blobs:
+            return True
+        if not self.shared:
+            return False
+        # Storage condiviso: il blob può essere stato pubblicato da un altro worker
+        try:
+            self._blobs[blob] = os.stat(self.blob_path(blob))
+        except OSError:
+            return False
+        return True
+
+    def blobs(self) -> list[tuple[str, os.stat_result]]:
+        return list(self._blobs.items())
+
+    def get(self, guild_id: int, user_id: int) -> IntroEntry | None:
+        ref = self._refs.get((guild_id, user_id))
+        if ref is None:
+            return None
+        st = self._blobs.get(ref.blob)
+        if st is None:
+            return None
+        return IntroEntry(ref.blob, self.blob_path(ref.blob), st, ref.created)
+
+    def references(self, blob: str) -> list[tuple[int, int]]:
+        return [key for key, ref in self._refs.items() if ref.blob == blob]
+
+    def guild_members(self, guild_id: int) -> list[tuple[int, int]]:
+        return [key for key in self._refs if key[0] == guild_id]
+
+    def find_source(self, source: str) -> str | None:
+        blob = self._sources.get(source) or self._peer_sources.get(source)
+        return blob if blob is not None and self.has_blob(blob) else None
+
+    # --- Persistenza ---
+
+    def _save(self) -> None:
+        # Scrittura coalescente in un thread: sul loop resta solo la copia dei due dizionari
+        self._writer.schedule()
+
+    def _snapshot(self) -> tuple[dict[tuple[int, int], _Ref], dict[str, str]]:
+        # I _Ref non vengono mai modificati, solo sostituiti: basta una copia superficiale
+        return dict(self._refs), dict(self._sources)
+
+    @staticmethod
+    def _encode(snapshot: tuple[dict[tuple[int, int], _Ref], dict[str, str]]) -> dict[str, object]:
+        refs, sources = snapshot
+        return {"refs": {f"{g}:{u}": {"blob": r.blob, "created": r.created, "source": r.source} for (g, u), r in refs.items()}, "sources": sources}
+
+    async def flush(self) -> None:
+        await self._writer.flush()
+
+    def scan(self) -> int:
+        # Bloccante, solo all'avvio (prima di qualsiasi modifica sul loop). Carica i riferimenti, verifica
+        # i blob presenti, importa eventuali file legacy <guild_id>/<user_id>.mp3 e rimuove i blob non
+        # referenziati. I blob non contengono il proprietario: se l'indice manca o è illeggibile non si
+        # rimuove nulla, altrimenti un file troncato da un crash cancellerebbe tutte le intro. Con lo
+        # storage condiviso i blob degli altri worker risultano non referenziati: nessuna rimozione.
+        os.makedirs(self.blob_dir, exist_ok=True)
+        refs: dict[tuple[int, int], _Ref] = {}
+        sources: dict[str, str] = {}
+        refs_loaded = False
+        try:
+            with open(self.refs_path, encoding="utf-8") as f:
+                raw = json.load(f)
+            for key, value in raw.get("refs", {}).items():
+                guild_id, user_id = key.split(":")
+                refs[(int(guild_id), int(user_id))] = _Ref(value["blob"], value["created"], value.get("source"))
+            sources = dict(raw.get("sources", {}))
+            refs_loaded = True
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            refs, sources = {}, {}
+            aside = f"{self.refs_path}.corrupt-{int(time.time())}"
+            try:
+                os.replace(self.refs_path, aside)
+            except OSError as move_error:
+                bot_logger.error("Impossibile spostare l'indice intro illeggibile: %s", move_error)
+            bot_logger.error("Indice intro illeggibile, spostato in %s; i blob vengono conservati: %s", aside, e)
+        corrupt = glob.glob(f"{glob.escape(self.refs_path)}.corrupt-*")
+        if corrupt:
+            # Finché l'indice danneggiato non viene recuperato o rimosso, nessun blob viene eliminato
+            bot_logger.warning("--- Indice intro danneggiato da recuperare (%s): rimozione dei blob non referenziati sospesa", ", ".join(corrupt))
+
+        blobs: dict[str, os.stat_result] = {}
+        with os.scandir(self.blob_dir) as it:
+            for item in it:
+                stem, ext = os.path.splitext(item.name)
+                if ext == ".mp3" and item.is_file():
+                    blobs[stem] = item.stat()
+
+        for (guild_id, user_id), path in self._legacy_files():
+            try:
+                blob = hash_file(path)
+                dst = self.blob_path(blob)
+                if blob in blobs:
+                    os.remove(path)
+                else:
+                    os.replace(path, dst)
+                    blobs[blob] = os.stat(dst)
+                refs[(guild_id, user_id)] = _Ref(blob, blobs[blob].st_mtime)
+                legacy_opus = os.path.join(os.path.dirname(path), f"{user_id}.opus")
+                if os.path.exists(legacy_opus):
+                    os.remove(legacy_opus)
+            except OSError as e:
+                bot_logger.error("Errore importazione intro legacy %s: %s", path, e)
+
+        refs = {key: ref for key, ref in refs.items() if ref.blob in blobs}
+        sources = {key: blob for key, blob in sources.items() if blob in blobs}
+        refcount = Counter(ref.blob for ref in refs.values())
+        if self.shared:
+            # Solo i blob propri: il controllo di integrità non ripete il lavoro degli altri worker
+            blobs = {blob: st for blob, st in blobs.items() if refcount[blob] > 0}
+            self._peer_sources = self._load_peer_sources()
+        elif refs_loaded and not corrupt:
+            for blob in [b for b in blobs if refcount[b] == 0]:
+                self._delete_blob(blob)
+                del blobs[blob]
+                sources = {key: b for key, b in sources.items() if b != blob}
+
+        self._refs, self._sources, self._blobs, self._refcount = refs, sources, blobs, refcount
+        self._save()
+        return len(refs)
+
+    def _load_peer_sources(self) -> dict[str, str]:
+        # Sorgenti YouTube degli altri worker, in sola lettura e aggiornate a ogni avvio
+        sources: dict[str, str] = {}
+        for path in self.peer_refs:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    sources.update({str(key): str(blob) for key, blob in json.load(f).get("sources", {}).items()})
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, TypeError, AttributeError) as e:
+                bot_logger.warning("--- Sorgenti di %s illeggibili, ignorate: %s", path, e)
+        return sources
+
+    def cleanup_orphans(self) -> int:
+        # Bloccante, solo all'avvio (nessuna scrittura in corso): rimuove i file temporanei lasciati
+        # da un crash durante upload, codifica o salvataggio dell'indice. I file pubblicati non sono
+        # mai temporanei: ogni percorso di scrittura scrive su .tmp e pubblica con os.replace.
+        # Con lo storage condiviso la radice e i blob (dove scrivono anche gli altri worker) vengono
+        # puliti da workers.py prima dell'avvio; qui solo la directory dati e le guild possedute.
+        removed = 0
+        dirs = [os.path.dirname(self.refs_path)] if self.shared else [self.root, self.blob_dir, os.path.dirname(self.refs_path)]
+        if os.path.isdir(self.root):
+            dirs += [entry.path for entry in os.scandir(self.root) if entry.is_dir() and entry.name.isdigit() and self.owns_guild(int(entry.name))]
+        for directory in dirs:
+            if not os.path.isdir(directory):
+                continue
+            with os.scandir(directory) as it:
+                for item in it:
+                    if ".tmp" in item.name and item.is_file():
+                        try:
+                            os.remove(item.path)
+                            audio_meta_store.forget(item.path)
+                            removed += 1
+                        except OSError as e:
+                            bot_logger.error("Errore rimozione file temporaneo %s: %s", item.path, e)
+        return removed
+
+    def _legacy_files(self) -> list[tuple[tuple[int, int], str]]:
+        found: list[tuple[tuple[int, int], str]] = []
+        for guild_dir in os.scandir(self.root):
+            if not guild_dir.is_dir() or not guild_dir.name.isdigit() or not self.owns_guild(int(guild_dir.name)):
+                continue
+            with os.scandir(guild_dir.path) as it:
+                for item in it:
+                    stem, ext = os.path.splitext(item.name)
+                    if ext == ".mp3" and stem.isdigit() and item.is_file():
+                        found.append(((int(guild_dir.name), int(stem)), item.path))
+        return found
+
+    # --- Modifiche (sul loop) ---
+
+    async def publish(self, guild_id: int, user_id: int, staged_path: str, source: str | None = None, staged_opus: str | None = None, blob: str | None = None) -> IntroEntry:
+        # Sposta il file già validato nello storage per contenuto; se il blob esiste già il file viene scartato
+        await asyncio.to_thread(fsync_file, staged_path)
+        if blob is None:
+            blob = await asyncio.to_thread(hash_file, staged_path)
+        dst = self.blob_path(blob)
+        if self.has_blob(blob):
+            os.remove(staged_path)
+            audio_meta_store.forget(staged_path)
+            if staged_opus is not None and os.path.exists(staged_opus):
+                os.remove(staged_opus)
+        else:
+            os.makedirs(self.blob_dir, exist_ok=True)
+            os.replace(staged_path, dst)
+            audio_meta_store.move(staged_path, dst)
+            if staged_opus is not None and os.path.exists(staged_opus):
+                opus_dst = self.blob_path(blob, ".opus")
+                os.replace(staged_opus, opus_dst)
+                os.utime(opus_dst)  # la copia opus deve risultare non più vecchia dell'mp3
+            self._blobs[blob] = os.stat(dst)
+        if source is not None:
+            self._sources[source] = blob
+        entry = self.link(guild_id, user_id, blob, source)
+        # L'intro viene confermata solo quando il riferimento è su disco (scritto fuori dal loop)
+        await self.flush()
+        return entry
+
+    async def import_legacy(self) -> int:
+        # Importa i file legacy <guild_id>/<user_id>.mp3 comparsi mentre il bot è in esecuzione.
+        # Solo lettura e hash in un thread: ogni modifica all'indice avviene sul loop tramite publish,
+        # senza rileggere intro_refs.json né rimuovere blob.
+        imported = 0
+        for (guild_id, user_id), path in await asyncio.to_thread(self._legacy_files):
+            try:
+                blob = await asyncio.to_thread(hash_file, path)
+                await self.publish(guild_id, user_id, path, blob=blob)
+                legacy_opus = os.path.join(os.path.dirname(path), f"{user_id}.opus")
+                if os.path.exists(legacy_opus):
+                    os.remove(legacy_opus)
+                imported += 1
+            except OSError as e:
+                bot_logger.error("Errore importazione intro legacy %s: %s", path, e)
+        return imported
+
+    def link(self, guild_id: int, user_id: int, blob: str, source: str | None = None) -> IntroEntry:
+        self.has_blob(blob)  # storage condiviso: registra un blob pubblicato da un altro worker
+        previous = self._refs.get((guild_id, user_id))
+        self._refs[(guild_id, user_id)] = _Ref(blob, time.time(), source)
+        self._refcount[blob] += 1
+        if previous is not None:
+            self._release(previous.blob)
+        self._save()
+        entry = self.get(guild_id, user_id)
+        assert entry is not None
+        return entry
+
+    def variant_mtime(self, blob: str, suffix: str) -> float | None:
+        return self._variants.get(blob, {}).get(suffix)
+
+    def record_variant(self, blob: str, suffix: str, mtime: float) -> None:
+        self._variants.setdefault(blob, {})[suffix] = mtime
+
+    def forget_variant(self, blob: str, suffix: str) -> None:
+        self._variants.get(blob, {}).pop(suffix, None)
+
+    def refresh_blob(self, blob: str, st: os.stat_result) -> None:
+        if blob in self._blobs:
+            self._blobs[blob] = st
+
+    def quarantine(self, blob: str, reason: str) -> list[tuple[int, int]]:
+        # Blob rotto o alterato: i riferimenti vengono rimossi (i membri dovranno ricaricare l'intro)
+        # e l'mp3 spostato in quarantine/ per un'eventuale analisi, fuori dal percorso di riproduzione.
+        affected = self.references(blob)
+        for key in affected:
+            del self._refs[key]
+        self._refcount.pop(blob, None)
+        self._blobs.pop(blob, None)
+        self._sources = {key: b for key, b in self._sources.items() if b != blob}
+        try:
+            os.makedirs(self.quarantine_dir, exist_ok=True)
+            os.replace(self.blob_path(blob), os.path.join(self.quarantine_dir, f"{blob}.mp3"))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            bot_logger.error("Errore spostamento in quarantena del blob %s: %s", blob, e)
+        self._delete_blob(blob)
+        self._save()
+        bot_logger.warning("--- Blob %s in quarantena (%s): %s intro rimosse", blob[:12], reason, len(affected))
+        return affected
+
+    def remove(self, guild_id: int, user_id: int) -> bool:
+        ref = self._refs.pop((guild_id, user_id), None)
+        if ref is None:
+            return False
+        self._release(ref.blob)
+        self._save()
+        return True
+
+    def _release(self, blob: str) -> None:
+        self._refcount[blob] -= 1
+        if self._refcount[blob] > 0:
+            return
+        # Garbage collection: nessun riferimento rimasto (con lo storage condiviso la fa workers.py)
+        del self._refcount[blob]
+        self._blobs.pop(blob, None)
+        self._sources = {key: b for key, b in self._sources.items() if b != blob}
+        if not self.shared:
+            self._delete_blob(blob)
+
+    def _delete_blob(self, blob: str) -> None:
+        variants = glob.glob(os.path.join(glob.escape(self.blob_dir), f"{blob}.*.opus"))
+        for path in [self.blob_path(blob, ".mp3"), self.blob_path(blob, ".opus"), *variants]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                bot_logger.error("Errore rimozione blob %s: %s", path, e)
+        audio_meta_store.forget(self.blob_path(blob))
+        opus_frame_cache.invalidate_blob(blob)
+        self._variants.pop(blob, None)
+
+
+def fsync_file(path: str) -> None:
+    # Il contenuto deve essere su disco prima che os.replace lo renda visibile
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+async def run_index_refresh(index: IntroIndex, interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        count = await index.import_legacy()
+        if count:
+            bot_logger.info("--- Importate %s intro legacy aggiunte fuori dal bot", count)
+
+
+intro_index = IntroIndex(
+    INTRO_DIR,
+    os.path.join(DATA_DIR, "intro_refs.json"),
+    SHARED_INTRO_STORE,
+    owns_guild if SHARED_INTRO_STORE else None,
+    [os.path.join(peer, "intro_refs.json") for peer in PEER_DATA_DIRS],
+)
@@ -1,43 +1,106 @@
 # utils/logger.py
 
+import atexit
+import copy
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
-from utils.config import LOG_DIR, LOG_LEVEL
+from utils.config import BOT_LOG_FILE, ERROR_LOG_FILE, LOG_DIR, LOG_FORMAT, LOG_LEVEL, SERVICE_LOG_FILE
 
 
-def setup_logger(name: str, log_file: str, level: int = logging.DEBUG) -> logging.Logger:
+class JsonFormatter(logging.Formatter):
     """
-    Create and configure a rotating logger.
+    One JSON object per line: timestamp, level, logger name and message (traceback included).
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if record.exc_info:
+            message = f"{message}\n{self.formatException(record.exc_info)}"
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": message,
+        }
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _LoggerNameFilter(logging.Filter):
+    def __init__(self, names: tuple[str, ...]) -> None:
+        super().__init__()
+        self.names = names
 
-    Args:
-        name (str): Logger name.
-        log_file (str): File name for the log.
-        level (int): Logging level.
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.name in self.names
 
-    Returns:
-        Logger: Configured rotating logger.
+
+class _RecordQueueHandler(QueueHandler):
+    """
+    Enqueues the record itself instead of a pre-formatted copy.
+
+    The stock ``QueueHandler.prepare`` formats the record (traceback included) on the calling
+    thread. Here only the message arguments are merged, since they may change before the listener
+    runs; timestamps, tracebacks and JSON encoding are left to the listener thread.
     """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _file_handler(log_file: str) -> RotatingFileHandler:
     filepath = os.path.join(LOG_DIR, log_file)
+    # delay=True: il file viene aperto alla prima scrittura, dopo che init_runtime() ha creato LOG_DIR
+    return RotatingFileHandler(filepath, maxBytes=5 * 1024 * 1024, backupCount=3, encoding="utf-8", delay=True)
 
-    handler = RotatingFileHandler(filepath, maxBytes=5 * 1024 * 1024, backupCount=3, encoding="utf-8")
-    chandler = logging.StreamHandler()
 
-    formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
-    handler.setFormatter(formatter)
-    chandler.setFormatter(formatter)
+def setup_logging() -> QueueListener:
+    """
+    Build the file/console handlers and start the background listener that owns them.
+
+    Loggers only enqueue records (``QueueHandler``); formatting and file/console I/O happen on the
+    listener thread, so logging never blocks the event loop. Routing:
+
+    - ``bot.log``: the ``bot`` logger and discord.py's own ``discord`` logger
+    - ``services.log``: the ``services`` logger (voice path, connections)
+    - ``errors.log``: every record at ERROR or above, from any logger (``errors``, ``discord`` included)
+    - console: everything
+    """
+    formatter: logging.Formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+
+    bot_handler = _file_handler(BOT_LOG_FILE)
+    bot_handler.addFilter(_LoggerNameFilter(("bot", "discord")))
+    service_handler = _file_handler(SERVICE_LOG_FILE)
+    service_handler.addFilter(_LoggerNameFilter(("services",)))
+    error_handler = _file_handler(ERROR_LOG_FILE)
+    error_handler.setLevel(logging.ERROR)
+    console_handler = logging.StreamHandler()
+    handlers: list[logging.Handler] = [bot_handler, service_handler, error_handler, console_handler]
+    for handler in handlers:
+        handler.setFormatter(formatter)
 
-    logger = logging.getLogger(name)
-    logger.setLevel(level)
-    logger.addHandler(handler)
-    logger.addHandler(chandler)
-    logger.propagate = False  # Prevent double logging on console
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Svuota la coda prima dell'uscita del processo
+    atexit.register(listener.stop)
 
-    return logger
+    queue_handler = _RecordQueueHandler(log_queue)
+    for name, level in (("bot", LOG_LEVEL), ("services", LOG_LEVEL), ("errors", logging.ERROR), ("discord", max(LOG_LEVEL, logging.INFO))):
+        logger = logging.getLogger(name)
+        logger.setLevel(level)
+        logger.addHandler(queue_handler)
+        logger.propagate = False  # Prevent double logging on console
+    return listener
 
 
-# Loggers with rotation
-bot_logger = setup_logger("bot", "bot.log", level=LOG_LEVEL)
-service_logger = setup_logger("services", "services.log", level=LOG_LEVEL)
-error_logger = setup_logger("errors", "errors.log", level=logging.ERROR)
+listener = setup_logging()
+bot_logger = logging.getLogger("bot")
+service_logger = logging.getLogger("services")
+error_logger = logging.getLogger("errors")
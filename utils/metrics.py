@@ -0,0 +1,180 @@
+import bisect
+import sys
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from aiohttp import web
+
+from utils.logger import bot_logger
+
+LabelValues = tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+registry: list["_Metric"] = []
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        registry.append(self)
+
+    def _key(self, labels: dict[str, object]) -> LabelValues:
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: object) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: object) -> None:
+        self._values[self._key(labels)] = value
+
+    def remove(self, **labels: object) -> None:
+        self._values.pop(self._key(labels), None)
+
+    def samples(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.buckets = buckets
+        # Per label: conteggi per bucket (non cumulativi), somma, totale
+        self._values: dict[LabelValues, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        counts, totals = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0, 0.0]))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        totals[0] += value
+        totals[1] += 1
+
+    @contextmanager
+    def time(self, **labels: object) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[str]:
+        for key, (counts, totals) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {totals[0]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {int(totals[1])}"
+
+
+def process_rss_bytes() -> int | None:
+    # RSS corrente da /proc (Linux); altrove il picco da getrusage, se disponibile
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def render_metrics() -> str:
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    bot_logger.info("Endpoint metriche attivo su http://%s:%s/metrics", host, port)
+    return runner
+
+
+# --- Voice path ---
+queue_depth = Gauge("introbot_queue_depth", "Intro in attesa nella coda della guild", ("guild",))
+enqueue_to_play_seconds = Histogram("introbot_enqueue_to_play_seconds", "Attesa tra accodamento e inizio riproduzione", ("guild",))
+voice_connect_seconds = Histogram("introbot_voice_connect_seconds", "Durata dell'handshake vocale", ("guild",))
+voice_connect_retries = Counter("introbot_voice_connect_retries_total", "Tentativi di connessione vocale falliti e ripetuti", ("guild",))
+voice_connect_reuses = Counter("introbot_voice_connect_reuses_total", "Connessioni vocali riutilizzate senza handshake", ("guild",))
+playback_seconds = Histogram("introbot_playback_seconds", "Durata effettiva della riproduzione", ("guild",))
+intros_played = Counter("introbot_intros_played_total", "Intro riprodotte", ("guild",))
+intros_skipped = Counter("introbot_intros_skipped_total", "Intro non riprodotte, per motivo", ("guild", "reason"))
+intro_batch_size = Histogram("introbot_intro_batch_size", "Intro riprodotte in un'unica sequenza dopo un ingresso di gruppo", ("guild",), buckets=(1, 2, 3, 5, 8, 13, 21))
+opus_cache_bytes = Gauge("introbot_opus_cache_bytes", "Byte di frame Opus in memoria")
+opus_cache_entries = Gauge("introbot_opus_cache_entries", "Intro presenti nella cache dei frame Opus")
+opus_cache_requests = Counter("introbot_opus_cache_requests_total", "Richieste alla cache dei frame Opus, per esito", ("result",))
+opus_cache_evictions = Counter("introbot_opus_cache_evictions_total", "Intro rimosse dalla cache dei frame Opus per fare spazio")
+
+# --- Gateway ---
+shard_disconnects = Counter("introbot_shard_disconnects_total", "Disconnessioni dal gateway, per shard", ("shard",))
+
+# --- Event loop ---
+loop_lag_seconds = Histogram("introbot_loop_lag_seconds", "Ritardo dell'event loop rispetto al battito atteso", buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+loop_stalls = Counter("introbot_loop_stalls_total", "Blocchi dell'event loop oltre SLOW_CALLBACK_SECONDS (con stack campionato)")
+handler_seconds = Histogram("introbot_handler_seconds", "Durata di eventi e comandi slash", ("handler",))
+
+# --- Ingestion ---
+ingest_rejected = Counter("introbot_ingest_rejected_total", "Richieste di ingestione rifiutate dal limite di frequenza, per ambito", ("scope",))
+ingest_superseded = Counter("introbot_ingest_superseded_total", "Ingestioni annullate da una richiesta più recente dello stesso utente")
+ingest_active = Gauge("introbot_ingest_active", "Ingestioni in corso")
+ingest_queue_wait_seconds = Histogram("introbot_ingest_queue_wait_seconds", "Attesa di uno slot libero per un'ingestione")
+subprocess_seconds = Histogram("introbot_subprocess_seconds", "Durata dei processi esterni", ("tool",))
+subprocess_queue_wait_seconds = Histogram("introbot_subprocess_queue_wait_seconds", "Attesa di uno slot libero nel pool dei processi esterni", ("tool",))
+subprocess_timeouts = Counter("introbot_subprocess_timeouts_total", "Processi esterni terminati per timeout o senza slot entro il tempo massimo", ("tool",))
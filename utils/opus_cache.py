@@ -0,0 +1,186 @@
+import os
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass
+
+import discord
+from discord.oggparse import OggStream
+
+from utils import metrics
+from utils.config import OPUS_CACHE_MAX_BYTES
+from utils.logger import bot_logger
+
+# Pacchetti di intestazione Ogg/Opus: non sono audio e non vanno inviati a Discord
+_HEADER_PREFIXES = (b"OpusHead", b"OpusTags")
+# Durata di un pacchetto Opus inviato a Discord
+FRAME_SECONDS = 0.02
+
+
+def read_opus_frames(path: str) -> tuple[bytes, ...]:
+    # Bloccante: va eseguito con asyncio.to_thread
+    with open(path, "rb") as f:
+        return tuple(packet for packet in OggStream(f).iter_packets() if not packet.startswith(_HEADER_PREFIXES))
+
+
+class CachedOpusSource(discord.AudioSource):
+    """
+    Plays pre-encoded Opus packets straight from memory: no subprocess, no disk I/O.
+
+    The frames are an immutable tuple shared with the cache, so any number of guilds can play the
+    same intro at once.
+    """
+
+    def __init__(self, frames: tuple[bytes, ...]) -> None:
+        self._frames = frames
+        self._position = 0
+
+    def read(self) -> bytes:
+        if self._position >= len(self._frames):
+            return b""
+        frame = self._frames[self._position]
+        self._position += 1
+        return frame
+
+    def is_opus(self) -> bool:
+        return True
+
+
+class OpusSequenceSource(discord.AudioSource):
+    """
+    Plays several members' intros back to back as one continuous Opus stream.
+
+    Each segment is checked just before its first frame: if ``keep(member_id)`` is false (the
+    member is no longer in the channel, recorded in ``dropped``) or the member was ``skip``-ped,
+    the stream moves straight on to the next clip with no gap. ``read`` runs in the player thread;
+    ``skip``, ``current`` and ``finished`` only read the position and touch a set.
+    """
+
+    def __init__(self, segments: list[tuple[int, tuple[bytes, ...]]], keep: Callable[[int], bool]) -> None:
+        self._segments = segments
+        self.members = {member_id for member_id, _ in segments}
+        self._keep = keep
+        self._skipped: set[int] = set()
+        self._index = -1
+        self._position = 0
+        self.played: list[int] = []
+        self.dropped: list[int] = []
+
+    @property
+    def seconds(self) -> float:
+        return sum(len(frames) for _, frames in self._segments) * FRAME_SECONDS
+
+    @property
+    def current(self) -> int | None:
+        # Membro del segmento in riproduzione (None prima del primo frame e a sequenza finita)
+        if 0 <= self._index < len(self._segments):
+            member_id = self._segments[self._index][0]
+            if member_id not in self._skipped:
+                return member_id
+        return None
+
+    def finished(self, member_id: int) -> bool:
+        # Segmento già concluso, saltato o scartato: non più interrompibile
+        if member_id in self._skipped:
+            return True
+        return any(segment_member == member_id for segment_member, _ in self._segments[: max(self._index, 0)])
+
+    def skip(self, member_id: int) -> bool:
+        # Solo segmenti non ancora conclusi: quello in corso viene interrotto
+        if member_id not in self.members or self.finished(member_id):
+            return False
+        self._skipped.add(member_id)
+        return True
+
+    def read(self) -> bytes:
+        while True:
+            if 0 <= self._index < len(self._segments):
+                member_id, frames = self._segments[self._index]
+                if member_id not in self._skipped and self._position < len(frames):
+                    frame = frames[self._position]
+                    self._position += 1
+                    return frame
+            # Segmento finito o saltato: si passa al successivo senza inviare silenzio
+            self._index += 1
+            self._position = 0
+            if self._index >= len(self._segments):
+                return b""
+            member_id = self._segments[self._index][0]
+            if member_id in self._skipped:
+                continue
+            if not self._keep(member_id):
+                self._skipped.add(member_id)
+                self.dropped.append(member_id)
+                continue
+            self.played.append(member_id)
+
+    def is_opus(self) -> bool:
+        return True
+
+
+@dataclass
+class OpusCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class OpusFrameCache:
+    """
+    Memory-bounded LRU of Opus frames keyed by the path of a cached ``.opus`` file.
+
+    Paths are content-addressed (blob hash plus gain variant), so an entry only goes stale when the
+    file is rebuilt or deleted; both paths call ``invalidate``. Accessed from the event loop only.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.stats = OpusCacheStats()
+        self._entries: OrderedDict[str, tuple[tuple[bytes, ...], int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, path: str) -> tuple[bytes, ...] | None:
+        item = self._entries.get(path)
+        if item is None:
+            self.stats.misses += 1
+            metrics.opus_cache_requests.inc(result="miss")
+            return None
+        self._entries.move_to_end(path)
+        self.stats.hits += 1
+        metrics.opus_cache_requests.inc(result="hit")
+        return item[0]
+
+    def put(self, path: str, frames: tuple[bytes, ...]) -> None:
+        size = sum(len(frame) for frame in frames)
+        if size > self.max_bytes:
+            return
+        self.invalidate(path)
+        while self._entries and self.bytes + size > self.max_bytes:
+            evicted, (_, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.stats.evictions += 1
+            metrics.opus_cache_evictions.inc()
+            bot_logger.debug("--- Cache opus in memoria: rimosso %s (%s byte), rimozioni totali %s", os.path.basename(evicted), evicted_size, self.stats.evictions)
+        self._entries[path] = (frames, size)
+        self.bytes += size
+        self._update_gauges()
+
+    def invalidate(self, path: str) -> None:
+        item = self._entries.pop(path, None)
+        if item is not None:
+            self.bytes -= item[1]
+            self._update_gauges()
+
+    def invalidate_blob(self, blob: str) -> None:
+        # Tutte le varianti (copia base e varianti di volume) di un blob eliminato
+        for path in [p for p in self._entries if os.path.basename(p).startswith(f"{blob}.")]:
+            self.invalidate(path)
+
+    def _update_gauges(self) -> None:
+        metrics.opus_cache_bytes.set(self.bytes)
+        metrics.opus_cache_entries.set(len(self._entries))
+
+
+opus_frame_cache = OpusFrameCache(OPUS_CACHE_MAX_BYTES)
@@ -0,0 +1,70 @@
+import json
+import os
+
+from utils.config import DATA_DIR
+from utils.logger import bot_logger
+from utils.snapshot_writer import SnapshotWriter
+
+
+class SettingsStore:
+    """
+    Persistent per-(guild, user) intro volume and per-guild loudness ceiling.
+
+    Both are applied once when the Opus playback copy is encoded, never at playback time.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._volumes: dict[str, float] | None = None
+        self._ceilings: dict[str, float] = {}
+        self._writer = SnapshotWriter(path, self._snapshot, "impostazioni")
+
+    def _load(self) -> dict[str, float]:
+        if self._volumes is None:
+            self._volumes = {}
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    raw = json.load(f)
+                self._volumes = {key: float(v) for key, v in raw.get("volumes", {}).items()}
+                self._ceilings = {key: float(v) for key, v in raw.get("ceilings", {}).items()}
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, TypeError, AttributeError) as e:
+                bot_logger.error("Impostazioni illeggibili, verranno usati i valori di default: %s", e)
+        return self._volumes
+
+    def _save(self) -> None:
+        # Come l'indice intro: scrittura coalescente fuori dal loop (un import imposta molti volumi di fila)
+        self._writer.schedule()
+
+    def _snapshot(self) -> dict[str, dict[str, float]]:
+        return {"volumes": dict(self._load()), "ceilings": dict(self._ceilings)}
+
+    async def flush(self) -> None:
+        await self._writer.flush()
+
+    def get_volume(self, guild_id: int, user_id: int) -> float:
+        return self._load().get(f"{guild_id}:{user_id}", 1.0)
+
+    def set_volume(self, guild_id: int, user_id: int, volume: float) -> None:
+        volumes = self._load()
+        if volume == 1.0:
+            volumes.pop(f"{guild_id}:{user_id}", None)
+        else:
+            volumes[f"{guild_id}:{user_id}"] = volume
+        self._save()
+
+    def get_ceiling(self, guild_id: int) -> float | None:
+        self._load()
+        return self._ceilings.get(str(guild_id))
+
+    def set_ceiling(self, guild_id: int, ceiling_db: float | None) -> None:
+        self._load()
+        if ceiling_db is None:
+            self._ceilings.pop(str(guild_id), None)
+        else:
+            self._ceilings[str(guild_id)] = ceiling_db
+        self._save()
+
+
+settings_store = SettingsStore(os.path.join(DATA_DIR, "settings.json"))
@@ -0,0 +1,60 @@
+import asyncio
+import json
+import os
+import threading
+from collections.abc import Callable
+from typing import Any
+
+from utils.logger import bot_logger
+
+
+class SnapshotWriter:
+    """
+    Persists a JSON document off the event loop, one write at a time.
+
+    ``schedule()`` only marks the document dirty: a single background task takes a snapshot on
+    the loop (a shallow copy, so the data cannot change under the serializer) and encodes,
+    writes and fsyncs it in a thread. Saves requested while a write is in flight are coalesced
+    into the next one. Outside the loop (startup scan, worker threads) the write is synchronous.
+    """
+
+    def __init__(self, path: str, snapshot: Callable[[], Any], label: str, encode: Callable[[Any], Any] | None = None) -> None:
+        self.path = path
+        self.label = label
+        self._snapshot = snapshot
+        self._encode = encode or (lambda data: data)
+        self._dirty = False
+        self._task: asyncio.Task[None] | None = None
+        self._lock = threading.Lock()  # un solo scrittore del file .tmp, anche tra thread
+
+    def schedule(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(self._snapshot())
+            return
+        self._dirty = True
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    async def flush(self) -> None:
+        # Attende che tutte le modifiche richieste finora siano su disco
+        while self._task is not None and not self._task.done():
+            await asyncio.shield(self._task)
+
+    async def _run(self) -> None:
+        while self._dirty:
+            self._dirty = False
+            await asyncio.to_thread(self._write, self._snapshot())
+
+    def _write(self, data: Any) -> None:
+        tmp = f"{self.path}.tmp"
+        with self._lock:
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(self._encode(data), f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            except (OSError, TypeError, ValueError) as e:
+                bot_logger.error("Errore salvataggio %s: %s", self.label, e)
@@ -0,0 +1,128 @@
+import asyncio
+import heapq
+import os
+import signal
+import sys
+import time
+from dataclasses import dataclass
+
+from utils import metrics
+from utils.config import SUBPROCESS_LIMITS, SUBPROCESS_QUEUE_TIMEOUT
+from utils.logger import bot_logger
+
+# Priorità: valore più basso = servito prima. La riproduzione passa davanti all'ingestione,
+# che passa davanti ai controlli in background.
+PRIORITY_PLAYBACK = 0
+PRIORITY_INGEST = 10
+PRIORITY_BACKGROUND = 20
+
+
+@dataclass
+class ProcessResult:
+    returncode: int | None
+    stdout: bytes
+    stderr: bytes
+    timed_out: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return not self.timed_out and self.returncode == 0
+
+
+class PrioritySemaphore:
+    def __init__(self, value: int) -> None:
+        self._value = value
+        self._waiters: list[tuple[int, int, asyncio.Future[None]]] = []
+        self._seq = 0
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, fut in self._waiters if not fut.done())
+
+    async def acquire(self, priority: int) -> None:
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        self._seq += 1
+        fut: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, self._seq, fut))
+        try:
+            await fut
+        except BaseException:
+            # Slot assegnato ma richiesta annullata nel frattempo: va restituito
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._value += 1
+
+
+class SubprocessPool:
+    """
+    Central executor for ffprobe, ffmpeg and yt-dlp.
+
+    Each tool has its own concurrency limit; waiting jobs are served by priority, give up after
+    ``queue_timeout`` seconds, and the whole process group is killed on timeout or cancellation.
+    """
+
+    def __init__(self, limits: dict[str, int], queue_timeout: float) -> None:
+        self.queue_timeout = queue_timeout
+        self._slots = {tool: PrioritySemaphore(limit) for tool, limit in limits.items()}
+
+    def waiting(self, tool: str) -> int:
+        return self._slots[tool].waiting
+
+    async def run(self, tool: str, command: list[str], timeout: float, priority: int = PRIORITY_INGEST) -> ProcessResult:
+        slots = self._slots[tool]
+        queued_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(slots.acquire(priority), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            metrics.subprocess_timeouts.inc(tool=tool)
+            bot_logger.error("Nessuno slot %s libero entro %ss", tool, self.queue_timeout)
+            return ProcessResult(None, b"", b"", timed_out=True)
+        metrics.subprocess_queue_wait_seconds.observe(time.perf_counter() - queued_at, tool=tool)
+
+        try:
+            # Nuova sessione (POSIX): il process group comprende anche i figli (es. ffmpeg lanciato da yt-dlp)
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=sys.platform != "win32",
+            )
+            try:
+                with metrics.subprocess_seconds.time(tool=tool):
+                    stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+            except asyncio.TimeoutError:
+                await _kill(process)
+                metrics.subprocess_timeouts.inc(tool=tool)
+                return ProcessResult(process.returncode, b"", b"", timed_out=True)
+            except asyncio.CancelledError:
+                await _kill(process)
+                raise
+            return ProcessResult(process.returncode, stdout, stderr)
+        finally:
+            slots.release()
+
+
+async def _kill(process: asyncio.subprocess.Process) -> None:
+    if process.returncode is not None:
+        return
+    try:
+        if sys.platform != "win32":
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+    await process.wait()
+
+
+subprocess_pool = SubprocessPool(SUBPROCESS_LIMITS, SUBPROCESS_QUEUE_TIMEOUT)
@@ -0,0 +1,132 @@
+import asyncio
+import functools
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from collections.abc import Callable, Coroutine
+from dataclasses import dataclass
+from typing import Any, ParamSpec, TypeVar
+
+from utils import metrics
+from utils.config import LOOP_WATCHDOG_INTERVAL, SLOW_CALLBACK_SECONDS
+from utils.logger import bot_logger
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+
+@dataclass
+class LoopStall:
+    at: float
+    seconds: float
+    stack: str
+
+
+class LoopWatchdog:
+    """
+    Measures event-loop lag and samples the loop thread's stack when it is blocked.
+
+    A heartbeat task sleeps ``interval`` seconds and records how late it wakes up. A separate
+    thread watches the heartbeat: when it is overdue by ``threshold`` seconds the loop is stuck in
+    a synchronous call, and the thread captures the loop's current stack (once per stall) so the
+    culprit shows up in the log.
+    """
+
+    def __init__(self, interval: float, threshold: float, window: int = 1200) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self.lag_samples: deque[float] = deque(maxlen=window)
+        self.stalls: deque[LoopStall] = deque(maxlen=20)
+        self.stall_count = 0
+        self._beat = time.monotonic()
+        self._loop_thread_id: int | None = None
+        self._task: asyncio.Task[None] | None = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    def lag_percentile(self, pct: float) -> float:
+        if not self.lag_samples:
+            return 0.0
+        ordered = sorted(self.lag_samples)
+        return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+    async def _heartbeat(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - started - self.interval)
+            self._beat = now
+            self.lag_samples.append(lag)
+            metrics.loop_lag_seconds.observe(lag)
+
+    def _watch(self) -> None:
+        # Gira in un thread: legge solo _beat e lo stack del thread del loop, senza toccare il loop
+        sampled_beat: float | None = None
+        while not self._stop.wait(min(self.interval, self.threshold) / 2):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked < self.threshold or beat == sampled_beat or self._loop_thread_id is None:
+                continue
+            sampled_beat = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "n/d"
+            self.stall_count += 1
+            self.stalls.append(LoopStall(time.time(), blocked, stack))
+            metrics.loop_stalls.inc()
+            bot_logger.warning("--- Event loop bloccato da %.2fs, stack del loop:\n%s", blocked, stack)
+
+
+@dataclass
+class HandlerStats:
+    calls: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    @property
+    def avg_seconds(self) -> float:
+        return self.total_seconds / self.calls if self.calls else 0.0
+
+
+handler_stats: dict[str, HandlerStats] = {}
+
+
+def record_handler(name: str, seconds: float) -> None:
+    stats = handler_stats.setdefault(name, HandlerStats())
+    stats.calls += 1
+    stats.total_seconds += seconds
+    stats.max_seconds = max(stats.max_seconds, seconds)
+    metrics.handler_seconds.observe(seconds, handler=name)
+    if seconds >= SLOW_CALLBACK_SECONDS:
+        bot_logger.warning("--- %s lento: %.3fs", name, seconds)
+
+
+def timed(name: str) -> Callable[[Callable[P, Coroutine[Any, Any, R]]], Callable[P, Coroutine[Any, Any, R]]]:
+    # Misura la durata di un handler asincrono (evento o comando) e la registra in handler_stats
+    def decorator(func: Callable[P, Coroutine[Any, Any, R]]) -> Callable[P, Coroutine[Any, Any, R]]:
+        @functools.wraps(func)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                record_handler(name, time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+loop_watchdog = LoopWatchdog(LOOP_WATCHDOG_INTERVAL, SLOW_CALLBACK_SECONDS)
@@ -0,0 +1,346 @@
+"""
+Multi-process launcher.
+
+Starts ``introbot.py`` as several worker processes on one host, each owning a contiguous range of
+gateway shards together with the voice connections of those guilds, and supervises them:
+a worker that exits with an error is restarted with exponential backoff, SIGINT/SIGTERM are
+forwarded to every worker.
+
+Voice connections are negotiated over the gateway session of the shard that owns the guild, so
+they cannot be handed to a process that is not connected to that shard: the unit of work given
+to a worker is therefore a shard range, not a single play job.
+
+Each worker keeps its own intro index and settings, but all workers share one blob store, so a
+clip or YouTube source stored by one worker is reused by the others. Before starting the workers
+the launcher moves each guild's data to the worker that now owns it (from the previous layout's
+worker directories, or from a single-process install) and deletes blobs no worker references.
+
+Usage (from the repository root):
+
+    python workers.py --workers 4 --shards 8
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from types import FrameType
+from typing import Any
+
+from utils.config import DATA_DIR, INTRO_DIR, LOG_DIR, METRICS_PORT, WORKER_LAYOUT_FILE, WORKERS_LAYOUT_FILE, guild_shard, init_runtime, require_token
+from utils.data_lock import data_dir_lock
+from utils.logger import bot_logger
+
+MAX_BACKOFF_SECONDS = 60.0
+# Un worker rimasto attivo almeno così a lungo riparte da backoff minimo
+STABLE_SECONDS = 300.0
+
+
+@dataclass
+class Worker:
+    index: int
+    shard_ids: list[int]
+    shard_count: int
+    env: dict[str, str]
+    process: subprocess.Popen[bytes] | None = None
+    restarts: int = 0
+    restart_at: float = 0.0
+    started_at: float = 0.0
+
+    @property
+    def label(self) -> str:
+        return f"shard-{self.shard_ids[0]}-{self.shard_ids[-1]}-of-{self.shard_count}"
+
+
+def split_shards(shard_count: int, workers: int) -> list[list[int]]:
+    # Intervalli contigui e bilanciati: i primi worker prendono uno shard in più se la divisione non è esatta
+    base, extra = divmod(shard_count, workers)
+    ranges: list[list[int]] = []
+    start = 0
+    for index in range(workers):
+        size = base + (1 if index < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return [r for r in ranges if r]
+
+
+def build_workers(shard_count: int, workers: int) -> list[Worker]:
+    result: list[Worker] = []
+    for index, shard_ids in enumerate(split_shards(shard_count, workers)):
+        worker = Worker(index, shard_ids, shard_count, {})
+        # Indice, impostazioni e log separati per worker (file a scrittore singolo); i blob stanno nello
+        # storage condiviso INTRO_DIR (write_layout). Il nome dipende dagli shard: a ogni cambio di
+        # --shards/--workers i dati vengono migrati dalle directory della ripartizione precedente.
+        env = dict(os.environ)
+        env.update(
+            SHARD_COUNT=str(shard_count),
+            SHARD_IDS=f"{shard_ids[0]}-{shard_ids[-1]}",
+            DATA_DIR=os.path.join(DATA_DIR, worker.label),
+            LOG_DIR=os.path.join(LOG_DIR, worker.label),
+            PYTHONUNBUFFERED="1",
+        )
+        # La sync dei comandi è globale per l'applicazione: basta un solo worker
+        if index > 0:
+            env["SYNC_COMMANDS"] = "0"
+        if METRICS_PORT > 0:
+            env["METRICS_PORT"] = str(METRICS_PORT + index)
+        worker.env = env
+        result.append(worker)
+    return result
+
+
+REFS_FILE = "intro_refs.json"
+# Stato per processo: indice, impostazioni e metadati audio (i blob stanno nello storage condiviso)
+STATE_FILES = (REFS_FILE, "settings.json", "audio_meta.json")
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    # Hard link: i blob non occupano altro spazio e conservano l'inode (metadati audio validi)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.exists(dst):
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _write_json(path: str, data: object) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _read_json(path: str) -> dict[str, Any]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return dict(json.load(f))
+    except FileNotFoundError:
+        return {}
+
+
+def migration_sources(workers: list[Worker]) -> list[str]:
+    # Directory dati da cui migrare: quelle dei worker di una ripartizione precedente (altro --shards
+    # o --workers), altrimenti la DATA_DIR del bot a processo singolo
+    current = {worker.env["DATA_DIR"] for worker in workers}
+    previous = sorted(path for path in glob.glob(os.path.join(glob.escape(DATA_DIR), "shard-*")) if path not in current and os.path.exists(os.path.join(path, REFS_FILE)))
+    if previous:
+        return previous
+    return [DATA_DIR] if any(os.path.exists(os.path.join(DATA_DIR, name)) for name in STATE_FILES) else []
+
+
+def migrate_worker(worker: Worker, sources: list[str]) -> int | None:
+    # Unisce dalle sorgenti riferimenti, sorgenti YouTube, volumi, tetti e metadati audio delle guild
+    # degli shard del worker. intro_refs.json viene scritto per ultimo e segna la migrazione come completata.
+    # Ritorna le intro migrate, None se una sorgente è illeggibile (il worker non va avviato).
+    data_dir = worker.env["DATA_DIR"]
+    shared_blob_dir = os.path.join(INTRO_DIR, "blobs")
+    owned = set(worker.shard_ids)
+
+    def owns(key: str) -> bool:
+        return guild_shard(int(key.split(":")[0]), worker.shard_count) in owned
+
+    refs: dict[str, dict[str, Any]] = {}
+    sources_map: dict[str, str] = {}
+    volumes: dict[str, float] = {}
+    ceilings: dict[str, float] = {}
+    meta: dict[str, Any] = {}
+    try:
+        loaded: list[tuple[str, dict[str, Any], dict[str, Any], dict[str, Any]]] = []
+        for source in sources:
+            index, settings, audio_meta = (_read_json(os.path.join(source, name)) for name in STATE_FILES)
+            loaded.append((source, index, settings, audio_meta))
+        for _, index, settings, _ in loaded:
+            for key, ref in index.get("refs", {}).items():
+                # Stesso membro in più sorgenti (indice rimasto da una ripartizione vecchia): vince il più recente
+                if owns(key) and (key not in refs or ref["created"] > refs[key]["created"]):
+                    refs[key] = ref
+            volumes.update({key: v for key, v in settings.get("volumes", {}).items() if owns(key)})
+            ceilings.update({key: v for key, v in settings.get("ceilings", {}).items() if owns(key)})
+        blobs = {str(ref["blob"]) for ref in refs.values()}
+        for source, index, _, audio_meta in loaded:
+            sources_map.update({key: blob for key, blob in index.get("sources", {}).items() if blob in blobs})
+            # Layout precedente con una directory intro per worker: i blob passano nello storage condiviso
+            source_blob_dir = os.path.join(source, "intros", "blobs")
+            if source != DATA_DIR and os.path.isdir(source_blob_dir):
+                for blob in blobs:
+                    for path in glob.glob(os.path.join(glob.escape(source_blob_dir), f"{blob}.*")):
+                        if ".tmp" not in path:
+                            _link_or_copy(path, os.path.join(shared_blob_dir, os.path.basename(path)))
+            for path, value in audio_meta.items():
+                name = os.path.basename(path)
+                if os.path.dirname(path) in (shared_blob_dir, source_blob_dir) and name.split(".")[0] in blobs:
+                    meta[os.path.join(shared_blob_dir, name)] = value
+        os.makedirs(data_dir, exist_ok=True)
+        _write_json(os.path.join(data_dir, "settings.json"), {"volumes": volumes, "ceilings": ceilings})
+        _write_json(os.path.join(data_dir, "audio_meta.json"), meta)
+        _write_json(os.path.join(data_dir, REFS_FILE), {"refs": refs, "sources": sources_map})
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        bot_logger.error("Errore migrazione dei dati per il worker %s: %s", worker.label, e)
+        return None
+    bot_logger.info("--- Worker %s: migrate %s intro da %s", worker.label, len(refs), ", ".join(sources))
+    return len(refs)
+
+
+def retire(sources: list[str]) -> None:
+    # Dopo la migrazione le vecchie copie non vanno più lette né devono tenere in vita blob
+    retired = os.path.join(DATA_DIR, "retired")
+    stamp = int(time.time())
+    for source in sources:
+        if source == DATA_DIR:
+            dst = os.path.join(retired, f"single-process-{stamp}")
+            os.makedirs(dst, exist_ok=True)
+            for name in STATE_FILES:
+                if os.path.exists(os.path.join(source, name)):
+                    os.replace(os.path.join(source, name), os.path.join(dst, name))
+        else:
+            dst = os.path.join(retired, f"{os.path.basename(source)}-{stamp}")
+            os.makedirs(retired, exist_ok=True)
+            os.replace(source, dst)
+        bot_logger.info("--- Dati migrati spostati in %s (eliminabile dopo una verifica)", dst)
+
+
+def write_layout(workers: list[Worker]) -> None:
+    # worker.json viene letto da config.py nel processo del worker (e da cli.py puntato su di esso)
+    dirs = [worker.env["DATA_DIR"] for worker in workers]
+    for worker in workers:
+        data_dir = worker.env["DATA_DIR"]
+        os.makedirs(data_dir, exist_ok=True)
+        layout = {"intro_dir": INTRO_DIR, "shard_count": worker.shard_count, "shard_ids": worker.env["SHARD_IDS"], "peers": [d for d in dirs if d != data_dir]}
+        _write_json(os.path.join(data_dir, WORKER_LAYOUT_FILE), layout)
+    _write_json(os.path.join(DATA_DIR, WORKERS_LAYOUT_FILE), {"shard_count": workers[0].shard_count, "workers": [w.label for w in workers]})
+
+
+def collect_shared_store(workers: list[Worker]) -> int | None:
+    # Bloccante, con i worker fermi: rimuove i file temporanei dello storage condiviso e i blob (con
+    # copie opus e varianti) che nessun indice referenzia. Se un indice manca, è illeggibile o è stato
+    # messo da parte come danneggiato non si rimuove nessun blob. Ritorna i file rimossi, None se saltata.
+    blob_dir = os.path.join(INTRO_DIR, "blobs")
+    for directory in (INTRO_DIR, blob_dir):
+        for path in glob.glob(os.path.join(glob.escape(directory), "*.tmp*")):
+            if os.path.isfile(path):
+                os.remove(path)
+    if not os.path.isdir(blob_dir):
+        return 0
+    index_paths = sorted({os.path.join(w.env["DATA_DIR"], REFS_FILE) for w in workers} | set(glob.glob(os.path.join(glob.escape(DATA_DIR), "shard-*", REFS_FILE))))
+    referenced: set[str] = set()
+    for refs_path in index_paths:
+        if not os.path.exists(refs_path) or glob.glob(f"{glob.escape(refs_path)}.corrupt-*"):
+            bot_logger.warning("--- Indice %s mancante o danneggiato: rimozione dei blob non referenziati saltata", refs_path)
+            return None
+        try:
+            referenced.update(str(ref["blob"]) for ref in _read_json(refs_path).get("refs", {}).values())
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            bot_logger.warning("--- Indice %s illeggibile, rimozione dei blob non referenziati saltata: %s", refs_path, e)
+            return None
+    removed = 0
+    with os.scandir(blob_dir) as it:
+        for item in it:
+            if item.is_file() and item.name.split(".")[0] not in referenced:
+                os.remove(item.path)
+                removed += 1
+    if removed:
+        bot_logger.info("--- Storage condiviso: rimossi %s file di blob non più referenziati", removed)
+    return removed
+
+
+def start(worker: Worker) -> None:
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "introbot.py")
+    worker.process = subprocess.Popen([sys.executable, script], env=worker.env)
+    worker.started_at = time.monotonic()
+    bot_logger.info("--- Worker %s avviato (pid %s, shard %s di %s)", worker.label, worker.process.pid, worker.env["SHARD_IDS"], worker.env["SHARD_COUNT"])
+
+
+def supervise(workers: list[Worker]) -> int:
+    stopping = False
+
+    def request_stop(signum: int, frame: FrameType | None) -> None:
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    for worker in workers:
+        start(worker)
+
+    while not stopping:
+        time.sleep(1)
+        now = time.monotonic()
+        for worker in workers:
+            if worker.process is None:
+                if now >= worker.restart_at:
+                    start(worker)
+                continue
+            code = worker.process.poll()
+            if code is None:
+                continue
+            worker.process = None
+            if code == 0:
+                bot_logger.info("--- Worker %s terminato normalmente", worker.label)
+                worker.restart_at = float("inf")
+                continue
+            if now - worker.started_at >= STABLE_SECONDS:
+                worker.restarts = 0
+            worker.restarts += 1
+            backoff = min(MAX_BACKOFF_SECONDS, 2.0 ** min(worker.restarts, 6))
+            worker.restart_at = now + backoff
+            bot_logger.error("--- Worker %s uscito con codice %s, riavvio tra %.0fs (riavvii: %s)", worker.label, code, backoff, worker.restarts)
+        if all(w.process is None and w.restart_at == float("inf") for w in workers):
+            return 0
+
+    bot_logger.info("--- Arresto dei worker...")
+    running = [w.process for w in workers if w.process is not None]
+    for process in running:
+        process.terminate()
+    for process in running:
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Avvia IntroBot come più processi, ognuno con un intervallo di shard")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processi worker (default: numero di core)")
+    parser.add_argument("--shards", type=int, default=0, help="shard totali (default: uno per worker)")
+    args = parser.parse_args(argv)
+
+    if args.workers < 1:
+        parser.error("--workers deve essere almeno 1")
+    shard_count = args.shards or args.workers
+    if shard_count < args.workers:
+        parser.error("--shards non può essere minore di --workers")
+    require_token()
+    init_runtime()
+    # La DATA_DIR di base resta bloccata finché i worker girano: né il bot a processo singolo né cli.py la usano
+    if not data_dir_lock.acquire():
+        bot_logger.error("Un altro processo sta usando %s: avvio dei worker annullato", DATA_DIR)
+        return 1
+    workers = build_workers(shard_count, args.workers)
+    sources = migration_sources(workers)
+    pending = [w for w in workers if not os.path.exists(os.path.join(w.env["DATA_DIR"], REFS_FILE))]
+    if sources and pending:
+        for worker in pending:
+            if migrate_worker(worker, sources) is None:
+                return 1
+        retire(sources)
+    elif sources:
+        bot_logger.warning("--- Directory dati di worker non più in uso: %s (i loro blob vengono conservati)", ", ".join(sources))
+    write_layout(workers)
+    collect_shared_store(workers)
+    return supervise(workers)
+
+
+if __name__ == "__main__":
+    sys.exit(main())